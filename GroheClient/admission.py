@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import contextlib
+from typing import Optional
+
+from GroheClient.metrics import GaugeFunction
+from settings import get_setting as _
+
+# the maximum number of tap requests executed at once, 0 disables the admission control
+MAX_CONCURRENT = int(_("ADMISSION/MAX_CONCURRENT", 8))
+# the maximum number of tap requests waiting for a free slot, further requests are rejected at once
+MAX_QUEUE = int(_("ADMISSION/MAX_QUEUE", 32))
+# the number of seconds a tap request may wait for a free slot, afterwards it is rejected instead of running late
+QUEUE_TIMEOUT = float(_("ADMISSION/QUEUE_TIMEOUT", 2.0))
+
+REASON_QUEUE_FULL = 'queue_full'
+REASON_DEADLINE = 'deadline'
+
+
+class AdmissionRejectedError(Exception):
+    """
+    Raised if a request is shed because the API is overloaded.
+    """
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__('The API is overloaded. Try again later.')
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits the number of requests executed at once. Requests exceeding the limit wait in a bounded FIFO queue,
+    a request is rejected if the queue is full or it could not start within its deadline.
+    So during a slowdown of the Grohe cloud, requests fail fast instead of dispensing water long after they were sent.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, max_queue: int = MAX_QUEUE,
+                 queue_timeout: float = QUEUE_TIMEOUT):
+        """
+        Args:
+            max_concurrent: The maximum number of requests executed at once, 0 disables the limit.
+            max_queue: The maximum number of waiting requests.
+            queue_timeout: The default number of seconds a request may wait.
+
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = collections.deque()
+        self.stats = {
+            'admitted'  : 0,
+            'queued'    : 0,
+            'queue_full': 0,
+            'deadline'  : 0,
+        }
+
+    async def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Wait for a free slot.
+        Args:
+            timeout: The number of seconds to wait, the default queue timeout if None.
+
+        Raises: AdmissionRejectedError if the queue is full or no slot became free within the timeout.
+
+        """
+        if self.max_concurrent <= 0:
+            return
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.stats['admitted'] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self.reject(REASON_QUEUE_FULL)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats['queued'] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                raise self.reject(REASON_DEADLINE)
+        except asyncio.CancelledError:
+            # the slot was handed over just before the request was cancelled
+            if waiter.done():
+                self.release()
+            raise
+        finally:
+            if not waiter.done():
+                waiter.cancel()
+                self._waiters.remove(waiter)
+        self.stats['admitted'] += 1
+
+    def reject(self, reason: str) -> AdmissionRejectedError:
+        """
+        Count a shed request.
+        Args:
+            reason: Why the request is shed, REASON_QUEUE_FULL or REASON_DEADLINE.
+
+        Returns: The error to raise.
+
+        """
+        self.stats[reason] += 1
+        return AdmissionRejectedError(reason, self.queue_timeout)
+
+    def release(self) -> None:
+        """
+        Free the slot of a finished request, it is handed over to the longest waiting request.
+
+        """
+        if self.max_concurrent <= 0:
+            return
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @contextlib.asynccontextmanager
+    async def admit(self, timeout: Optional[float] = None):
+        """
+        Hold a slot while the request is executed.
+
+        Raises: AdmissionRejectedError if the request is shed.
+
+        See Also: acquire
+
+        """
+        await self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_queue_length(self) -> int:
+        return len(self._waiters)
+
+    def get_status(self) -> dict:
+        """
+        Returns: The number of running and waiting requests and the counters of admitted and shed requests.
+
+        """
+        return dict(self.stats, active=self.active, waiting=len(self._waiters))
+
+
+admission_controller = AdmissionController()
+
+GaugeFunction('grohe_admission_active_requests', 'Number of tap requests being executed.',
+              lambda: {(): admission_controller.active})
+GaugeFunction('grohe_admission_queue_length', 'Number of tap requests waiting for a free slot.',
+              lambda: {(): admission_controller.get_queue_length()})
+GaugeFunction('grohe_admission_events_total', 'Admitted and queued tap requests and requests shed because the queue '
+                                              'was full or they could not start within their deadline.',
+              lambda: {(name,): value for name, value in admission_controller.stats.items()},
+              label_names=('event',), metric_type='counter')
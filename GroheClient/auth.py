@@ -0,0 +1,143 @@
+import hashlib
+import hmac
+import logging
+import threading
+from typing import Optional
+
+from GroheClient.rate_limit import KEY_BURST, KEY_RATE, TokenBucket
+from settings import get_setting as _
+
+# executing tap commands, queueing and cancelling jobs
+PERMISSION_TAP = 'tap'
+# reading the devices and the jobs
+PERMISSION_READ = 'read'
+ALL_PERMISSIONS = frozenset((PERMISSION_TAP, PERMISSION_READ))
+
+
+def hash_key(key: str) -> str:
+    """
+    Args:
+        key: The API key.
+
+    Returns: The hex encoded SHA-256 hash of the key, as stored in the KEY_SHA256 setting.
+
+    """
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def parse_permissions(permissions) -> frozenset:
+    """
+    Args:
+        permissions: The PERMISSIONS of an API key in the settings, a list of permissions or a single permission.
+
+    Returns: The permissions.
+    Raises: ValueError if a permission is unknown.
+
+    """
+    if isinstance(permissions, str):
+        permissions = [permissions]
+    unknown = [permission for permission in permissions if permission not in ALL_PERMISSIONS]
+    if unknown:
+        raise ValueError(f'Unknown permissions {unknown}, expected some of {sorted(ALL_PERMISSIONS)}')
+    return frozenset(permissions)
+
+
+class ApiKey:
+    """
+    A named API key with its permissions and its rate limit.
+    """
+
+    def __init__(self, name: str, key_hash: str, permissions: frozenset = ALL_PERMISSIONS, rate: float = KEY_RATE,
+                 burst: float = KEY_BURST):
+        """
+        Args:
+            name: The name of the key, used in the logs.
+            key_hash: The SHA-256 hash of the key.
+            permissions: The permissions of the key.
+            rate: The number of tap requests per second, 0 disables the limit.
+            burst: The number of tap requests which may be sent at once.
+
+        """
+        self.name = name
+        self.key_hash = key_hash.lower()
+        self.permissions = permissions
+        self.bucket = TokenBucket(rate, burst)
+
+    def __repr__(self):
+        return f"ApiKey({self.name})"
+
+    def has_permission(self, permission: str) -> bool:
+        return permission in self.permissions
+
+
+class ApiKeyStore:
+    """
+    The API keys accepted by the API.
+
+    The keys are configured in the KEYS list of the API section, each with a NAME, the SHA-256 hash of the key
+    as KEY_SHA256, and optionally its PERMISSIONS, RATE and BURST. The single API_KEY setting is still supported,
+    it has all permissions. The keys are reloaded when the settings change.
+    """
+
+    def __init__(self):
+        self._source = None
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _load(self, api_settings: Optional[dict]) -> dict:
+        api_settings = api_settings or {}
+        api_keys = []
+        if api_settings.get('API_KEY'):
+            api_keys.append(ApiKey('default', hash_key(api_settings['API_KEY'])))
+        for key in api_settings.get('KEYS', []):
+            try:
+                api_keys.append(ApiKey(key['NAME'], key['KEY_SHA256'],
+                                       parse_permissions(key.get('PERMISSIONS', ALL_PERMISSIONS)),
+                                       float(key.get('RATE', KEY_RATE)), float(key.get('BURST', KEY_BURST))))
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(f'Invalid API key {key.get("NAME")} in the settings: {e}')
+
+        keys = {}
+        for api_key in api_keys:
+            previous = self._keys.get(api_key.key_hash)
+            if previous is not None and (previous.bucket.rate, previous.bucket.burst) == (api_key.bucket.rate,
+                                                                                         api_key.bucket.burst):
+                # keep the used up tokens of the key when the settings are reloaded
+                api_key.bucket = previous.bucket
+            keys[api_key.key_hash] = api_key
+        return keys
+
+    def get_keys(self) -> dict:
+        """
+        Returns: A dict from the key hashes to the API keys.
+
+        """
+        api_settings = _("API", None)
+        # the settings are replaced when they are reloaded, so the keys are only parsed again after a change
+        if api_settings is not self._source:
+            with self._lock:
+                if api_settings is not self._source:
+                    self._keys = self._load(api_settings)
+                    self._source = api_settings
+        return self._keys
+
+    def authenticate(self, key: Optional[str]) -> Optional[ApiKey]:
+        """
+        Find the API key matching the given key. Only the hash of the key is looked up and compared
+        in constant time, so the time of the check reveals nothing about the configured keys.
+        Args:
+            key: The key sent with the request.
+
+        Returns: The API key or None if the key is invalid.
+
+        """
+        if not key:
+            return None
+        key_hash = hash_key(key)
+        api_key = self.get_keys().get(key_hash)
+        if api_key is None or not hmac.compare_digest(api_key.key_hash, key_hash):
+            return None
+        return api_key
+
+
+api_key_store = ApiKeyStore()
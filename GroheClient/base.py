@@ -1,9 +1,374 @@
+import asyncio
 import logging
+import threading
 from datetime import datetime, timedelta
+from typing import Optional
 
+from GroheClient.events import TOKEN_REFRESH_FAILED, TOKEN_REFRESHED, event_bus
+from GroheClient.metrics import GaugeFunction
+from GroheClient.token_cache import load_tokens, save_tokens, token_lock
 from GroheClient.tokens import get_refresh_tokens, get_tokens_from_credentials
 from settings import get_setting as _
 
+# refresh the tokens this many seconds before the access token expires
+REFRESH_AHEAD = float(_("TOKENS/REFRESH_AHEAD", 300.0))
+# wait this many seconds before retrying a failed background refresh
+REFRESH_RETRY_INTERVAL = float(_("TOKENS/REFRESH_RETRY_INTERVAL", 30.0))
+# the background thread refreshes the tokens at most once in this many seconds, even if they expire sooner
+MIN_REFRESH_INTERVAL = float(_("TOKENS/MIN_REFRESH_INTERVAL", 30.0))
+# wait this many seconds before retrying a failed login
+LOGIN_RETRY_INTERVAL = float(_("TOKENS/LOGIN_RETRY_INTERVAL", 60.0))
+# requests wait this many seconds for the initial login before they fail
+LOGIN_WAIT_TIMEOUT = float(_("TOKENS/LOGIN_WAIT_TIMEOUT", 30.0))
+
+
+class TokensNotReadyError(Exception):
+    """
+    Raised if no tokens are available, because the initial login did not finish yet or failed.
+    """
+
+
+class TokenManager:
+    """
+    Holds the current access and refresh tokens and keeps them valid.
+
+    Nothing happens until start is called, which logs in and then keeps refreshing the tokens in a background thread.
+    Concurrent refreshes are collapsed into a single request to the token endpoint, both across threads and
+    across asyncio tasks, because every refresh invalidates the previous refresh token.
+    A background thread refreshes the tokens before they expire, so requests usually never wait for a refresh.
+
+    Several worker processes share the tokens through the token cache: the login and every refresh hold a file lock,
+    and a worker first checks whether another worker already stored newer tokens before it refreshes itself.
+    """
+
+    def __init__(self):
+        self.access_token = None
+        self.refresh_token = None
+        self.access_token_expiring_date = datetime.min
+        self.tokens_received_at = None
+        self._refresh_lock = threading.Lock()
+        self._async_refresh_task = None
+        self._stop_event = threading.Event()
+        self._refresh_thread = None
+        self._ready_event = threading.Event()
+        self.login_error = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'refreshes'       : 0,
+            'refresh_waits'   : 0,
+            'refresh_failures': 0,
+            'shared_tokens'   : 0,
+            'relogins'        : 0,
+        }
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def set_tokens(self, tokens: dict) -> None:
+        """
+        Store the given tokens as the current tokens.
+        Args:
+            tokens: A dict with the tokens.
+
+        """
+        self.access_token = tokens['access_token']
+        self.refresh_token = tokens['refresh_token']
+        self.access_token_expiring_date = datetime.now() + timedelta(seconds=tokens['access_token_expires_in'] - 60)
+        self.tokens_received_at = datetime.now()
+
+    def get_stats(self) -> dict:
+        """
+        Returns: A copy of the refresh counters and the seconds until the access token expires.
+
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats['access_token_expires_in'] = (self.access_token_expiring_date - datetime.now()).total_seconds()
+        return stats
+
+    def is_ready(self) -> bool:
+        """
+        Returns: True once the initial login finished, False otherwise.
+
+        """
+        return self._ready_event.is_set()
+
+    def wait_until_ready(self, timeout: float = LOGIN_WAIT_TIMEOUT) -> None:
+        """
+        Wait for the initial login to finish.
+        Args:
+            timeout: The maximum number of seconds to wait.
+
+        Raises: TokensNotReadyError if the login did not finish within the timeout.
+
+        """
+        if self._ready_event.wait(timeout):
+            return
+        if self.login_error is not None:
+            raise TokensNotReadyError(f'The login to the Grohe cloud failed: {self.login_error}')
+        raise TokensNotReadyError('The login to the Grohe cloud did not finish yet.')
+
+    def get_status(self) -> str:
+        """
+        Returns: The login status: "ready" once the login finished, "failed" if the last login attempt failed,
+                 "starting" otherwise.
+
+        """
+        if self.is_ready():
+            return 'ready'
+        if self.login_error is not None:
+            return 'failed'
+        return 'starting'
+
+    def is_expired(self) -> bool:
+        """
+        Returns: True if the access token is expired, False otherwise.
+
+        """
+        return datetime.now() > self.access_token_expiring_date
+
+    def refresh(self, stale_access_token: Optional[str] = None) -> None:
+        """
+        Refresh the tokens. If another thread is already refreshing, wait for it instead of refreshing again.
+        Args:
+            stale_access_token: The access token the caller considers invalid. If the tokens were refreshed
+                                in the meantime, no additional refresh is done.
+
+        Raises: An exception if the refresh failed.
+
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            self._count('refresh_waits')
+            self._refresh_lock.acquire()
+        try:
+            # another caller refreshed the tokens while we were waiting for the lock
+            if stale_access_token is not None and stale_access_token != self.access_token:
+                return
+
+            with token_lock():
+                # another worker process refreshed the tokens
+                if self.use_shared_tokens():
+                    return
+
+                logging.info("Refreshing tokens")
+                try:
+                    tokens = get_refresh_tokens(self.refresh_token)
+                except Exception as e:
+                    self._count('refresh_failures')
+                    event_bus.publish(TOKEN_REFRESH_FAILED, {'error': type(e).__name__})
+                    raise
+                self.set_tokens(tokens)
+                save_tokens(tokens)
+                self._count('refreshes')
+                self.publish_refreshed(shared=False)
+        finally:
+            self._refresh_lock.release()
+
+    def use_shared_tokens(self) -> bool:
+        """
+        Use the tokens from the token cache if they are newer than the current tokens,
+        because another worker process refreshed them.
+        Returns: True if the cached tokens are used, False otherwise.
+
+        """
+        tokens = load_tokens()
+        if tokens is None or tokens['access_token'] == self.access_token:
+            return False
+        expiring_date = datetime.now() + timedelta(seconds=tokens['access_token_expires_in'] - 60)
+        if expiring_date <= max(self.access_token_expiring_date, datetime.now()):
+            return False
+        logging.info("Using the tokens refreshed by another worker")
+        self.set_tokens(tokens)
+        self._count('shared_tokens')
+        self.publish_refreshed(shared=True)
+        return True
+
+    def publish_refreshed(self, shared: bool) -> None:
+        """
+        Publish a token refresh event. The tokens themselves are never published.
+        Args:
+            shared: Whether the tokens were refreshed by another worker process.
+
+        """
+        event_bus.publish(TOKEN_REFRESHED, {'expiring_date': self.access_token_expiring_date.isoformat(),
+                                            'shared'       : shared})
+
+    async def async_refresh(self, stale_access_token: Optional[str] = None) -> None:
+        """
+        Async version of refresh. Concurrent tasks share one refresh, which runs in a worker thread,
+        so the event loop is never blocked.
+
+        See Also: refresh
+
+        """
+        task = self._async_refresh_task
+        if task is not None and not task.done():
+            self._count('refresh_waits')
+        else:
+            task = asyncio.ensure_future(asyncio.to_thread(self.refresh, stale_access_token))
+            self._async_refresh_task = task
+        await asyncio.shield(task)
+
+    def get_access_token(self) -> str:
+        """
+        Get the access token. Refresh the tokens if they are expired.
+        Returns: The access token.
+
+        """
+        if not self.is_ready():
+            self.start()
+            self.wait_until_ready()
+        access_token = self.access_token
+        if self.is_expired():
+            self.refresh(access_token)
+        return self.access_token
+
+    async def async_get_access_token(self) -> str:
+        """
+        Async version of get_access_token.
+
+        See Also: get_access_token
+
+        """
+        if not self.is_ready():
+            self.start()
+            await asyncio.to_thread(self.wait_until_ready)
+        access_token = self.access_token
+        if self.is_expired():
+            await self.async_refresh(access_token)
+        return self.access_token
+
+    def restore_cached_tokens(self) -> bool:
+        """
+        Restore the tokens from the token cache. A still valid access token is used as it is,
+        otherwise the cached refresh token is exchanged for new tokens.
+        Returns: True if valid tokens were restored, False otherwise.
+
+        """
+        tokens = load_tokens()
+        if tokens is None:
+            return False
+
+        if tokens['access_token_expires_in'] > REFRESH_AHEAD + 60:
+            logging.info("Using the cached access token")
+            self.set_tokens(tokens)
+            return True
+
+        if tokens['refresh_token_expires_in'] > 60:
+            logging.info("Refreshing the cached tokens")
+            try:
+                tokens = get_refresh_tokens(tokens['refresh_token'])
+            except Exception as e:
+                logging.warning(f'Could not refresh the cached tokens: {e}')
+                return False
+            self.set_tokens(tokens)
+            save_tokens(tokens)
+            self._count('refreshes')
+            return True
+
+        return False
+
+    def login(self) -> None:
+        """
+        Get the initial tokens. The token cache is tried first,
+        the login with the credentials from the settings is only done if there are no usable cached tokens.
+        Only one worker process logs in at a time.
+
+        Raises: An exception if the login failed.
+
+        """
+        try:
+            # the other workers wait for the login of the first one and then restore its tokens from the cache
+            with token_lock():
+                if not self.restore_cached_tokens():
+                    tokens = get_initial_tokens()
+                    self.set_tokens(tokens)
+                    save_tokens(tokens)
+        except Exception as e:
+            self.login_error = e
+            raise
+        self.login_error = None
+        self._ready_event.set()
+
+    def relogin(self) -> None:
+        """
+        Replace the tokens with new ones from a login with the credentials from the settings,
+        e.g. because the refresh token was rejected. No refresh runs while logging in.
+
+        Raises: An exception if the login failed.
+
+        """
+        with self._refresh_lock:
+            with token_lock():
+                # another worker process got new tokens
+                if self.use_shared_tokens():
+                    return
+
+                logging.info("Logging in again with the credentials")
+                tokens = get_initial_tokens()
+                self.set_tokens(tokens)
+                save_tokens(tokens)
+                self._count('relogins')
+                self.publish_refreshed(shared=False)
+
+    def get_refresh_delay(self) -> float:
+        """
+        Returns: The seconds until the background thread refreshes the tokens. It waits at least
+            MIN_REFRESH_INTERVAL seconds after the tokens were received, so it never spins if the tokens expire
+            within REFRESH_AHEAD seconds.
+
+        """
+        now = datetime.now()
+        refresh_at = self.access_token_expiring_date - timedelta(seconds=REFRESH_AHEAD)
+        if self.tokens_received_at is not None:
+            refresh_at = max(refresh_at, self.tokens_received_at + timedelta(seconds=MIN_REFRESH_INTERVAL))
+        return max((refresh_at - now).total_seconds(), 0)
+
+    def start(self) -> None:
+        """
+        Start the background thread which logs in and then refreshes the tokens before they expire.
+        Calling this more than once has no effect.
+
+        """
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._refresh_thread = threading.Thread(target=self._run, name='token-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread.
+
+        """
+        self._stop_event.set()
+
+    def _run(self) -> None:
+        while not self.is_ready():
+            try:
+                self.login()
+            except Exception as e:
+                logging.error("Could not get initial tokens: {}".format(e))
+                if self._stop_event.wait(LOGIN_RETRY_INTERVAL):
+                    return
+
+        while True:
+            if self._stop_event.wait(self.get_refresh_delay()):
+                return
+            try:
+                self.refresh(self.access_token)
+                continue
+            except Exception as e:
+                logging.error(f'Background token refresh failed: {e}')
+            # the refresh token may have been revoked or expired, which a retry of the refresh does not fix
+            try:
+                self.relogin()
+            except Exception as e:
+                logging.error(f'Could not log in again after the failed refresh: {e}')
+                if self._stop_event.wait(REFRESH_RETRY_INTERVAL):
+                    return
+
 
 def get_initial_tokens() -> dict:
     """
@@ -14,27 +379,26 @@ def get_initial_tokens() -> dict:
     return get_tokens_from_credentials(_("CREDENTIALS/EMAIL"), _("CREDENTIALS/PASSWORD"))
 
 
-# get the initial tokens
-try:
-    initial_tokens = get_initial_tokens()
-except Exception as e:
-    logging.error("Could not get initial tokens: {}".format(e))
-    exit(1)
+token_manager = TokenManager()
+
+GaugeFunction('grohe_token_age_seconds', 'Seconds since the current tokens were received.',
+              lambda: {(): (datetime.now() - token_manager.tokens_received_at).total_seconds()
+                       if token_manager.tokens_received_at else None})
+GaugeFunction('grohe_token_expires_in_seconds', 'Seconds until the access token is refreshed at the latest.',
+              lambda: {(): token_manager.get_stats()['access_token_expires_in'] if token_manager.is_ready() else None})
+GaugeFunction('grohe_token_events_total',
+              'Token refreshes, waits for a running refresh, failed refreshes and logins after a failed refresh.',
+              lambda: {(name,): value for name, value in token_manager.get_stats().items()
+                       if name != 'access_token_expires_in'},
+              label_names=('event',), metric_type='counter')
 
-# set the tokens
-# noinspection PyUnboundLocalVariable
-access_token = initial_tokens['access_token']
-access_token_expiring_date = datetime.now() + timedelta(seconds=initial_tokens['access_token_expires_in'] - 60)
-refresh_token = initial_tokens['refresh_token']
 
+def refresh_tokens(stale_access_token: Optional[str] = None):
+    token_manager.refresh(stale_access_token)
 
-def refresh_tokens():
-    logging.info("Refreshing tokens")
-    global access_token, refresh_token, access_token_expiring_date
-    tokens = get_refresh_tokens(refresh_token)
-    access_token = tokens['access_token']
-    refresh_token = tokens['refresh_token']
-    access_token_expiring_date = datetime.now() + timedelta(seconds=tokens['access_token_expires_in'] - 60)
+
+async def async_refresh_tokens(stale_access_token: Optional[str] = None):
+    await token_manager.async_refresh(stale_access_token)
 
 
 def get_access_token() -> str:
@@ -43,9 +407,14 @@ def get_access_token() -> str:
     Returns: The access token.
 
     """
-    global access_token, access_token_expiring_date
-    # refresh the tokens if they are expired
-    if datetime.now() > access_token_expiring_date:
-        refresh_tokens()
+    return token_manager.get_access_token()
+
+
+async def async_get_access_token() -> str:
+    """
+    Async version of get_access_token. Refreshing the tokens does not block the event loop.
 
-    return access_token
+    See Also: get_access_token
+
+    """
+    return await token_manager.async_get_access_token()
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Hashable
+
+
+class CacheEntry:
+    def __init__(self, value):
+        self.value = value
+        self.fetched_at = time.monotonic()
+
+    def get_age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+class AsyncTTLCache:
+    """
+    Caches the results of slow fetches, like requests to the Grohe cloud.
+
+    A value is fresh for ttl seconds. After that it is stale for stale_ttl more seconds: a stale value is returned
+    at once while a single fetch updates it in the background (stale-while-revalidate). Concurrent readers of a
+    missing value share one fetch. Invalidating a key drops its value, and the result of a fetch started before
+    the invalidation is not cached.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._fetches = {}
+        self._generations = {}
+        self.stats = {
+            'hits'        : 0,
+            'stale_hits'  : 0,
+            'misses'      : 0,
+            'coalesced'   : 0,
+            'fetch_errors': 0,
+        }
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable]) -> CacheEntry:
+        """
+        Get the cached value of the given key, fetching it if it is missing or expired.
+        Args:
+            key: The key of the value.
+            fetch: The coroutine function fetching the value.
+
+        Returns: The cache entry with the value and its age.
+        Raises: The exception of the fetch if there is no value to fall back to.
+
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = entry.get_age()
+            if age < self.ttl:
+                self.stats['hits'] += 1
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                self.stats['stale_hits'] += 1
+                self._start_fetch(key, fetch)
+                return entry
+
+        self.stats['misses'] += 1
+        generation = self._generations.get(key, 0)
+        task = self._fetches.get(key)
+        if task is not None and task.generation == generation:
+            self.stats['coalesced'] += 1
+        else:
+            task = self._start_fetch(key, fetch)
+        # the fetch is shared, so a cancelled reader must not cancel it
+        return await asyncio.shield(task)
+
+    def _start_fetch(self, key: Hashable, fetch: Callable[[], Awaitable]) -> asyncio.Task:
+        generation = self._generations.get(key, 0)
+        task = self._fetches.get(key)
+        if task is not None and task.generation == generation:
+            return task
+
+        async def run() -> CacheEntry:
+            try:
+                value = await fetch()
+            except Exception:
+                self.stats['fetch_errors'] += 1
+                raise
+            entry = CacheEntry(value)
+            if self._generations.get(key, 0) == generation:
+                self._entries[key] = entry
+            return entry
+
+        task = asyncio.ensure_future(run())
+        task.generation = generation
+        self._fetches[key] = task
+
+        def done(finished: asyncio.Task) -> None:
+            if self._fetches.get(key) is finished:
+                del self._fetches[key]
+            if not finished.cancelled() and finished.exception() is not None:
+                logging.warning(f'Could not fetch {key}: {finished.exception()}')
+
+        task.add_done_callback(done)
+        return task
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Drop the cached value of the given key. A running fetch of the key is not cached anymore.
+        Args:
+            key: The key of the value.
+
+        """
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._entries.pop(key, None)
+
+    def get_stats(self) -> dict:
+        """
+        Returns: The counters of the cache and the number of cached values.
+
+        """
+        return dict(self.stats, entries=len(self._entries), fetches=len(self._fetches))
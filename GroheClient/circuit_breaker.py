@@ -0,0 +1,155 @@
+import collections
+import threading
+import time
+
+from GroheClient.metrics import GaugeFunction
+from settings import get_setting as _
+
+# the number of most recent requests the failure rate is calculated from
+WINDOW_SIZE = int(_("CIRCUIT_BREAKER/WINDOW_SIZE", 20))
+# the minimum number of requests in the window before the circuit can open
+MIN_REQUESTS = int(_("CIRCUIT_BREAKER/MIN_REQUESTS", 5))
+# the circuit opens if this share of the requests in the window failed
+FAILURE_RATE = float(_("CIRCUIT_BREAKER/FAILURE_RATE", 0.5))
+# the number of seconds the circuit stays open before probe requests are let through
+OPEN_DURATION = float(_("CIRCUIT_BREAKER/OPEN_DURATION", 30.0))
+# the number of probe requests let through at the same time while the circuit is half open
+HALF_OPEN_PROBES = int(_("CIRCUIT_BREAKER/HALF_OPEN_PROBES", 1))
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request while the circuit is open.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'The Grohe cloud is unavailable. Try again in {retry_after:.0f} seconds.')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to the Grohe cloud while it is failing, so callers fail at once instead of waiting
+    for timeouts and retries.
+
+    The circuit opens when the failure rate of the last requests exceeds the threshold. While it is open, requests
+    fail with a CircuitOpenError. After the open duration it is half open and lets probe requests through:
+    a successful probe closes the circuit, a failed one opens it again.
+    """
+
+    def __init__(self, window_size: int = WINDOW_SIZE, min_requests: int = MIN_REQUESTS,
+                 failure_rate: float = FAILURE_RATE, open_duration: float = OPEN_DURATION,
+                 half_open_probes: int = HALF_OPEN_PROBES):
+        self.min_requests = min_requests
+        self.failure_rate = failure_rate
+        self.open_duration = open_duration
+        self.half_open_probes = half_open_probes
+        self.state = STATE_CLOSED
+        self._results = collections.deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'opened'  : 0,
+            'rejected': 0,
+        }
+
+    def _get_retry_after(self) -> float:
+        return max(self._opened_at + self.open_duration - time.monotonic(), 0.0)
+
+    def raise_if_open(self) -> None:
+        """
+        Fail fast if the circuit is open. Unlike before_request, this does not use up a probe request.
+
+        Raises: CircuitOpenError if the circuit is open.
+
+        """
+        if self.state != STATE_OPEN:
+            return
+        with self._lock:
+            retry_after = self._get_retry_after()
+            if self.state == STATE_OPEN and retry_after > 0:
+                self.stats['rejected'] += 1
+                raise CircuitOpenError(retry_after)
+
+    def before_request(self) -> None:
+        """
+        Must be called before every request. Switches an open circuit to half open after the open duration.
+
+        Raises: CircuitOpenError if the request must not be sent.
+
+        """
+        with self._lock:
+            if self.state == STATE_OPEN:
+                retry_after = self._get_retry_after()
+                if retry_after > 0:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(retry_after)
+                self.state = STATE_HALF_OPEN
+                self._probes = 0
+
+            if self.state == STATE_HALF_OPEN:
+                if self._probes >= self.half_open_probes:
+                    self.stats['rejected'] += 1
+                    raise CircuitOpenError(1)
+                self._probes += 1
+
+    def record_success(self) -> None:
+        """
+        Record a request which reached the Grohe cloud. Closes a half open circuit.
+
+        """
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self.state = STATE_CLOSED
+                self._results.clear()
+            self._results.append(True)
+
+    def record_failure(self) -> None:
+        """
+        Record a failed request. Opens the circuit if the failure rate exceeds the threshold
+        or if a probe request failed.
+
+        """
+        with self._lock:
+            self._results.append(False)
+            if self.state == STATE_HALF_OPEN:
+                self._open()
+            elif self.state == STATE_CLOSED and len(self._results) >= self.min_requests:
+                failures = self._results.count(False)
+                if failures / len(self._results) >= self.failure_rate:
+                    self._open()
+
+    def _open(self) -> None:
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self.stats['opened'] += 1
+
+    def get_status(self) -> dict:
+        """
+        Returns: The state of the circuit, the failure rate of the window and the counters.
+
+        """
+        with self._lock:
+            results = list(self._results)
+            status = {
+                'state'       : self.state,
+                'failure_rate': results.count(False) / len(results) if results else 0.0,
+                'requests'    : len(results),
+                'retry_after' : self._get_retry_after() if self.state == STATE_OPEN else 0.0,
+            }
+            status.update(self.stats)
+        return status
+
+
+circuit_breaker = CircuitBreaker()
+
+GaugeFunction('grohe_circuit_breaker_open', '1 while the circuit breaker is open or half open, 0 otherwise.',
+              lambda: {(): int(circuit_breaker.state != STATE_CLOSED)})
+GaugeFunction('grohe_circuit_breaker_events_total', 'Times the circuit opened and requests it rejected.',
+              lambda: {(name,): circuit_breaker.stats[name] for name in ('opened', 'rejected')},
+              label_names=('event',), metric_type='counter')
@@ -0,0 +1,123 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the valid tap types: 1 for still, 2 for medium, 3 for sparkling
+TAP_TYPES = (1, 2, 3)
+# the maximum amount of water in ml a single command can dispense
+MAX_TAP_AMOUNT = 2000
+# the amount must be a multiple of this many ml
+TAP_AMOUNT_STEP = 50
+
+# the commands which do not dispense water, each sets its flag of the command
+CONTROL_COMMANDS = ('get_current_measurement', 'filter_status_reset', 'co2_status_reset')
+
+# every valid (tap type, amount) pair, there are only 3 x 40 of them
+VALID_COMMANDS = frozenset((tap_type, amount) for tap_type in TAP_TYPES
+                           for amount in range(TAP_AMOUNT_STEP, MAX_TAP_AMOUNT + 1, TAP_AMOUNT_STEP))
+
+
+def dumps(data) -> bytes:
+    """
+    Serialize the given data to compact JSON, with orjson if it is installed.
+    Args:
+        data: The data to serialize.
+
+    Returns: The UTF-8 encoded JSON.
+
+    """
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def check_tap_params(tap_type: int, amount: int) -> None:
+    """
+    Checks the given tap parameters.
+    Args:
+        tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
+        amount: The amount of water to be dispensed in ml.
+
+    Raises: ValueError if the parameters are invalid.
+
+    """
+    if (tap_type, amount) in VALID_COMMANDS:
+        return
+    # check if the tap type is valid
+    if tap_type not in TAP_TYPES:
+        raise ValueError(f'Invalid tap type: {tap_type}. Valid values are 1, 2 and 3.')
+    raise ValueError('The amount must be a multiple of 50, greater than 0 and less or equal to 2000.')
+
+
+def get_command(tap_type: int, amount: int) -> dict:
+    """
+    Returns the command to execute for the given tap type and amount.
+    Args:
+        tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
+        amount: The amount of water to be dispensed in ml.
+
+    Returns: The command to execute.
+
+    """
+    return {
+        "co2_status_reset"         : False,
+        "tap_type"                 : tap_type,
+        "cleaning_mode"            : False,
+        "filter_status_reset"      : False,
+        "get_current_measurement"  : False,
+        "tap_amount"               : amount,
+        "factory_reset"            : False,
+        "revoke_flush_confirmation": False,
+        "exec_auto_flush"          : False
+    }
+
+
+def get_payload_template(appliance_id: str) -> dict:
+    """
+    Returns the payload of a command request for the given appliance, without the command.
+    Args:
+        appliance_id: The Grohe appliance id.
+
+    Returns: The payload template.
+
+    """
+    return {
+        "type"        : None,
+        "appliance_id": appliance_id,
+        "command"     : None,
+        "commandb64"  : None,
+        "timestamp"   : None
+    }
+
+
+def build_command_bodies(payload_template: dict) -> dict:
+    """
+    Serialize the payloads of all valid tap commands once, so sending a command needs no serialization.
+    Args:
+        payload_template: The payload template of the appliance.
+
+    Returns: A dict from (tap type, amount) to the JSON body of the command request.
+
+    See Also: get_payload_template
+
+    """
+    return {(tap_type, amount): dumps(dict(payload_template, command=get_command(tap_type, amount)))
+            for tap_type, amount in sorted(VALID_COMMANDS)}
+
+
+def build_control_bodies(payload_template: dict) -> dict:
+    """
+    Serialize the payloads of the control commands once, like build_command_bodies.
+    Args:
+        payload_template: The payload template of the appliance.
+
+    Returns: A dict from the name of the control command to the JSON body of the command request.
+
+    See Also: CONTROL_COMMANDS
+
+    """
+    return {name: dumps(dict(payload_template, command=dict(get_command(0, 0), **{name: True})))
+            for name in CONTROL_COMMANDS}
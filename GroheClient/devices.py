@@ -0,0 +1,154 @@
+import logging
+import threading
+from typing import Optional
+
+from GroheClient.base import get_access_token
+from GroheClient.commands import build_command_bodies, build_control_bodies, get_payload_template
+from GroheClient.discovery import APPLIANCES_BASE_URL, discover_devices
+from settings import get_setting as _
+
+APPLIANCE_BASE_URL = APPLIANCES_BASE_URL + "/{}"
+
+
+class Appliance:
+    """
+    A Grohe Blue appliance with its precomputed urls and the serialized bodies of all valid commands.
+    """
+
+    def __init__(self, device_id: str, location_id: str, room_id: str, appliance_id: str,
+                 name: Optional[str] = None):
+        """
+        Args:
+            device_id: The id used for the appliance in the API routes.
+            location_id: The id of the location (home) of the appliance.
+            room_id: The id of the room of the appliance.
+            appliance_id: The Grohe appliance id.
+            name: The display name of the appliance.
+
+        """
+        self.device_id = device_id
+        self.location_id = location_id
+        self.room_id = room_id
+        self.appliance_id = appliance_id
+        self.name = name or device_id
+
+        self.url = APPLIANCE_BASE_URL.format(location_id, room_id, appliance_id)
+        self.command_url = self.url + '/command'
+        self.payload_template = get_payload_template(appliance_id)
+        self.command_bodies = build_command_bodies(self.payload_template)
+        self.control_bodies = build_control_bodies(self.payload_template)
+
+    def __repr__(self):
+        return f"Appliance({self.device_id}, {self.appliance_id})"
+
+    def __str__(self):
+        return self.name
+
+    def to_dict(self) -> dict:
+        return {
+            'device_id'   : self.device_id,
+            'name'        : self.name,
+            'location_id' : self.location_id,
+            'room_id'     : self.room_id,
+            'appliance_id': self.appliance_id,
+        }
+
+
+def discover_appliances() -> list:
+    """
+    Discover the Grohe Blue appliances of the account.
+    Returns: A list of the discovered appliances, their device id is the appliance id.
+
+    See Also: GroheClient.discovery.discover_devices
+
+    """
+    return [Appliance(device.appliance_id, str(device.room.location.location_id), str(device.room.room_id),
+                      device.appliance_id, device.name)
+            for device in discover_devices(get_access_token()) if device.is_grohe_blue()]
+
+
+class DeviceRegistry:
+    """
+    The appliances served by the API.
+
+    The appliances are configured in the DEVICES list of the settings, each with an ID used in the API routes.
+    The single DEVICE section written by install.py is supported as well and becomes the default appliance.
+    If DEVICES_DISCOVER is enabled, all Grohe Blue appliances of the account are added with discover.
+    """
+
+    def __init__(self):
+        self._appliances = {}
+        self._default = None
+        self._lock = threading.Lock()
+
+    def load_from_settings(self) -> None:
+        """
+        Add the appliances configured in the settings.
+
+        """
+        device = _("DEVICE", None)
+        if device:
+            self.add(Appliance(device['APPLIANCE_ID'], str(device['LOCATION_ID']), str(device['ROOM_ID']),
+                               device['APPLIANCE_ID'], device.get('NAME')))
+
+        for device in _("DEVICES", []):
+            self.add(Appliance(device['ID'], str(device['LOCATION_ID']), str(device['ROOM_ID']),
+                               device['APPLIANCE_ID'], device.get('NAME')))
+
+    def discover(self) -> None:
+        """
+        Add all Grohe Blue appliances of the account, which are not configured yet.
+
+        See Also: discover_appliances
+
+        """
+        for appliance in discover_appliances():
+            if self.get(appliance.appliance_id) is None:
+                logging.info(f'Discovered appliance {appliance.name} ({appliance.appliance_id})')
+                self.add(appliance)
+
+    def add(self, appliance: Appliance) -> None:
+        """
+        Add the given appliance. The first added appliance is the default appliance.
+        Args:
+            appliance: The appliance to add.
+
+        """
+        with self._lock:
+            self._appliances[appliance.device_id] = appliance
+            self._appliances.setdefault(appliance.appliance_id, appliance)
+            if self._default is None:
+                self._default = appliance
+
+    def get(self, device_id: str) -> Optional[Appliance]:
+        """
+        Get the appliance with the given device id or Grohe appliance id.
+        Args:
+            device_id: The device id or the appliance id.
+
+        Returns: The appliance or None if there is no such appliance.
+
+        """
+        return self._appliances.get(device_id)
+
+    def get_default(self) -> Optional[Appliance]:
+        """
+        Returns: The default appliance used by the routes without a device id, or None if there are no appliances.
+
+        """
+        return self._default
+
+    def get_all(self) -> list:
+        """
+        Returns: A list of all appliances.
+
+        """
+        appliances = []
+        for appliance in self._appliances.values():
+            if appliance not in appliances:
+                appliances.append(appliance)
+        return appliances
+
+
+device_registry = DeviceRegistry()
+device_registry.load_from_settings()
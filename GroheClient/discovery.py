@@ -0,0 +1,123 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from GroheClient.session import GROHE_API_BASE_URL, get_session, get_timeout
+from settings import get_setting as _
+
+LOCATIONS_BASE_URL = GROHE_API_BASE_URL + "/v3/iot/locations"
+ROOMS_BASE_URL = LOCATIONS_BASE_URL + "/{}/rooms"
+APPLIANCES_BASE_URL = ROOMS_BASE_URL + "/{}/appliances"
+
+# the appliance type ids of Grohe Blue devices: 104 for Grohe Blue Home, 105 for Grohe Blue Professional
+GROHE_BLUE_TYPE_IDS = (104, 105)
+
+# the maximum number of concurrent requests during the discovery
+MAX_CONCURRENCY = int(_("DISCOVERY/MAX_CONCURRENCY", 8))
+# the number of seconds a discovery result is reused, 0 disables the cache
+CACHE_TTL = float(_("DISCOVERY/CACHE_TTL", 300.0))
+
+_cached_devices = None
+_cache_expires_at = 0.0
+_cache_lock = threading.Lock()
+
+
+class Location:
+    def __init__(self, location_id: str, name: str):
+        self.location_id = location_id
+        self.name = name
+
+    def __repr__(self):
+        return f"Location({self.location_id}, {self.name})"
+
+    def __str__(self):
+        return self.name
+
+
+class Room:
+    def __init__(self, location: Location, room_id: str, name: str):
+        self.location = location
+        self.room_id = room_id
+        self.name = name
+
+    def __repr__(self):
+        return f"Room({self.location} - {self.room_id}, {self.name})"
+
+    def __str__(self):
+        return self.name
+
+
+class Device:
+    def __init__(self, room: Room, appliance_id: str, type_id: int, name: str):
+        self.room = room
+        self.appliance_id = appliance_id
+        self.type_id = type_id
+        self.name = name
+
+    def __repr__(self):
+        return f"Device({self.room} - {self.appliance_id}, {self.name})"
+
+    def __str__(self):
+        return self.name
+
+    def is_grohe_blue(self) -> bool:
+        return self.type_id in GROHE_BLUE_TYPE_IDS
+
+
+def _get(url: str, headers: dict) -> list:
+    response = get_session().get(url, headers=headers, timeout=get_timeout())
+    response.raise_for_status()
+    return response.json()
+
+
+def discover_devices(access_token: str, use_cache: bool = True) -> list:
+    """
+    Discover all devices of the account by walking its locations, rooms and appliances.
+    The rooms of all locations and the appliances of all rooms are requested concurrently,
+    with at most MAX_CONCURRENCY requests at a time.
+    Args:
+        access_token: The access token to use.
+        use_cache: If True, a result of the last CACHE_TTL seconds is reused.
+
+    Returns: A list of the devices. Each device references its room and the room references its location.
+
+    """
+    global _cached_devices, _cache_expires_at
+    with _cache_lock:
+        if use_cache and _cached_devices is not None and time.monotonic() < _cache_expires_at:
+            return _cached_devices
+
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type" : "application/json",
+        "Accept"       : "application/json",
+    }
+
+    locations = [Location(location['id'], location['name']) for location in _get(LOCATIONS_BASE_URL, headers)]
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix='discovery') as executor:
+        room_lists = executor.map(lambda location: _get(ROOMS_BASE_URL.format(location.location_id), headers),
+                                  locations)
+        rooms = [Room(location, room['id'], room['name'])
+                 for location, room_list in zip(locations, room_lists) for room in room_list]
+
+        appliance_lists = executor.map(
+            lambda room: _get(APPLIANCES_BASE_URL.format(room.location.location_id, room.room_id), headers), rooms)
+        devices = [Device(room, appliance['appliance_id'], appliance['type'], appliance['name'])
+                   for room, appliance_list in zip(rooms, appliance_lists) for appliance in appliance_list]
+
+    if CACHE_TTL > 0:
+        with _cache_lock:
+            _cached_devices = devices
+            _cache_expires_at = time.monotonic() + CACHE_TTL
+    return devices
+
+
+def clear_cache() -> None:
+    """
+    Forget the cached discovery result.
+
+    """
+    global _cached_devices
+    with _cache_lock:
+        _cached_devices = None
@@ -0,0 +1,89 @@
+import asyncio
+import functools
+import time
+from typing import Awaitable, Callable
+
+from GroheClient.admission import REASON_DEADLINE, AdmissionRejectedError, admission_controller
+from GroheClient.base import TokensNotReadyError
+from GroheClient.circuit_breaker import CircuitOpenError, circuit_breaker
+from GroheClient.commands import check_tap_params
+from GroheClient.devices import Appliance
+from GroheClient.rate_limit import RateLimitError, TokenBucket, rate_limiter
+from GroheClient.scheduler import DeadlineExceededError, Job, job_manager
+from GroheClient.tap_controller import async_execute_tap_command
+
+# the errors of a tap command which was rejected before it was sent, it can be retried
+REJECTIONS = (RateLimitError, CircuitOpenError, AdmissionRejectedError, TokensNotReadyError)
+
+
+def get_executor(appliance: Appliance) -> Callable[[int, int], Awaitable[bool]]:
+    """
+    Returns the function which executes a tap command on the given appliance.
+    Args:
+        appliance: The appliance.
+
+    Returns: The coroutine function, taking the tap type and the amount.
+
+    """
+    return functools.partial(async_execute_tap_command, appliance=appliance)
+
+
+async def dispense(key_bucket: TokenBucket, appliance: Appliance, tap_type: int, amount: int) -> Job:
+    """
+    Executes the command for the given tap type and amount on the given appliance, the path shared by the HTTP
+    routes and the MQTT bridge. The command is validated, checked against the circuit breaker, rate limited and
+    admitted, then queued behind other commands for the appliance. Returns once it was executed. The command is
+    rejected if it could not be sent within the queue timeout of the admission controller, counting both the wait
+    for a slot and the wait in the queue of the appliance. If the caller is cancelled, a queued command is dropped
+    and a running command keeps its slot until it is finished.
+    Args:
+        key_bucket: The rate limit of the client, like the token bucket of an API key.
+        appliance: The appliance.
+        tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
+        amount: The amount of water to be dispensed in ml.
+
+    Returns: The finished job of the command.
+    Raises: ValueError if the parameters are invalid. One of REJECTIONS if the command was not sent.
+        The exception of the command if it failed.
+
+    See Also: GroheClient.admission.AdmissionController, GroheClient.scheduler.JobManager
+
+    """
+    check_tap_params(tap_type, amount)
+    # checked before the rate limits, so requests rejected by the open circuit do not use up their tokens
+    circuit_breaker.raise_if_open()
+    rate_limiter.check(key_bucket, appliance.appliance_id)
+    deadline = time.monotonic() + admission_controller.queue_timeout
+    try:
+        await admission_controller.acquire()
+    except AdmissionRejectedError:
+        # the request was not executed, so it does not count against the rate limits
+        rate_limiter.release(key_bucket, appliance.appliance_id)
+        raise
+    release = True
+    try:
+        job = job_manager.submit(appliance.appliance_id, get_executor(appliance), [(tap_type, amount)],
+                                 deadline=deadline)
+        try:
+            await job.wait()
+        except asyncio.CancelledError:
+            # the client went away, the command must not be sent later without holding a slot
+            job_manager.cancel(job)
+            if not job.is_finished():
+                release = False
+                asyncio.ensure_future(_release_when_finished(job))
+            raise
+    finally:
+        if release:
+            admission_controller.release()
+    if isinstance(job.exception, DeadlineExceededError):
+        rate_limiter.release(key_bucket, appliance.appliance_id)
+        raise admission_controller.reject(REASON_DEADLINE)
+    if job.exception is not None:
+        raise job.exception
+    return job
+
+
+async def _release_when_finished(job: Job) -> None:
+    await job.wait()
+    admission_controller.release()
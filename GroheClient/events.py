@@ -0,0 +1,232 @@
+import asyncio
+import collections
+import itertools
+import time
+from typing import Optional
+
+from GroheClient.commands import dumps
+from GroheClient.metrics import GaugeFunction
+from settings import get_setting as _
+
+# the number of events buffered per subscriber, the oldest events of a slow subscriber are dropped
+QUEUE_SIZE = int(_("EVENTS/QUEUE_SIZE", 100))
+# the maximum number of concurrent subscribers
+MAX_SUBSCRIBERS = int(_("EVENTS/MAX_SUBSCRIBERS", 500))
+# the number of seconds after which an idle event stream sends a keep-alive comment
+KEEP_ALIVE = float(_("EVENTS/KEEP_ALIVE", 15.0))
+
+COMMAND_QUEUED = 'command.queued'
+COMMAND_SENT = 'command.sent'
+COMMAND_ACKNOWLEDGED = 'command.acknowledged'
+COMMAND_FAILED = 'command.failed'
+COMMAND_CANCELLED = 'command.cancelled'
+TOKEN_REFRESHED = 'token.refreshed'
+TOKEN_REFRESH_FAILED = 'token.refresh_failed'
+STATUS_UPDATED = 'status.updated'
+MEASUREMENTS_UPDATED = 'measurements.updated'
+EVENT_TYPES = frozenset((COMMAND_QUEUED, COMMAND_SENT, COMMAND_ACKNOWLEDGED, COMMAND_FAILED, COMMAND_CANCELLED,
+                         TOKEN_REFRESHED, TOKEN_REFRESH_FAILED, STATUS_UPDATED, MEASUREMENTS_UPDATED))
+
+
+class TooManySubscribersError(Exception):
+    """
+    Raised if the maximum number of subscribers is reached.
+    """
+
+    def __init__(self):
+        super().__init__('Too many event subscribers. Try again later.')
+
+
+class Event:
+    """
+    An event published to all subscribers. It is serialized once, however many subscribers receive it.
+    """
+
+    def __init__(self, event_id: int, event_type: str, data: dict):
+        self.event_id = event_id
+        self.event_type = event_type
+        self.data = data
+        self.time = time.time()
+        self._json = None
+
+    def to_json(self) -> bytes:
+        if self._json is None:
+            self._json = dumps({'id': self.event_id, 'type': self.event_type, 'time': self.time, 'data': self.data})
+        return self._json
+
+    def to_sse(self) -> bytes:
+        """
+        Returns: The event in the server-sent events format.
+
+        """
+        return b'id: %d\nevent: %s\ndata: %s\n\n' % (self.event_id, self.event_type.encode(), self.to_json())
+
+
+class Subscription:
+    """
+    The buffer of one subscriber. If the subscriber is too slow, the oldest events are dropped,
+    which it can notice by the gaps in the event ids.
+    """
+
+    def __init__(self, bus: 'EventBus', types: Optional[frozenset], queue_size: int):
+        self._bus = bus
+        self.types = types
+        self._events = collections.deque(maxlen=queue_size)
+        self._wakeup = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, event: Event) -> bool:
+        """
+        Add the given event to the buffer, dropping the oldest event if it is full.
+        Args:
+            event: The event.
+
+        Returns: False if an event was dropped, True otherwise.
+
+        """
+        dropped = len(self._events) == self._events.maxlen
+        if dropped:
+            self.dropped += 1
+        self._events.append(event)
+        self._wakeup.set()
+        return not dropped
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """
+        Wait for the next event.
+        Args:
+            timeout: The maximum number of seconds to wait, None to wait until an event arrives.
+
+        Returns: The next event, or None if the timeout passed or the subscription was closed.
+
+        """
+        while not self._events:
+            if self.closed:
+                return None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._events.popleft()
+
+    def close(self) -> None:
+        """
+        Stop receiving events, a waiting get returns None.
+
+        """
+        if not self.closed:
+            self.closed = True
+            self._bus.unsubscribe(self)
+            self._wakeup.set()
+
+
+class EventBus:
+    """
+    Broadcasts events, like the lifecycle of tap commands and token refreshes, to the subscribers of the event streams.
+
+    Publishing only schedules the delivery on the event loop, so a publisher like the tap path never waits for the
+    subscribers. Events can be published from any thread, events without subscribers are discarded at once.
+    """
+
+    def __init__(self, queue_size: int = QUEUE_SIZE, max_subscribers: int = MAX_SUBSCRIBERS):
+        self.queue_size = max(queue_size, 1)
+        self.max_subscribers = max_subscribers
+        self._subscriptions = set()
+        self._loop = None
+        self._event_ids = itertools.count(1)
+        self.stats = {
+            'published': 0,
+            'delivered': 0,
+            'dropped'  : 0,
+            'rejected' : 0,
+        }
+
+    def subscribe(self, types: Optional[frozenset] = None) -> Subscription:
+        """
+        Subscribe to the events, must be called on the event loop.
+        Args:
+            types: The event types to receive, None for all types.
+
+        Returns: The subscription, it must be closed once the subscriber is gone.
+        Raises: TooManySubscribersError if the maximum number of subscribers is reached.
+
+        """
+        if len(self._subscriptions) >= self.max_subscribers:
+            self.stats['rejected'] += 1
+            raise TooManySubscribersError()
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self, types, self.queue_size)
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        self._subscriptions.discard(subscription)
+
+    def publish(self, event_type: str, data: dict) -> None:
+        """
+        Publish an event to all subscribers.
+        Args:
+            event_type: The type of the event, one of EVENT_TYPES.
+            data: The data of the event, it must be serializable to JSON.
+
+        """
+        loop = self._loop
+        if not self._subscriptions or loop is None or loop.is_closed():
+            return
+        event = Event(next(self._event_ids), event_type, data)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            loop.call_soon(self._deliver, event)
+        else:
+            loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event: Event) -> None:
+        self.stats['published'] += 1
+        for subscription in self._subscriptions:
+            if subscription.types is not None and event.event_type not in subscription.types:
+                continue
+            self.stats['delivered'] += 1
+            if not subscription.put(event):
+                self.stats['dropped'] += 1
+
+    def get_subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+
+def parse_event_types(types: Optional[str]) -> Optional[frozenset]:
+    """
+    Parse a comma separated list of event types. A type ending with a dot selects all types with this prefix,
+    e.g. "command." selects all command events.
+    Args:
+        types: The list of event types, None or an empty string for all types.
+
+    Returns: The selected event types, None for all types.
+    Raises: ValueError if the list contains an unknown event type.
+
+    """
+    if not types:
+        return None
+    selected = set()
+    for name in types.split(','):
+        name = name.strip()
+        matches = {event_type for event_type in EVENT_TYPES
+                   if event_type == name or (name.endswith('.') and event_type.startswith(name))}
+        if not matches:
+            raise ValueError(f'Unknown event type: {name}. Valid types are {", ".join(sorted(EVENT_TYPES))}.')
+        selected |= matches
+    return frozenset(selected)
+
+
+event_bus = EventBus()
+
+GaugeFunction('grohe_event_subscribers', 'Number of connected event stream subscribers.',
+              lambda: {(): event_bus.get_subscriber_count()})
+GaugeFunction('grohe_events_total', 'Published events, events delivered to subscribers, events dropped because a '
+                                    'subscriber was too slow and rejected subscribers.',
+              lambda: {(name,): value for name, value in event_bus.stats.items()},
+              label_names=('event',), metric_type='counter')
@@ -0,0 +1,46 @@
+import contextlib
+import logging
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows, the locks are skipped there and only a single worker is supported
+    fcntl = None
+
+
+@contextlib.contextmanager
+def file_lock(path: str, blocking: bool = True):
+    """
+    Hold an exclusive lock on the given lock file, which coordinates the worker processes of the server.
+    The lock is released when the process dies, so a crashed worker never leaves a stale lock behind.
+    Args:
+        path: The path of the lock file, it is created if it does not exist.
+        blocking: If False, do not wait for another process holding the lock.
+
+    Returns: A context manager yielding True if the lock is held, False if it is held by another process.
+
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError as e:
+        logging.warning(f'Could not open the lock file {path}: {e}')
+        yield True
+        return
+
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
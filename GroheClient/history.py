@@ -0,0 +1,381 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from GroheClient.base import get_access_token, refresh_tokens, token_manager
+from GroheClient.devices import Appliance, device_registry
+from GroheClient.file_lock import file_lock
+from GroheClient.session import get_session, get_timeout
+from GroheClient.tap_controller import get_auth_header
+from settings import get_setting as _, get_settings
+
+# off by default, the history is read from the undocumented /data/aggregated endpoint of the Grohe cloud
+HISTORY_ENABLED = bool(_("HISTORY/ENABLED", False))
+# relative paths are relative to the directory of the settings file
+HISTORY_DATABASE = os.path.join(os.path.dirname(get_settings().path), _("HISTORY/DATABASE", 'history.sqlite3'))
+# the number of seconds between two syncs with the Grohe cloud
+SYNC_INTERVAL = float(_("HISTORY/SYNC_INTERVAL", 3600.0))
+# the number of days fetched by the first sync of an appliance
+INITIAL_DAYS = int(_("HISTORY/INITIAL_DAYS", 365))
+# the number of days requested at once, the cloud rejects long ranges
+CHUNK_DAYS = int(_("HISTORY/CHUNK_DAYS", 30))
+
+PERIOD_DAY = 'day'
+PERIOD_WEEK = 'week'
+# the SQLite expressions grouping the unix timestamps by local day and by local week starting on monday
+PERIOD_EXPRESSIONS = {
+    PERIOD_DAY : "date(timestamp, 'unixepoch', 'localtime')",
+    PERIOD_WEEK: "date(timestamp, 'unixepoch', 'localtime', '-6 days', 'weekday 1')",
+}
+
+# the names of the water types in the data of the Grohe cloud
+WATER_TYPES = {
+    'still'     : 1,
+    'medium'    : 2,
+    'carbonated': 3,
+    'sparkling' : 3,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS withdrawals (
+    appliance_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    tap_type INTEGER NOT NULL,
+    amount_ml REAL NOT NULL,
+    PRIMARY KEY (appliance_id, timestamp, tap_type)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS measurements (
+    appliance_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    remaining_filter REAL,
+    remaining_co2 REAL,
+    PRIMARY KEY (appliance_id, timestamp)
+) WITHOUT ROWID;
+"""
+
+
+def parse_timestamp(value) -> Optional[int]:
+    """
+    Args:
+        value: An ISO 8601 date or timestamp, or a unix timestamp.
+
+    Returns: The unix timestamp in seconds, or None if the value is invalid. Values without timezone are UTC.
+
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def parse_withdrawals(data: dict) -> list:
+    """
+    Get the withdrawals from the appliance data of the Grohe cloud. A withdrawal has a starttime (or date),
+    a tap_type or water_type and its amount as tap_amount in ml or as waterconsumption in liters.
+    Withdrawals without any of them are skipped.
+    Args:
+        data: The appliance data.
+
+    Returns: A list of (timestamp, tap type, amount in ml) tuples.
+
+    """
+    withdrawals = []
+    for item in ((data or {}).get('data') or {}).get('withdrawals') or []:
+        timestamp = parse_timestamp(item.get('starttime', item.get('date')))
+        tap_type = item.get('tap_type')
+        if tap_type is None:
+            tap_type = WATER_TYPES.get(str(item.get('water_type')).lower())
+        if 'tap_amount' in item:
+            amount = item['tap_amount']
+        elif 'waterconsumption' in item:
+            amount = item['waterconsumption'] * 1000
+        else:
+            amount = None
+        if timestamp is None or tap_type is None or amount is None:
+            continue
+        withdrawals.append((timestamp, int(tap_type), float(amount)))
+    return withdrawals
+
+
+def parse_measurements(data: dict) -> list:
+    """
+    Get the measurements from the appliance data of the Grohe cloud.
+    Args:
+        data: The appliance data.
+
+    Returns: A list of (timestamp, remaining filter, remaining CO2) tuples.
+
+    """
+    measurements = []
+    for item in ((data or {}).get('data') or {}).get('measurement') or []:
+        timestamp = parse_timestamp(item.get('timestamp', item.get('date')))
+        if timestamp is None:
+            continue
+        measurements.append((timestamp, item.get('remaining_filter'), item.get('remaining_co2')))
+    return measurements
+
+
+class HistoryStore:
+    """
+    Stores the withdrawals and measurements of the appliances in a SQLite database.
+
+    Both tables are clustered by appliance and time (WITHOUT ROWID), so a query for a time range of an appliance
+    reads only the rows of that range, even with years of data. Rows which are already stored are replaced
+    by the newer values, so overlapping syncs are harmless and the running totals of a day are updated.
+    """
+
+    def __init__(self, path: str = HISTORY_DATABASE):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def get_last_timestamp(self, appliance_id: str) -> Optional[int]:
+        """
+        Returns: The unix timestamp of the newest stored withdrawal or measurement of the appliance,
+                 or None if nothing is stored.
+
+        """
+        with self._lock:
+            connection = self._connect()
+            timestamps = [connection.execute(f'SELECT MAX(timestamp) FROM {table} WHERE appliance_id = ?',
+                                             (appliance_id,)).fetchone()[0]
+                          for table in ('withdrawals', 'measurements')]
+        timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+        return max(timestamps) if timestamps else None
+
+    def add(self, appliance_id: str, withdrawals: list, measurements: list) -> int:
+        """
+        Store the given withdrawals and measurements of the appliance. Stored rows are replaced by newer values,
+        as the cloud returns the running totals of the current day.
+        Args:
+            appliance_id: The Grohe appliance id.
+            withdrawals: A list of (timestamp, tap type, amount in ml) tuples.
+            measurements: A list of (timestamp, remaining filter, remaining CO2) tuples.
+
+        Returns: The number of new or changed rows.
+
+        """
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                before = connection.total_changes
+                connection.executemany('INSERT INTO withdrawals VALUES (?, ?, ?, ?) '
+                                       'ON CONFLICT(appliance_id, timestamp, tap_type) DO UPDATE '
+                                       'SET amount_ml = excluded.amount_ml '
+                                       'WHERE amount_ml IS NOT excluded.amount_ml',
+                                       [(appliance_id, *withdrawal) for withdrawal in withdrawals])
+                connection.executemany('INSERT INTO measurements VALUES (?, ?, ?, ?) '
+                                       'ON CONFLICT(appliance_id, timestamp) DO UPDATE '
+                                       'SET remaining_filter = excluded.remaining_filter, '
+                                       'remaining_co2 = excluded.remaining_co2 '
+                                       'WHERE remaining_filter IS NOT excluded.remaining_filter '
+                                       'OR remaining_co2 IS NOT excluded.remaining_co2',
+                                       [(appliance_id, *measurement) for measurement in measurements])
+                return connection.total_changes - before
+
+    def get_consumption(self, appliance_id: str, period: str, start: int, end: int) -> list:
+        """
+        Sum up the withdrawals of the appliance per period and tap type.
+        Args:
+            appliance_id: The Grohe appliance id.
+            period: "day" or "week".
+            start: The unix timestamp the range starts at.
+            end: The unix timestamp the range ends before.
+
+        Returns: A list of dicts with the period, the tap type, the amount in ml and the number of withdrawals.
+
+        """
+        query = (f'SELECT {PERIOD_EXPRESSIONS[period]} AS period, tap_type, SUM(amount_ml), COUNT(*) '
+                 'FROM withdrawals WHERE appliance_id = ? AND timestamp >= ? AND timestamp < ? '
+                 'GROUP BY period, tap_type ORDER BY period, tap_type')
+        with self._lock:
+            rows = self._connect().execute(query, (appliance_id, start, end)).fetchall()
+        return [{'period': row[0], 'tap_type': row[1], 'amount_ml': row[2], 'withdrawals': row[3]} for row in rows]
+
+    def get_trends(self, appliance_id: str, period: str, start: int, end: int) -> list:
+        """
+        Get the lowest remaining filter capacity and CO2 of the appliance per period.
+        Args:
+            appliance_id: The Grohe appliance id.
+            period: "day" or "week".
+            start: The unix timestamp the range starts at.
+            end: The unix timestamp the range ends before.
+
+        Returns: A list of dicts with the period, the remaining filter capacity and the remaining CO2.
+
+        """
+        query = (f'SELECT {PERIOD_EXPRESSIONS[period]} AS period, MIN(remaining_filter), MIN(remaining_co2) '
+                 'FROM measurements WHERE appliance_id = ? AND timestamp >= ? AND timestamp < ? '
+                 'GROUP BY period ORDER BY period')
+        with self._lock:
+            rows = self._connect().execute(query, (appliance_id, start, end)).fetchall()
+        return [{'period': row[0], 'remaining_filter': row[1], 'remaining_co2': row[2]} for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+def get_range(period: str, start: Optional[date] = None, end: Optional[date] = None) -> tuple:
+    """
+    Get the unix timestamps of the given range of local days.
+    Args:
+        period: "day" or "week", without a start the range covers the last 30 days or the last 52 weeks.
+        start: The first day of the range.
+        end: The last day of the range, defaults to today.
+
+    Returns: A (start, end) tuple of unix timestamps, the end is excluded.
+
+    """
+    end = end or date.today()
+    if start is None:
+        start = end - (timedelta(days=29) if period == PERIOD_DAY else timedelta(weeks=52))
+    start_timestamp = datetime.combine(start, datetime.min.time()).timestamp()
+    end_timestamp = datetime.combine(end + timedelta(days=1), datetime.min.time()).timestamp()
+    return int(start_timestamp), int(end_timestamp)
+
+
+def fetch_appliance_data(appliance: Appliance, start: datetime, end: datetime) -> dict:
+    """
+    Request the data of the appliance between the given dates from the Grohe cloud.
+    After a 401 response the tokens are refreshed and the request is sent again once.
+    Args:
+        appliance: The appliance.
+        start: The first day of the range.
+        end: The last day of the range.
+
+    Returns: The appliance data.
+    Raises: An exception of requests if the request failed.
+
+    """
+    params = {
+        'from': start.date().isoformat(),
+        'to'  : end.date().isoformat(),
+    }
+    for attempt in range(2):
+        access_token = get_access_token()
+        headers = {
+            "Authorization": get_auth_header(access_token),
+            "Accept"       : "application/json",
+        }
+        response = get_session().get(appliance.url + '/data/aggregated', params=params, headers=headers,
+                                     timeout=get_timeout())
+        if response.status_code == 401 and attempt == 0:
+            refresh_tokens(access_token)
+            continue
+        response.raise_for_status()
+        return response.json()
+
+
+def sync_appliance(store: HistoryStore, appliance: Appliance) -> int:
+    """
+    Fetch the data of the appliance which is newer than the last stored data and store it.
+    The first sync fetches the last INITIAL_DAYS days. The data is requested in ranges of CHUNK_DAYS days.
+    Args:
+        store: The history store.
+        appliance: The appliance.
+
+    Returns: The number of new or changed rows.
+
+    """
+    now = datetime.now(timezone.utc)
+    last_timestamp = store.get_last_timestamp(appliance.appliance_id)
+    if last_timestamp is None:
+        start = now - timedelta(days=INITIAL_DAYS)
+    else:
+        # the cloud returns whole days, the rows of the last stored day are updated with their final values
+        start = datetime.fromtimestamp(last_timestamp, timezone.utc)
+
+    added = 0
+    while start <= now:
+        end = min(start + timedelta(days=CHUNK_DAYS - 1), now)
+        data = fetch_appliance_data(appliance, start, end)
+        added += store.add(appliance.appliance_id, parse_withdrawals(data), parse_measurements(data))
+        start = end + timedelta(days=1)
+    return added
+
+
+class HistorySync:
+    """
+    Syncs the history of all appliances of the device registry with the Grohe cloud in a background thread.
+    """
+
+    def __init__(self, store: HistoryStore, interval: float = SYNC_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self.last_sync = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def sync(self) -> int:
+        """
+        Sync all appliances once. Errors of an appliance are logged and do not stop the sync of the others.
+        With several worker processes, only one of them syncs at a time and the others skip the sync.
+        Returns: The number of new rows.
+
+        """
+        with file_lock(self.store.path + '.lock', blocking=False) as locked:
+            if not locked:
+                logging.debug('Another worker is syncing the history')
+                return 0
+            return self._sync()
+
+    def _sync(self) -> int:
+        added = 0
+        for appliance in device_registry.get_all():
+            try:
+                added += sync_appliance(self.store, appliance)
+            except Exception as e:
+                logging.error(f'Could not sync the history of {appliance.name}: {e}')
+        self.last_sync = datetime.now(timezone.utc)
+        logging.info(f'Synced the history, {added} new rows')
+        return added
+
+    def start(self) -> None:
+        """
+        Start the background thread, which waits for the login and then syncs every interval seconds.
+        Calling this more than once has no effect.
+
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='history-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background thread.
+
+        """
+        self._stop_event.set()
+
+    def _run(self) -> None:
+        while not token_manager.is_ready():
+            if self._stop_event.wait(1):
+                return
+        while True:
+            self.sync()
+            if self._stop_event.wait(self.interval):
+                return
+
+
+history_store = HistoryStore()
+history_sync = HistorySync(history_store)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable
+
+from GroheClient.metrics import GaugeFunction
+from settings import get_setting as _
+
+# the number of seconds the result of a request is returned again for a repeated idempotency key
+IDEMPOTENCY_TTL = float(_("IDEMPOTENCY/TTL", 3600.0))
+# the maximum number of remembered idempotency keys, the least recently used keys are dropped first
+IDEMPOTENCY_MAX_KEYS = int(_("IDEMPOTENCY/MAX_KEYS", 10000))
+# the maximum length of an idempotency key
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflictError(Exception):
+    """
+    Raised if an idempotency key is reused for a different request.
+    """
+
+    def __init__(self):
+        super().__init__('The Idempotency-Key was already used for a different request.')
+
+
+class IdempotencyRecord:
+    def __init__(self, fingerprint: Hashable, task: asyncio.Task, ttl: float):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.expires_at = time.monotonic() + ttl
+
+    def is_expired(self) -> bool:
+        # a running request never expires, repeats always wait for it
+        return self.task.done() and self.expires_at < time.monotonic()
+
+
+class IdempotencyStore:
+    """
+    Remembers the results of requests by their idempotency key, so a retried request is executed only once.
+
+    A repeat of a running request waits for the same result, a repeat of a finished request gets its result again.
+    The keys expire after ttl seconds and at most max_keys keys are kept, the least recently used are dropped first.
+    The keys are kept in memory, so every worker process has its own store.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max(max_keys, 1)
+        self._records = OrderedDict()
+        self.stats = {
+            'executed' : 0,
+            'replayed' : 0,
+            'waited'   : 0,
+            'conflicts': 0,
+            'evicted'  : 0,
+        }
+
+    async def run(self, key: Hashable, fingerprint: Hashable, execute: Callable[[], Awaitable],
+                  is_final: Callable[[Exception], bool]) -> tuple:
+        """
+        Execute the given request once for the given key, repeats get the same result.
+        Args:
+            key: The idempotency key, scoped to the client which sent it.
+            fingerprint: Identifies the request, a repeat with a different fingerprint is rejected.
+            execute: The coroutine function executing the request.
+            is_final: Whether an exception of the request is returned again to repeats. Otherwise, the key is
+                dropped once the request failed, so a repeat executes the request again.
+
+        Returns: The result of the request and whether it is a repeat.
+        Raises: IdempotencyConflictError if the key was used for a different request.
+            The exception of the request if it failed.
+
+        """
+        record = self._records.get(key)
+        if record is not None and record.is_expired():
+            del self._records[key]
+            record = None
+
+        if record is not None:
+            if record.fingerprint != fingerprint:
+                self.stats['conflicts'] += 1
+                raise IdempotencyConflictError()
+            self._records.move_to_end(key)
+            self.stats['waited' if not record.task.done() else 'replayed'] += 1
+            # the request is shared, so a cancelled repeat must not cancel it
+            return await asyncio.shield(record.task), True
+
+        task = asyncio.ensure_future(execute())
+        self._add(key, IdempotencyRecord(fingerprint, task, self.ttl))
+        self.stats['executed'] += 1
+
+        def done(finished: asyncio.Task) -> None:
+            if finished.cancelled() or (finished.exception() is not None and not is_final(finished.exception())):
+                if self._records.get(key) is not None and self._records[key].task is finished:
+                    del self._records[key]
+
+        task.add_done_callback(done)
+        # the request continues if the client disconnects, so its result is available to a retry
+        return await asyncio.shield(task), False
+
+    def _add(self, key: Hashable, record: IdempotencyRecord) -> None:
+        self._records[key] = record
+        while len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+            self.stats['evicted'] += 1
+
+    def get_stats(self) -> dict:
+        """
+        Returns: The counters of the store and the number of remembered keys.
+
+        """
+        return dict(self.stats, keys=len(self._records))
+
+
+idempotency_store = IdempotencyStore()
+
+GaugeFunction('grohe_idempotency_events_total', 'Executed, replayed, waiting and conflicting requests with an '
+                                                'idempotency key and keys dropped because the store was full.',
+              lambda: {(name,): value for name, value in idempotency_store.stats.items()},
+              label_names=('event',), metric_type='counter')
@@ -0,0 +1,242 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from GroheClient.metrics import GaugeFunction
+from settings import get_setting as _
+
+# the log file, relative to the working directory
+LOG_FILE = _("LOGGING/FILE", 'app.log')
+LOG_LEVEL = str(_("LOGGING/LEVEL", 'INFO')).upper()
+# "json" for one JSON object per line, "text" for plain lines
+LOG_FORMAT = _("LOGGING/FORMAT", 'json')
+# the log file is rotated once it is larger than MAX_BYTES, or at ROTATE_WHEN (e.g. "midnight") if set
+MAX_BYTES = int(_("LOGGING/MAX_BYTES", 10 * 1024 * 1024))
+ROTATE_WHEN = _("LOGGING/ROTATE_WHEN", None)
+# the number of rotated log files which are kept
+BACKUP_COUNT = int(_("LOGGING/BACKUP_COUNT", 5))
+# with several worker processes, all of them append to the log file and it has to be rotated externally
+WORKERS = int(_("SERVER/WORKERS", 1))
+# the maximum number of records waiting to be written, further records are dropped
+QUEUE_SIZE = int(_("LOGGING/QUEUE_SIZE", 10000))
+# log one line per request with its latency
+ACCESS_LOG = bool(_("LOGGING/ACCESS_LOG", True))
+# repeated failed authentications are logged at most once per this many seconds
+AUTH_FAILURE_LOG_INTERVAL = float(_("LOGGING/AUTH_FAILURE_LOG_INTERVAL", 60.0))
+
+REDACTED = '[REDACTED]'
+_REDACT_PATTERNS = (
+    (re.compile(r'(?i)(bearer\s+)[\w\-.~+/]+=*'), r'\1' + REDACTED),
+    (re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]*'), REDACTED),
+    (re.compile(r'(?i)(\b(?:access_token|refresh_token|id_token|password|api_key|apikey|secret|code)'
+                r'["\']?\s*[:=]\s*["\']?)[^"\'&\s,;}]+'), r'\1' + REDACTED),
+)
+# the settings whose values never appear in the logs
+_SECRET_SETTINGS = ("API/API_KEY", "CREDENTIALS/PASSWORD", "MQTT/PASSWORD")
+
+# the attributes of every LogRecord, all other attributes were passed with extra= and are added to the JSON
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'request_id'}
+
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+_listener = None
+_queue_handler = None
+
+
+def redact(message: str) -> str:
+    """
+    Remove tokens, passwords and API keys from the given message.
+    Args:
+        message: The message to redact.
+
+    Returns: The message with the secrets replaced by [REDACTED].
+
+    """
+    for setting in _SECRET_SETTINGS:
+        secret = _(setting, None)
+        if secret and len(str(secret)) >= 4:
+            message = message.replace(str(secret), REDACTED)
+    for pattern, replacement in _REDACT_PATTERNS:
+        message = pattern.sub(replacement, message)
+    return message
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the id of the current request to the records, None outside of requests.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats the records as one JSON object per line, with the secrets redacted.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time'      : datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level'     : record.levelname,
+            'logger'    : record.name,
+            'message'   : redact(record.getMessage()),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRIBUTES:
+                data[name] = value
+        if record.exc_info:
+            data['exception'] = redact(self.formatException(record.exc_info))
+        return json.dumps(data, default=str)
+
+
+class RedactingFormatter(logging.Formatter):
+    """
+    Formats the records as plain lines, with the secrets redacted.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        return redact(super().format(record))
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts the records into a bounded queue without waiting. If the queue is full, the record is dropped,
+    so a flood of log records can never block a request.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def create_file_handler() -> logging.Handler:
+    """
+    Returns: The rotating handler writing the log file. With several worker processes, a handler which only appends
+        and reopens the file once it was rotated by another tool like logrotate, as the processes cannot rotate
+        the shared file without losing each other's records.
+
+    """
+    if WORKERS > 1:
+        handler = logging.handlers.WatchedFileHandler(LOG_FILE, encoding='utf-8')
+    elif ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(LOG_FILE, when=ROTATE_WHEN, backupCount=BACKUP_COUNT,
+                                                            encoding='utf-8')
+    else:
+        handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+                                                       encoding='utf-8')
+    if LOG_FORMAT == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(RedactingFormatter('%(asctime)s %(name)s - %(levelname)s - [%(request_id)s] %(message)s'))
+    return handler
+
+
+def setup_logging() -> None:
+    """
+    Send the records of all loggers through a queue to a background thread, which writes them to the rotating
+    log file. Logging then never waits for the disk. Calling it again has no effect.
+
+    See Also: stop_logging
+
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    _queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, create_file_handler(),
+                                               respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging() -> None:
+    """
+    Write the queued records and stop the background thread.
+
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_dropped_records() -> int:
+    """
+    Returns: The number of records dropped because the queue was full.
+
+    """
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+GaugeFunction('grohe_log_records_dropped_total', 'Log records dropped because the log queue was full.',
+              lambda: {(): get_dropped_records()}, metric_type='counter')
+
+
+class LogRateLimiter:
+    """
+    Limits a repeated message to one line per interval. The line contains the number of suppressed repetitions.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next_log_at = 0.0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[int]:
+        """
+        Returns: The number of repetitions suppressed since the last line if the message may be logged now,
+                 None if it must be suppressed.
+
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_log_at:
+                self._suppressed += 1
+                return None
+            suppressed = self._suppressed
+            self._suppressed = 0
+            self._next_log_at = now + self.interval
+            return suppressed
+
+
+_auth_failure_limiter = LogRateLimiter(AUTH_FAILURE_LOG_INTERVAL)
+
+
+def log_auth_failure(client: Optional[str], path: str) -> None:
+    """
+    Log a request with an invalid API key. Repeated failures are logged at most once per interval,
+    the key itself is never logged.
+    Args:
+        client: The address of the client.
+        path: The requested path.
+
+    """
+    suppressed = _auth_failure_limiter.acquire()
+    if suppressed is None:
+        return
+    logging.warning(f'Invalid API key from {client} for {path}'
+                    + (f', {suppressed} more failed authentications since the last report' if suppressed else ''),
+                    extra={'event': 'auth_failure', 'client': client, 'suppressed': suppressed})
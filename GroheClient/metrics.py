@@ -0,0 +1,214 @@
+import contextlib
+import threading
+import time
+from typing import Callable, Iterable
+
+from settings import get_setting as _
+
+# collecting metrics can be disabled, every metric call then returns at once
+ENABLED = bool(_("METRICS/ENABLED", True))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+
+
+def _format_labels(label_names: tuple, label_values: tuple) -> str:
+    if not label_names:
+        return ''
+    labels = ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(label_names, label_values))
+    return '{' + labels + '}'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    A value which only increases, like the number of requests.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        """
+        Increase the counter with the given label values.
+        Args:
+            label_values: One value per label name.
+            amount: The amount to increase the counter by.
+
+        """
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+class Histogram:
+    """
+    The distribution of observed values, like request durations in seconds.
+    """
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *label_values) -> None:
+        """
+        Add an observation with the given label values.
+        Args:
+            value: The observed value.
+            label_values: One value per label name.
+
+        """
+        if not ENABLED:
+            return
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # one count per bucket, followed by the sum and the count of all observations
+                counts = self._values[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """
+        Observe the duration of the with block in seconds.
+        Args:
+            label_values: One value per label name.
+
+        """
+        if not ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    @contextlib.contextmanager
+    def time_result(self, *label_values):
+        """
+        Observe the duration of the with block in seconds, with "success" or "error" appended to the label values
+        depending on whether the block raised an exception.
+        Args:
+            label_values: One value per label name, except the last one.
+
+        """
+        if not ENABLED:
+            yield
+            return
+        start = time.perf_counter()
+        result = 'error'
+        try:
+            yield
+            result = 'success'
+        finally:
+            self.observe(time.perf_counter() - start, *label_values, result)
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            values = [(label_values, list(counts)) for label_values, counts in self._values.items()]
+        label_names = self.label_names + ('le',)
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(label_names, label_values + (_format_value(bound),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.label_names, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(counts[-2])}'
+            yield f'{self.name}_count{labels} {counts[-1]}'
+
+
+class GaugeFunction:
+    """
+    A value which is read from a function when the metrics are requested, like the age of the access token.
+    """
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], dict], label_names: tuple = (),
+                 metric_type: str = 'gauge'):
+        """
+        Args:
+            name: The name of the metric.
+            documentation: The description of the metric.
+            function: Returns a dict from label value tuples to values, () is the key of a metric without labels.
+            label_names: The names of the labels.
+            metric_type: The Prometheus type of the metric, gauge or counter.
+
+        """
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.label_names = label_names
+        self.metric_type = metric_type
+        _metrics.append(self)
+
+    def render(self) -> Iterable[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.metric_type}'
+        for label_values, value in self.function().items():
+            if value is not None:
+                yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+def render_metrics() -> str:
+    """
+    Returns: All metrics in the Prometheus text format.
+
+    """
+    lines = []
+    for metric in _metrics:
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            lines.append(f'# failed to collect {metric.name}: {_escape(str(e))}')
+    return '\n'.join(lines) + '\n'
+
+
+http_request_duration = Histogram('grohe_http_request_duration_seconds',
+                                  'Duration of the API requests in seconds.', ('method', 'route', 'status_code'))
+command_duration = Histogram('grohe_command_duration_seconds',
+                             'Duration of tap commands including retries in seconds.', ('result',))
+command_retries = Counter('grohe_command_retries_total', 'Retries of tap commands by reason.', ('reason',))
+cloud_responses = Counter('grohe_cloud_responses_total',
+                          'Responses of the Grohe cloud to tap commands by status code.', ('status_code',))
+rate_limited = Counter('grohe_rate_limited_total', 'Tap requests rejected by the rate limits by scope.', ('scope',))
+token_refresh_duration = Histogram('grohe_token_refresh_duration_seconds',
+                                   'Duration of token refreshes in seconds.', ('result',))
+login_duration = Histogram('grohe_login_duration_seconds', 'Duration of logins in seconds.', ('method', 'result'),
+                           buckets=(0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60))
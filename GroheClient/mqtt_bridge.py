@@ -0,0 +1,271 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+from GroheClient.devices import device_registry
+from GroheClient.dispense import REJECTIONS, dispense
+from GroheClient.events import (
+    COMMAND_ACKNOWLEDGED, COMMAND_CANCELLED, COMMAND_FAILED, COMMAND_QUEUED, COMMAND_SENT, MEASUREMENTS_UPDATED,
+    STATUS_UPDATED, Event, event_bus
+)
+from GroheClient.file_lock import file_lock
+from GroheClient.idempotency import IdempotencyConflictError, idempotency_store
+from GroheClient.rate_limit import KEY_BURST, KEY_RATE, TokenBucket
+from GroheClient.scheduler import JOB_COMPLETED
+from settings import get_setting as _, get_settings
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+MQTT_ENABLED = bool(_("MQTT/ENABLED", False))
+MQTT_HOST = str(_("MQTT/HOST", "localhost"))
+MQTT_PORT = int(_("MQTT/PORT", 1883))
+MQTT_USERNAME = _("MQTT/USERNAME", None)
+MQTT_PASSWORD = _("MQTT/PASSWORD", None)
+MQTT_CLIENT_ID = str(_("MQTT/CLIENT_ID", "grohe-blue-api"))
+# the seconds between two keep-alive pings of the connection to the broker
+MQTT_KEEP_ALIVE = int(_("MQTT/KEEP_ALIVE", 60))
+# the QoS of the subscribed command topics and of the published messages
+MQTT_QOS = int(_("MQTT/QOS", 1))
+# all topics start with this prefix, followed by the device id
+TOPIC_PREFIX = str(_("MQTT/TOPIC_PREFIX", "grohe")).rstrip('/')
+# the tap rate limit of the bridge, like the limit of an API key
+MQTT_RATE = float(_("MQTT/RATE", KEY_RATE))
+MQTT_BURST = float(_("MQTT/BURST", KEY_BURST))
+# held by the worker process running the bridge, the other workers do not connect to the broker
+MQTT_LOCK_FILE = os.path.join(os.path.dirname(get_settings().path), '.mqtt.lock')
+
+# the tap commands, e.g. {"tap_type": 2, "amount": 250, "id": "<unique id>"}
+TAP_TOPIC = TOPIC_PREFIX + '/{device_id}/tap/set'
+# the result of every tap command
+RESULT_TOPIC = TOPIC_PREFIX + '/{device_id}/tap/result'
+# retained: the last command event, the status and the measurements of the device
+COMMAND_TOPIC = TOPIC_PREFIX + '/{device_id}/command'
+STATUS_TOPIC = TOPIC_PREFIX + '/{device_id}/status'
+MEASUREMENTS_TOPIC = TOPIC_PREFIX + '/{device_id}/measurements'
+# retained: "online" while the bridge is connected, "offline" otherwise
+AVAILABILITY_TOPIC = TOPIC_PREFIX + '/bridge/availability'
+
+RESULT_COMPLETED = 'completed'
+RESULT_FAILED = 'failed'
+RESULT_REJECTED = 'rejected'
+
+# the events published to the retained state topics
+_STATE_TOPICS = {
+    COMMAND_QUEUED      : COMMAND_TOPIC,
+    COMMAND_SENT        : COMMAND_TOPIC,
+    COMMAND_ACKNOWLEDGED: COMMAND_TOPIC,
+    COMMAND_FAILED      : COMMAND_TOPIC,
+    COMMAND_CANCELLED   : COMMAND_TOPIC,
+    STATUS_UPDATED      : STATUS_TOPIC,
+    MEASUREMENTS_UPDATED: MEASUREMENTS_TOPIC,
+}
+
+
+def create_client():
+    """
+    Create the MQTT client of the bridge, configured by the MQTT section of the settings.
+
+    Returns: The paho MQTT client.
+
+    """
+    try:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=MQTT_CLIENT_ID)
+    except AttributeError:
+        # paho-mqtt before 2.0
+        client = mqtt.Client(client_id=MQTT_CLIENT_ID)
+    if MQTT_USERNAME:
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+    client.will_set(AVAILABILITY_TOPIC, 'offline', qos=MQTT_QOS, retain=True)
+    client.reconnect_delay_set(1, 30)
+    return client
+
+
+def parse_tap_command(payload: bytes) -> tuple:
+    """
+    Parse the payload of a tap command.
+    Args:
+        payload: The JSON payload, e.g. {"tap_type": 2, "amount": 250, "id": "<unique id>"}. The id is optional,
+                 repeated commands with the same id are only executed once.
+
+    Returns: A (tap type, amount, id) tuple, the id is None if it is missing.
+    Raises: ValueError if the payload is invalid.
+
+    """
+    try:
+        command = json.loads(payload)
+        command_id = command.get('id')
+        return int(command['tap_type']), int(command['amount']), None if command_id is None else str(command_id)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError('The command must be a JSON object with an integer tap_type and amount.')
+
+
+class MqttBridge:
+    """
+    Controls the appliances over MQTT, next to the HTTP routes and over one long-lived connection to the broker.
+
+    Tap commands published to the tap topic of a device are executed on the same path as the HTTP routes,
+    with validation, rate limit, circuit breaker and admission control, and their results are published to the
+    result topic. The command events, the status and the measurements of the devices are published to retained
+    topics. The network loop of paho runs in its own thread, the commands are executed on the event loop.
+    """
+
+    def __init__(self, client_factory=create_client):
+        """
+        Args:
+            client_factory: Creates the MQTT client, e.g. one connected to a broker stand-in in tests.
+
+        """
+        self._client_factory = client_factory
+        self._client = None
+        self._loop = None
+        self._forwarder = None
+        self._lock = contextlib.ExitStack()
+        self.bucket = TokenBucket(MQTT_RATE, MQTT_BURST)
+
+    def start(self) -> None:
+        """
+        Connect to the broker in the background, must be called on the event loop.
+        The client reconnects by itself if the connection is lost. With several worker processes,
+        only one of them runs the bridge.
+
+        Raises: RuntimeError if paho-mqtt is not installed.
+
+        """
+        if self._client is not None:
+            return
+        if mqtt is None and self._client_factory is create_client:
+            raise RuntimeError('The MQTT bridge is enabled, but paho-mqtt is not installed: '
+                               'pip install -r requirements-mqtt.txt')
+        if not self._lock.enter_context(file_lock(MQTT_LOCK_FILE, blocking=False)):
+            logging.info('Another worker runs the MQTT bridge')
+            self._lock.close()
+            return
+        self._loop = asyncio.get_running_loop()
+        self._client = self._client_factory()
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self._client.connect_async(MQTT_HOST, MQTT_PORT, MQTT_KEEP_ALIVE)
+        self._client.loop_start()
+        self._forwarder = asyncio.ensure_future(self._forward_events())
+        logging.info(f'Connecting the MQTT bridge to {MQTT_HOST}:{MQTT_PORT}')
+
+    async def stop(self) -> None:
+        """
+        Publish the offline state and disconnect from the broker.
+
+        """
+        if self._client is None:
+            return
+        self._forwarder.cancel()
+        client, self._client = self._client, None
+        client.publish(AVAILABILITY_TOPIC, 'offline', qos=MQTT_QOS, retain=True)
+        client.disconnect()
+        await asyncio.to_thread(client.loop_stop)
+        self._lock.close()
+
+    def publish(self, topic: str, data, retain: bool = False) -> None:
+        """
+        Publish the given data as JSON. The client queues the message if it is not connected.
+        Args:
+            topic: The topic.
+            data: The data, it must be serializable to JSON.
+            retain: Whether the broker keeps the message for new subscribers.
+
+        """
+        client = self._client
+        if client is not None:
+            client.publish(topic, json.dumps(data), qos=MQTT_QOS, retain=retain)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None) -> None:
+        if reason_code != 0:
+            logging.error(f'The MQTT broker refused the connection: {reason_code}')
+            return
+        logging.info('Connected the MQTT bridge')
+        # subscriptions are renewed on every reconnect
+        client.subscribe(TAP_TOPIC.format(device_id='+'), qos=MQTT_QOS)
+        client.publish(AVAILABILITY_TOPIC, 'online', qos=MQTT_QOS, retain=True)
+
+    def _on_message(self, client, userdata, message) -> None:
+        # called by the network thread of paho, the command is executed on the event loop
+        device_id = message.topic[len(TOPIC_PREFIX) + 1:].split('/', 1)[0]
+        asyncio.run_coroutine_threadsafe(self.handle_tap_command(device_id, message.payload), self._loop)
+
+    async def handle_tap_command(self, device_id: str, payload: bytes) -> dict:
+        """
+        Execute a tap command received on the tap topic of the given device and publish its result.
+        Args:
+            device_id: The device id from the topic.
+            payload: The payload of the command.
+
+        Returns: The published result.
+
+        """
+        start = time.perf_counter()
+        result = {'id': None, 'status': RESULT_REJECTED, 'error': None}
+        try:
+            tap_type, amount, result['id'] = parse_tap_command(payload)
+            result.update(tap_type=tap_type, amount=amount)
+            appliance = device_registry.get(device_id)
+            if appliance is None:
+                raise ValueError(f'Unknown device: {device_id}')
+
+            if result['id'] is None:
+                job = await dispense(self.bucket, appliance, tap_type, amount)
+            else:
+                # brokers redeliver QoS 1 messages, so a command id is only executed once
+                job, _replayed = await idempotency_store.run(('mqtt', device_id, result['id']),
+                                                             (appliance.appliance_id, tap_type, amount),
+                                                             lambda: dispense(self.bucket, appliance, tap_type, amount),
+                                                             lambda error: not isinstance(error, REJECTIONS))
+            if job.status == JOB_COMPLETED:
+                result['status'] = RESULT_COMPLETED
+            else:
+                result.update(status=RESULT_FAILED, error='Could not execute command')
+        except (ValueError, IdempotencyConflictError, *REJECTIONS) as e:
+            result['error'] = str(e)
+        except Exception as e:
+            logging.error(f'Could not execute the MQTT command for {device_id}: {e}')
+            result.update(status=RESULT_FAILED, error='Could not execute command')
+
+        result['latency_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        self.publish(RESULT_TOPIC.format(device_id=device_id), result)
+        return result
+
+    async def _forward_events(self) -> None:
+        subscription = event_bus.subscribe(frozenset(_STATE_TOPICS))
+        try:
+            while True:
+                event = await subscription.get()
+                if event is not None:
+                    self._publish_state(event)
+        finally:
+            subscription.close()
+
+    def _publish_state(self, event: Event) -> None:
+        appliance = device_registry.get(event.data.get('appliance_id'))
+        if appliance is None:
+            return
+        if event.event_type == STATUS_UPDATED:
+            data = event.data['status']
+        elif event.event_type == MEASUREMENTS_UPDATED:
+            data = event.data['measurements']
+        else:
+            data = dict(event.data, event=event.event_type, time=event.time)
+        self.publish(_STATE_TOPICS[event.event_type].format(device_id=appliance.device_id), data, retain=True)
+
+    def is_connected(self) -> Optional[bool]:
+        """
+        Returns: Whether the bridge is connected to the broker, None if it is not started.
+
+        """
+        return None if self._client is None else self._client.is_connected()
+
+
+mqtt_bridge = MqttBridge()
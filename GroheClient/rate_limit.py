@@ -0,0 +1,126 @@
+import threading
+import time
+
+from GroheClient.metrics import rate_limited
+from settings import get_setting as _
+
+# the default number of tap requests per second and the burst size of an API key, 0 disables the limit
+KEY_RATE = float(_("RATE_LIMIT/KEY_RATE", 1.0))
+KEY_BURST = float(_("RATE_LIMIT/KEY_BURST", 10.0))
+# the number of tap requests per second and the burst size of an appliance across all API keys, 0 disables the limit
+APPLIANCE_RATE = float(_("RATE_LIMIT/APPLIANCE_RATE", 0.5))
+APPLIANCE_BURST = float(_("RATE_LIMIT/APPLIANCE_BURST", 5.0))
+
+
+class RateLimitError(Exception):
+    """
+    Raised if a request exceeds a rate limit.
+    """
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f'Too many requests for this {scope}. Try again in {retry_after:.1f} seconds.')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    A token bucket: it holds up to burst tokens and is refilled with rate tokens per second.
+    Every request takes one token.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        """
+        Args:
+            rate: The number of tokens added per second, 0 disables the limit.
+            burst: The maximum number of tokens.
+
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take a token if one is available.
+        Returns: 0 if a token was taken, otherwise the number of seconds until the next token is available.
+
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._tokens + (now - self._updated_at) * self.rate, self.burst)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def release(self) -> None:
+        """
+        Return a token taken by acquire, because the request was rejected by another limit.
+
+        """
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self._tokens + 1, self.burst)
+
+
+class RateLimiter:
+    """
+    Limits the tap requests per API key and per appliance. The limit of an appliance protects the account from
+    being throttled by the Grohe cloud, no matter how many API keys use the appliance.
+    """
+
+    def __init__(self, appliance_rate: float = APPLIANCE_RATE, appliance_burst: float = APPLIANCE_BURST):
+        self.appliance_rate = appliance_rate
+        self.appliance_burst = appliance_burst
+        self._appliance_buckets = {}
+        self._lock = threading.Lock()
+
+    def get_appliance_bucket(self, appliance_id: str) -> TokenBucket:
+        bucket = self._appliance_buckets.get(appliance_id)
+        if bucket is None:
+            with self._lock:
+                bucket = self._appliance_buckets.setdefault(appliance_id,
+                                                            TokenBucket(self.appliance_rate, self.appliance_burst))
+        return bucket
+
+    def check(self, key_bucket: TokenBucket, appliance_id: str) -> None:
+        """
+        Take a token of the API key and of the appliance.
+        Args:
+            key_bucket: The token bucket of the API key.
+            appliance_id: The Grohe appliance id.
+
+        Raises: RateLimitError if the API key or the appliance exceeded its limit.
+
+        """
+        retry_after = key_bucket.acquire()
+        if retry_after:
+            rate_limited.inc('key')
+            raise RateLimitError('API key', retry_after)
+
+        retry_after = self.get_appliance_bucket(appliance_id).acquire()
+        if retry_after:
+            key_bucket.release()
+            rate_limited.inc('appliance')
+            raise RateLimitError('appliance', retry_after)
+
+    def release(self, key_bucket: TokenBucket, appliance_id: str) -> None:
+        """
+        Return the tokens taken by check, because the request was rejected before it was executed.
+        Args:
+            key_bucket: The token bucket of the API key.
+            appliance_id: The Grohe appliance id.
+
+        """
+        key_bucket.release()
+        self.get_appliance_bucket(appliance_id).release()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,133 @@
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from settings import get_setting as _
+
+# the maximum number of seconds a command may take including all retries
+DEADLINE = float(_("RETRY/DEADLINE", 8.0))
+# the maximum number of attempts of a command
+MAX_ATTEMPTS = int(_("RETRY/MAX_ATTEMPTS", 3))
+# the delay before the first retry, it doubles with every retry up to MAX_DELAY
+BASE_DELAY = float(_("RETRY/BASE_DELAY", 0.5))
+MAX_DELAY = float(_("RETRY/MAX_DELAY", 4.0))
+# also retry responses and errors after which the command may have reached the appliance,
+# this can dispense the water twice
+RETRY_AMBIGUOUS = bool(_("RETRY/RETRY_AMBIGUOUS", False))
+
+# status codes after which the command was not executed and can be retried safely
+SAFE_RETRY_STATUS_CODES = (429, 503)
+# status codes after which the command may have been executed
+AMBIGUOUS_RETRY_STATUS_CODES = (500, 502, 504)
+
+
+def is_connect_error(exception: Exception) -> bool:
+    """
+    Check whether the given exception happened before the request was sent, so the command was not executed.
+    Args:
+        exception: An exception raised by requests or httpx.
+
+    Returns: True if no connection could be established, False otherwise.
+
+    """
+    if isinstance(exception, (httpx.ConnectError, httpx.ConnectTimeout, requests.ConnectTimeout)):
+        return True
+    if isinstance(exception, requests.ConnectionError) and exception.args:
+        return isinstance(getattr(exception.args[0], 'reason', None), NewConnectionError)
+    return False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the value of a Retry-After header.
+    Args:
+        value: The header value, either a number of seconds or an HTTP date.
+
+    Returns: The number of seconds to wait, or None if the value is missing or invalid.
+
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed command is retried.
+
+    Retries use exponential backoff with full jitter and must finish within the deadline, otherwise the water
+    would be dispensed long after the user expects it. Only failures after which the command was certainly not
+    executed are retried, unless retry_ambiguous is set: a 429 or 503 response and errors while connecting.
+    A 401 response is handled by the caller, which refreshes the tokens and retries at once.
+    """
+
+    def __init__(self, deadline: float = DEADLINE, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY,
+                 max_delay: float = MAX_DELAY, retry_ambiguous: bool = RETRY_AMBIGUOUS):
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_ambiguous = retry_ambiguous
+
+    def backoff(self, attempt: int) -> float:
+        """
+        Args:
+            attempt: The number of attempts made so far, starting at 1.
+
+        Returns: A random delay between 0 and the exponential backoff of the given attempt.
+
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def get_retry_delay(self, attempt: int, elapsed: float, status_code: Optional[int] = None,
+                        retry_after: Optional[str] = None, exception: Optional[Exception] = None) -> Optional[float]:
+        """
+        Decide whether a failed attempt is retried.
+        Args:
+            attempt: The number of attempts made so far, starting at 1.
+            elapsed: The number of seconds since the first attempt started.
+            status_code: The status code of the failed response, if there was a response.
+            retry_after: The Retry-After header of the failed response.
+            exception: The exception raised by the attempt, if there was no response.
+
+        Returns: The number of seconds to wait before the next attempt, or None if the command must not be retried.
+
+        """
+        if attempt >= self.max_attempts:
+            return None
+
+        if exception is not None:
+            retryable = is_connect_error(exception) or self.retry_ambiguous
+        elif status_code in SAFE_RETRY_STATUS_CODES:
+            retryable = True
+        else:
+            retryable = self.retry_ambiguous and status_code in AMBIGUOUS_RETRY_STATUS_CODES
+        if not retryable:
+            return None
+
+        delay = parse_retry_after(retry_after)
+        if delay is None:
+            delay = self.backoff(attempt)
+
+        # give up at once if the next attempt could not start before the deadline
+        if elapsed + delay >= self.deadline:
+            return None
+        return delay
+
+
+retry_policy = RetryPolicy()
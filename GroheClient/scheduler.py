@@ -0,0 +1,369 @@
+import asyncio
+import collections
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable, Optional
+
+from GroheClient.commands import MAX_TAP_AMOUNT, check_tap_params
+from GroheClient.events import (
+    COMMAND_ACKNOWLEDGED, COMMAND_CANCELLED, COMMAND_FAILED, COMMAND_QUEUED, COMMAND_SENT, event_bus
+)
+from settings import get_setting as _
+
+# the number of milliliters the appliance dispenses per second, used to pace the commands of a queue
+DISPENSE_RATE = float(_("QUEUE/DISPENSE_RATE", 25.0))
+# the maximum number of commands a single job may consist of
+MAX_JOB_COMMANDS = int(_("QUEUE/MAX_JOB_COMMANDS", 20))
+# the number of finished jobs which are kept for status requests
+MAX_FINISHED_JOBS = int(_("QUEUE/MAX_FINISHED_JOBS", 1000))
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+
+def split_dispenses(dispenses: list, coalesce: bool = False) -> list:
+    """
+    Split the given dispenses into commands the appliance accepts.
+    Amounts above the maximum amount of a single command are split into several commands.
+    Args:
+        dispenses: A list of (tap_type, amount) tuples.
+        coalesce: If True, consecutive dispenses of the same tap type are merged into as few commands as possible.
+
+    Returns: A list of (tap_type, amount) tuples, each a valid tap command.
+    Raises: ValueError if a dispense is invalid or the job consists of too many commands.
+
+    """
+    if not dispenses:
+        raise ValueError('A job needs at least one dispense.')
+
+    if coalesce:
+        merged = []
+        for tap_type, amount in dispenses:
+            if merged and merged[-1][0] == tap_type:
+                merged[-1] = (tap_type, merged[-1][1] + amount)
+            else:
+                merged.append((tap_type, amount))
+        dispenses = merged
+
+    commands = []
+    for tap_type, amount in dispenses:
+        if amount <= 0:
+            raise ValueError('The amount must be a multiple of 50 and greater than 0.')
+        while amount > 0:
+            command_amount = min(amount, MAX_TAP_AMOUNT)
+            check_tap_params(tap_type, command_amount)
+            commands.append((tap_type, command_amount))
+            amount -= command_amount
+
+    if len(commands) > MAX_JOB_COMMANDS:
+        raise ValueError(f'A job may consist of at most {MAX_JOB_COMMANDS} commands of up to {MAX_TAP_AMOUNT} ml.')
+    return commands
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised if a job could not be started before its deadline, none of its commands was sent.
+    """
+
+    def __init__(self):
+        super().__init__('The command could not be sent within its deadline.')
+
+
+class Job:
+    """
+    A list of tap commands which are executed in order on one appliance.
+    """
+
+    def __init__(self, appliance_id: str, commands: list, deadline: Optional[float] = None):
+        """
+        Args:
+            appliance_id: The id of the appliance.
+            commands: A list of (tap_type, amount) tuples.
+            deadline: The time.monotonic() by which the first command must be sent, None to wait as long as needed.
+                A job which could not start in time fails with a DeadlineExceededError instead of dispensing late.
+
+        """
+        self.job_id = uuid.uuid4().hex
+        self.appliance_id = appliance_id
+        self.commands = commands
+        self.status = JOB_QUEUED
+        self.error = None
+        self.exception = None
+        self.deadline = deadline
+        self.cancel_requested = False
+        self.completed_commands = 0
+        self.created_at = time.time()
+        self.finished_at = None
+        self._done = asyncio.Event()
+
+    def is_finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+    def is_expired(self, start: float) -> bool:
+        """
+        Args:
+            start: The time.monotonic() at which the first command could be sent.
+
+        Returns: Whether the job would start after its deadline.
+
+        """
+        return self.deadline is not None and start > self.deadline
+
+    def expire(self) -> None:
+        error = DeadlineExceededError()
+        self.finish(JOB_FAILED, str(error), error)
+
+    def finish(self, status: str, error: Optional[str] = None, exception: Optional[Exception] = None) -> None:
+        self.status = status
+        self.error = error
+        self.exception = exception
+        self.finished_at = time.time()
+        self._done.set()
+        if status == JOB_CANCELLED:
+            self.publish(COMMAND_CANCELLED)
+        elif status == JOB_FAILED:
+            self.publish(COMMAND_FAILED, error=error)
+
+    def publish(self, event_type: str, **data) -> None:
+        """
+        Publish an event about this job to the event streams.
+        Args:
+            event_type: The type of the event.
+            **data: Additional data of the event, like the command which was sent.
+
+        """
+        event_bus.publish(event_type, dict(job_id=self.job_id, appliance_id=self.appliance_id, **data))
+
+    async def wait(self) -> None:
+        """
+        Wait until the job is finished.
+
+        """
+        await self._done.wait()
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id'            : self.job_id,
+            'appliance_id'      : self.appliance_id,
+            'status'            : self.status,
+            'error'             : self.error,
+            'cancel_requested'  : self.cancel_requested,
+            'commands'          : [{'tap_type': tap_type, 'amount': amount} for tap_type, amount in self.commands],
+            'completed_commands': self.completed_commands,
+            'dispensed_amount'  : sum(amount for _type, amount in self.commands[:self.completed_commands]),
+            'created_at'        : self.created_at,
+            'finished_at'       : self.finished_at,
+        }
+
+
+class CommandScheduler:
+    """
+    Executes the jobs of one appliance one after another in FIFO order.
+    After a command was sent, the next command waits until the appliance finished dispensing,
+    based on the dispense rate of the appliance.
+    """
+
+    def __init__(self, appliance_id: str, execute: Callable[[int, int], Awaitable[bool]]):
+        """
+        Args:
+            appliance_id: The id of the appliance the jobs are executed on.
+            execute: The coroutine function which executes a single tap command, like async_execute_tap_command.
+
+        """
+        self.appliance_id = appliance_id
+        self._execute = execute
+        self._queue = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+        self._ready_at = 0.0
+        self.current_job = None
+
+    def submit(self, job: Job) -> None:
+        """
+        Add the given job to the end of the queue.
+        Args:
+            job: The job to execute.
+
+        """
+        self._queue.append(job)
+        self._wakeup.set()
+        if job.deadline is not None:
+            asyncio.get_running_loop().call_later(max(job.deadline - time.monotonic(), 0), self._expire, job)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run())
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Cancel the given job. A queued job is removed from the queue, a running job stops after the current command.
+        Args:
+            job: The job to cancel.
+
+        Returns: True if the job was cancelled, False if it was already finished.
+
+        """
+        if job.is_finished():
+            return False
+        if job.status == JOB_QUEUED:
+            self._queue.remove(job)
+            job.finish(JOB_CANCELLED)
+        else:
+            job.cancel_requested = True
+        return True
+
+    def get_queue_length(self) -> int:
+        return len(self._queue)
+
+    def _expire(self, job: Job) -> None:
+        # called at the deadline of a job, it fails if it is still waiting behind other jobs
+        if job.status == JOB_QUEUED and job in self._queue:
+            self._queue.remove(job)
+            job.expire()
+
+    async def stop(self) -> None:
+        """
+        Stop the worker and cancel all queued jobs.
+
+        """
+        while self._queue:
+            self._queue.popleft().finish(JOB_CANCELLED)
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job = self._queue.popleft()
+            self.current_job = job
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                job.finish(JOB_CANCELLED)
+                raise
+            finally:
+                self.current_job = None
+
+    async def _run_job(self, job: Job) -> None:
+        if job.is_expired(max(self._ready_at, time.monotonic())):
+            # the appliance is still busy with previous commands, the job would dispense too late
+            job.expire()
+            return
+        job.status = JOB_RUNNING
+        for tap_type, amount in job.commands:
+            # wait until the appliance finished the previous command
+            delay = self._ready_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            if job.cancel_requested:
+                job.finish(JOB_CANCELLED)
+                return
+
+            job.publish(COMMAND_SENT, tap_type=tap_type, amount=amount)
+            try:
+                success = await self._execute(tap_type, amount)
+            except Exception as e:
+                logging.error(f'Job {job.job_id} failed: {e}')
+                job.finish(JOB_FAILED, str(e), e)
+                return
+            if not success:
+                job.finish(JOB_FAILED, 'Could not execute command')
+                return
+
+            job.completed_commands += 1
+            job.publish(COMMAND_ACKNOWLEDGED, tap_type=tap_type, amount=amount)
+            self._ready_at = time.monotonic() + amount / DISPENSE_RATE
+
+        job.finish(JOB_COMPLETED)
+
+
+class JobManager:
+    """
+    Keeps one scheduler per appliance and the jobs submitted to them.
+    """
+
+    def __init__(self):
+        self._schedulers = {}
+        self._jobs = collections.OrderedDict()
+
+    def get_scheduler(self, appliance_id: str, execute: Callable[[int, int], Awaitable[bool]]) -> CommandScheduler:
+        """
+        Get the scheduler of the given appliance, it is created on first use.
+        Args:
+            appliance_id: The id of the appliance.
+            execute: The coroutine function which executes a single tap command on the appliance.
+
+        Returns: The scheduler of the appliance.
+
+        """
+        scheduler = self._schedulers.get(appliance_id)
+        if scheduler is None:
+            scheduler = self._schedulers[appliance_id] = CommandScheduler(appliance_id, execute)
+        return scheduler
+
+    def submit(self, appliance_id: str, execute: Callable[[int, int], Awaitable[bool]], dispenses: list,
+               coalesce: bool = False, deadline: Optional[float] = None) -> Job:
+        """
+        Create a job for the given dispenses and add it to the queue of the appliance.
+        Args:
+            appliance_id: The id of the appliance.
+            execute: The coroutine function which executes a single tap command on the appliance.
+            dispenses: A list of (tap_type, amount) tuples. Amounts may exceed the maximum amount of a single command.
+            coalesce: If True, consecutive dispenses of the same tap type are merged.
+            deadline: The time.monotonic() by which the first command must be sent, None to wait as long as needed.
+
+        Returns: The queued job.
+        Raises: ValueError if the dispenses are invalid.
+
+        See Also: split_dispenses
+
+        """
+        job = Job(appliance_id, split_dispenses(dispenses, coalesce), deadline)
+        self._jobs[job.job_id] = job
+        self._forget_finished_jobs()
+        self.get_scheduler(appliance_id, execute).submit(job)
+        job.publish(COMMAND_QUEUED, commands=job.to_dict()['commands'])
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job: Job) -> bool:
+        """
+        Cancel the given job.
+        Returns: True if the job was cancelled, False if it was already finished.
+
+        See Also: CommandScheduler.cancel
+
+        """
+        return self._schedulers[job.appliance_id].cancel(job)
+
+    async def stop(self) -> None:
+        """
+        Stop all schedulers.
+
+        """
+        for scheduler in self._schedulers.values():
+            await scheduler.stop()
+
+    def _forget_finished_jobs(self) -> None:
+        if len(self._jobs) <= MAX_FINISHED_JOBS:
+            return
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.is_finished()]:
+            if len(self._jobs) <= MAX_FINISHED_JOBS:
+                break
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
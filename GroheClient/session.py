@@ -0,0 +1,187 @@
+import logging
+import socket
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from GroheClient.metrics import GaugeFunction
+from settings import get_setting as _
+
+# the base url of the Grohe cloud, can be pointed to a mock of the cloud, see benchmark/mock_cloud.py
+GROHE_API_BASE_URL = str(_("CLOUD/BASE_URL", "https://idp2-apigw.cloud.grohe.com")).rstrip('/')
+
+POOL_SIZE = int(_("HTTP/POOL_SIZE", 10))
+KEEP_ALIVE = bool(_("HTTP/KEEP_ALIVE", True))
+CONNECT_TIMEOUT = float(_("HTTP/CONNECT_TIMEOUT", 3.05))
+READ_TIMEOUT = float(_("HTTP/READ_TIMEOUT", 10.0))
+HTTP2 = bool(_("HTTP/HTTP2", False))
+
+_session = None
+_session_lock = threading.Lock()
+_async_client = None
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter which enables TCP keep-alive on the pooled connections,
+    so idle connections to the Grohe cloud are not silently dropped by NAT routers or the gateway.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+
+def get_timeout() -> tuple:
+    """
+    Get the timeout used for requests to the Grohe cloud.
+    Returns: A (connect, read) timeout tuple in seconds.
+
+    """
+    return CONNECT_TIMEOUT, READ_TIMEOUT
+
+
+def create_session() -> requests.Session:
+    """
+    Create a new session with a connection pool for the Grohe cloud.
+    Returns: The session.
+
+    """
+    session = requests.Session()
+    adapter_class = KeepAliveHTTPAdapter if KEEP_ALIVE else HTTPAdapter
+    adapter = adapter_class(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not KEEP_ALIVE:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    Get the shared session used by every request to the Grohe cloud.
+    The session is created on first use.
+    Returns: The shared session.
+
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+
+def warm_up() -> None:
+    """
+    Open a connection to the Grohe cloud, so the DNS lookup and the TCP and TLS handshakes
+    are already done when the first command is sent.
+    Errors are logged and ignored, a failed warm-up only means the first request is slower.
+
+    """
+    try:
+        get_session().head(GROHE_API_BASE_URL, timeout=get_timeout())
+    except requests.RequestException as e:
+        logging.warning(f'Could not warm up the connection to the Grohe cloud: {e}')
+
+
+def _http2_available() -> bool:
+    """
+    Check whether HTTP/2 can be used for the async client.
+    HTTP/2 needs the optional h2 package (pip install httpx[http2]).
+    Returns: True if HTTP/2 is enabled and available, False otherwise.
+
+    """
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logging.warning('HTTP/2 is enabled but the h2 package is not installed. Falling back to HTTP/1.1.')
+        return False
+    return True
+
+
+def create_async_client() -> httpx.AsyncClient:
+    """
+    Create a new async client with a connection pool for the Grohe cloud.
+    Returns: The async client.
+
+    """
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(max_connections=POOL_SIZE,
+                            max_keepalive_connections=POOL_SIZE if KEEP_ALIVE else 0),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Get the shared async client used by every async request to the Grohe cloud.
+    The client is created on first use and must only be used from one event loop.
+    Returns: The shared async client.
+
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = create_async_client()
+    return _async_client
+
+
+async def async_warm_up() -> None:
+    """
+    Async version of warm_up.
+
+    See Also: warm_up
+
+    """
+    try:
+        await get_async_client().head(GROHE_API_BASE_URL)
+    except httpx.HTTPError as e:
+        logging.warning(f'Could not warm up the connection to the Grohe cloud: {e}')
+
+
+async def close_async_client() -> None:
+    """
+    Close the shared async client and all of its pooled connections.
+
+    """
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def get_pool_stats() -> dict:
+    """
+    Get the number of active and idle pooled connections of the shared session and async client.
+    Returns: A dict from (client, state) tuples to the number of connections.
+
+    """
+    stats = {}
+    if _session is not None:
+        active = idle = 0
+        for adapter in _session.adapters.values():
+            for key in adapter.poolmanager.pools.keys():
+                pool = adapter.poolmanager.pools[key]
+                connections = list(pool.pool.queue)
+                idle += sum(1 for connection in connections if connection is not None)
+                active += pool.pool.maxsize - len(connections)
+        stats[('sync', 'active')] = active
+        stats[('sync', 'idle')] = idle
+    if _async_client is not None and not _async_client.is_closed:
+        connections = _async_client._transport._pool.connections
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats[('async', 'active')] = len(connections) - idle
+        stats[('async', 'idle')] = idle
+    return stats
+
+
+GaugeFunction('grohe_http_pool_connections', 'Pooled connections to the Grohe cloud.', get_pool_stats,
+              label_names=('client', 'state'))
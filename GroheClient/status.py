@@ -0,0 +1,148 @@
+import asyncio
+
+import httpx
+
+from GroheClient.base import async_get_access_token, async_refresh_tokens
+from GroheClient.cache import AsyncTTLCache, CacheEntry
+from GroheClient.circuit_breaker import circuit_breaker
+from GroheClient.devices import Appliance
+from GroheClient.events import MEASUREMENTS_UPDATED, STATUS_UPDATED, event_bus
+from GroheClient.metrics import GaugeFunction
+from GroheClient.session import get_async_client
+from GroheClient.tap_controller import async_execute_control_command, get_auth_header, record_response
+from settings import get_setting as _
+
+# the number of seconds the status and the measurements of an appliance are reused without asking the cloud
+CACHE_TTL = float(_("STATUS/CACHE_TTL", 30.0))
+# the number of seconds after CACHE_TTL an outdated value is still returned while it is updated in the background
+STALE_TTL = float(_("STATUS/STALE_TTL", 300.0))
+
+STATUS = 'status'
+MEASUREMENTS = 'measurements'
+
+status_cache = AsyncTTLCache(CACHE_TTL, STALE_TTL)
+
+
+async def _async_get_json(url: str):
+    """
+    Request the given url of the Grohe cloud. After a 401 response the tokens are refreshed and the request is
+    sent again once. Failed requests are not retried, the cache returns the last value instead.
+    Args:
+        url: The url to request.
+
+    Returns: The decoded JSON response.
+    Raises: CircuitOpenError if the circuit breaker is open. An exception of httpx if the request failed.
+
+    """
+    refreshed = False
+    while True:
+        access_token = await async_get_access_token()
+        headers = {
+            "Authorization": get_auth_header(access_token),
+            "Accept"       : "application/json",
+        }
+
+        circuit_breaker.before_request()
+        try:
+            response = await get_async_client().get(url, headers=headers)
+        except (asyncio.CancelledError, httpx.HTTPError):
+            circuit_breaker.record_failure()
+            raise
+
+        record_response(response.status_code)
+        if response.status_code == 401 and not refreshed:
+            await async_refresh_tokens(access_token)
+            refreshed = True
+            continue
+        response.raise_for_status()
+        return response.json()
+
+
+async def fetch_status(appliance: Appliance) -> dict:
+    """
+    Request the status of the given appliance from the Grohe cloud, like its connection and available updates.
+    The status is published to the event streams.
+    Args:
+        appliance: The appliance.
+
+    Returns: A dict from the status types to their values.
+
+    """
+    status = await _async_get_json(appliance.url + '/status')
+    if isinstance(status, list):
+        status = {item['type']: item.get('value') for item in status if isinstance(item, dict) and 'type' in item}
+    event_bus.publish(STATUS_UPDATED, {'appliance_id': appliance.appliance_id, 'status': status})
+    return status
+
+
+async def fetch_measurements(appliance: Appliance) -> dict:
+    """
+    Request the latest measurements of the given appliance from the Grohe cloud,
+    like the remaining filter capacity and CO2. The measurements are published to the event streams.
+    Args:
+        appliance: The appliance.
+
+    Returns: The latest measurements.
+
+    """
+    details = await _async_get_json(appliance.url + '/details')
+    measurements = ((details or {}).get('data_latest') or {}).get('measurement') or {}
+    event_bus.publish(MEASUREMENTS_UPDATED, {'appliance_id': appliance.appliance_id, 'measurements': measurements})
+    return measurements
+
+
+async def async_get_status(appliance: Appliance) -> CacheEntry:
+    """
+    Returns: The cached status of the given appliance.
+
+    See Also: fetch_status, GroheClient.cache.AsyncTTLCache
+
+    """
+    return await status_cache.get((appliance.appliance_id, STATUS), lambda: fetch_status(appliance))
+
+
+async def async_get_measurements(appliance: Appliance) -> CacheEntry:
+    """
+    Returns: The cached measurements of the given appliance.
+
+    See Also: fetch_measurements, GroheClient.cache.AsyncTTLCache
+
+    """
+    return await status_cache.get((appliance.appliance_id, MEASUREMENTS), lambda: fetch_measurements(appliance))
+
+
+def invalidate(appliance: Appliance) -> None:
+    """
+    Drop the cached status and measurements of the given appliance.
+    Args:
+        appliance: The appliance.
+
+    """
+    status_cache.invalidate((appliance.appliance_id, STATUS))
+    status_cache.invalidate((appliance.appliance_id, MEASUREMENTS))
+
+
+async def async_execute_control(appliance: Appliance, name: str) -> bool:
+    """
+    Execute the given control command, like resetting the filter status, and drop the cached values of the
+    appliance, which the command changes. The cache is dropped even if the command failed, because it may have
+    reached the appliance.
+    Args:
+        appliance: The appliance.
+        name: The name of the control command.
+
+    Returns: True if the command was executed successfully, False otherwise.
+
+    See Also: GroheClient.tap_controller.async_execute_control_command
+
+    """
+    try:
+        return await async_execute_control_command(name, appliance)
+    finally:
+        invalidate(appliance)
+
+
+GaugeFunction('grohe_status_cache_events_total', 'Hits, stale hits, misses, coalesced reads and failed fetches '
+                                                 'of the status cache.',
+              lambda: {(name,): value for name, value in status_cache.stats.items()},
+              label_names=('event',), metric_type='counter')
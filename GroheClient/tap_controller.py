@@ -1,20 +1,43 @@
+import asyncio
 import logging
 import time
+from typing import Optional
 
-import requests
+import httpx
 
-from GroheClient.base import get_access_token, refresh_tokens
-from settings import get_setting as _
+from GroheClient.base import async_get_access_token, async_refresh_tokens
+from GroheClient.circuit_breaker import circuit_breaker
+from GroheClient.commands import check_tap_params
+from GroheClient.devices import Appliance, device_registry
+from GroheClient.metrics import cloud_responses, command_duration, command_retries
+from GroheClient.retry import RetryPolicy, retry_policy
+from GroheClient.session import get_async_client
 
-DEVICE_LOCATION_ID = _("DEVICE/LOCATION_ID")
-DEVICE_APPLIANCE_ID = _("DEVICE/APPLIANCE_ID")
-DEVICE_ROOM_ID = _("DEVICE/ROOM_ID")
+_headers_cache = (None, None)
 
-APPLIANCE_COMMAND_URL = f'https://idp2-apigw.cloud.grohe.com/v3/iot' \
-                        f'/locations/{DEVICE_LOCATION_ID}' \
-                        f'/rooms/{DEVICE_ROOM_ID}' \
-                        f'/appliances/{DEVICE_APPLIANCE_ID}' \
-                        f'/command'
+
+class NoApplianceError(Exception):
+    """
+    Raised if a command is executed without an appliance and no default appliance is configured.
+    """
+
+
+def get_appliance(appliance: Optional[Appliance]) -> Appliance:
+    """
+    Returns the given appliance or the default appliance if none is given.
+    Args:
+        appliance: The appliance or None.
+
+    Returns: The appliance.
+    Raises: NoApplianceError if no appliance is given and there is no default appliance.
+
+    """
+    if appliance is not None:
+        return appliance
+    appliance = device_registry.get_default()
+    if appliance is None:
+        raise NoApplianceError('No appliance is configured.')
+    return appliance
 
 
 def get_auth_header(access_token: str) -> str:
@@ -29,103 +52,162 @@ def get_auth_header(access_token: str) -> str:
     return f'Bearer {access_token}'
 
 
-def execute_tap_command(tap_type: int, amount: int, tries=0) -> bool:
+async def async_execute_tap_command(tap_type: int, amount: int, appliance: Optional[Appliance] = None,
+                                    policy: RetryPolicy = retry_policy) -> bool:
     """
     Executes the command for the given tap type and amount.
+    Failed attempts are retried according to the retry policy. After a 401 response the tokens are refreshed
+    and the command is retried at once, this happens at most once per command.
+    No request is sent while the circuit breaker is open. Waiting for the Grohe cloud and between retries does not
+    block the event loop.
     Args:
         tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
         amount: The amount of water to be dispensed in ml.
-        tries: The number of tries to execute the command.
+        appliance: The appliance to execute the command on. Defaults to the default appliance.
+        policy: The retry policy to use.
 
     Returns: True if the command was executed successfully, False otherwise.
+    Raises: ValueError if the parameters are invalid. CircuitOpenError if the circuit breaker is open.
+            An exception of httpx if the request failed and must not be retried.
 
-    """
-    check_tap_params(tap_type, amount)
-
-    # set the headers
-    headers = {
-        "Content-Type" : "application/json",
-        "Authorization": get_auth_header(get_access_token()),
-    }
-
-    # set the payload body
-    data = {
-        "type"        : None,
-        "appliance_id": DEVICE_APPLIANCE_ID,
-        "command"     : get_command(tap_type, amount),
-        "commandb64"  : None,
-        "timestamp"   : None
-    }
+    See Also: GroheClient.retry.RetryPolicy
 
-    # send the request
-    response = requests.post(APPLIANCE_COMMAND_URL, headers=headers, json=data)
-    response.raise_for_status()
-
-    tries += 1
+    """
+    appliance = get_appliance(appliance)
+    body = get_command_body(appliance, tap_type, amount)
+
+    start = time.perf_counter()
+    result = 'error'
+    try:
+        success = await _async_send_tap_command(appliance, body, policy)
+        result = 'success' if success else 'failure'
+        return success
+    finally:
+        command_duration.observe(time.perf_counter() - start, result)
+
+
+async def _async_send_tap_command(appliance: Appliance, body: bytes, policy: RetryPolicy) -> bool:
+    start = time.monotonic()
+    attempt = 0
+    refreshed = False
+    while True:
+        access_token = await async_get_access_token()
+        headers = get_command_headers(access_token)
+        attempt += 1
+
+        circuit_breaker.before_request()
+        try:
+            response = await get_async_client().post(appliance.command_url, headers=headers, content=body)
+        except asyncio.CancelledError:
+            # release a possible probe request of the half open circuit
+            circuit_breaker.record_failure()
+            raise
+        except httpx.HTTPError as e:
+            circuit_breaker.record_failure()
+            delay = policy.get_retry_delay(attempt, time.monotonic() - start, exception=e)
+            if delay is None:
+                raise
+            logging.warning(f'Failed to send tap command, retrying in {delay:.2f}s: {e}')
+            command_retries.inc(type(e).__name__)
+            await asyncio.sleep(delay)
+            continue
+
+        record_response(response.status_code)
+        if response.is_success:
+            return True
+
+        logging.error(f'Failed to execute tap command. Response: {response.status_code} {response.text}')
+
+        # if the authorization token is invalid, refresh the tokens and try again
+        if response.status_code == 401 and not refreshed:
+            logging.info('Refreshing tokens and trying again.')
+            command_retries.inc('401')
+            await async_refresh_tokens(access_token)
+            refreshed = True
+            continue
+
+        delay = policy.get_retry_delay(attempt, time.monotonic() - start, status_code=response.status_code,
+                                       retry_after=response.headers.get('Retry-After'))
+        if delay is None:
+            return False
+        logging.info(f'Retrying tap command in {delay:.2f}s.')
+        command_retries.inc(str(response.status_code))
+        await asyncio.sleep(delay)
+
+
+async def async_execute_control_command(name: str, appliance: Appliance, policy: RetryPolicy = retry_policy) -> bool:
+    """
+    Executes a command which does not dispense water, like resetting the filter status.
+    It is sent and retried like a tap command.
+    Args:
+        name: The name of the control command, one of GroheClient.commands.CONTROL_COMMANDS.
+        appliance: The appliance to execute the command on.
+        policy: The retry policy to use.
 
-    if response.ok:
-        return True
+    Returns: True if the command was executed successfully, False otherwise.
+    Raises: ValueError if there is no such control command. CircuitOpenError if the circuit breaker is open.
+            An exception of httpx if the request failed and must not be retried.
 
-    logging.error(f'Failed to execute tap command. Response: {response.text}')
+    See Also: async_execute_tap_command
 
-    # check for a server error
-    if response.status_code >= 500:
-        # wait 5 seconds and try again
-        time.sleep(5)
-        # small amount of tries to execute the command, otherwise water will be dispensed after the user expects it
-        if tries < 2:
-            return execute_tap_command(tap_type, amount, tries + 1)
+    """
+    body = appliance.control_bodies.get(name)
+    if body is None:
+        raise ValueError(f'Invalid control command: {name}.')
+    return await _async_send_tap_command(appliance, body, policy)
 
-    # if the authorization token is invalid, refresh the tokens and try again
-    if response.status_code == 401 and tries < 3:
-        logging.info('Refreshing tokens and trying again.')
-        refresh_tokens()
-        return execute_tap_command(tap_type, amount, tries + 1)
 
-    # try again once after 5 seconds if the request failed
-    if tries < 2:
-        time.sleep(5)
-        return execute_tap_command(tap_type, amount, tries + 1)
+def record_response(status_code: int) -> None:
+    """
+    Records the outcome of a request to the Grohe cloud in the metrics and the circuit breaker.
+    Server errors and rate limiting count as failures, every other response shows that the cloud is available.
+    Args:
+        status_code: The status code of the response.
 
-    return False
+    """
+    cloud_responses.inc(str(status_code))
+    if status_code >= 500 or status_code == 429:
+        circuit_breaker.record_failure()
+    else:
+        circuit_breaker.record_success()
 
 
-def check_tap_params(tap_type: int, amount: int) -> None:
+def get_command_body(appliance: Appliance, tap_type: int, amount: int) -> bytes:
     """
-    Checks the given tap parameters.
+    Returns the serialized body of the command request for the given tap type and amount.
     Args:
+        appliance: The appliance to execute the command on.
         tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
         amount: The amount of water to be dispensed in ml.
 
+    Returns: The JSON body of the request.
     Raises: ValueError if the parameters are invalid.
 
+    See Also: GroheClient.commands.build_command_bodies
+
     """
-    # check if the tap type is valid
-    if tap_type not in [1, 2, 3]:
-        raise ValueError(f'Invalid tap type: {tap_type}. Valid values are 1, 2 and 3.')
-    # check if the amount is valid
-    if amount % 50 != 0 or amount <= 0 or amount > 2000:
-        raise ValueError('The amount must be a multiple of 50, greater than 0 and less or equal to 2000.')
+    body = appliance.command_bodies.get((tap_type, amount))
+    if body is None:
+        check_tap_params(tap_type, amount)
+        raise ValueError(f'No command for tap type {tap_type} and amount {amount}.')
+    return body
 
 
-def get_command(tap_type: int, amount: int) -> dict:
+def get_command_headers(access_token: str) -> dict:
     """
-    Returns the command to execute for the given tap type and amount.
+    Returns the headers of the command request. The headers of the last access token are reused.
     Args:
-        tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
-        amount: The amount of water to be dispensed in ml.
+        access_token: The access token to use.
 
-    Returns: The command to execute.
+    Returns: The headers, they must not be modified.
 
     """
-    return {
-        "co2_status_reset"         : False,
-        "tap_type"                 : tap_type,
-        "cleaning_mode"            : False,
-        "filter_status_reset"      : False,
-        "get_current_measurement"  : False,
-        "tap_amount"               : amount,
-        "factory_reset"            : False,
-        "revoke_flush_confirmation": False,
-        "exec_auto_flush"          : False
-    }
+    global _headers_cache
+    cached_token, headers = _headers_cache
+    if cached_token != access_token:
+        headers = {
+            "Content-Type" : "application/json",
+            "Authorization": get_auth_header(access_token),
+        }
+        _headers_cache = (access_token, headers)
+    return headers
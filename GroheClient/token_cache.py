@@ -0,0 +1,96 @@
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+from GroheClient.file_lock import file_lock
+from settings import get_setting as _, get_settings
+
+TOKEN_CACHE_ENABLED = bool(_("TOKENS/CACHE_ENABLED", True))
+# relative paths are relative to the directory of the settings file
+TOKEN_CACHE_FILE = os.path.join(os.path.dirname(get_settings().path), _("TOKENS/CACHE_FILE", '.tokens.json'))
+# held by the worker which logs in or refreshes the tokens, the other workers wait and read the result from the cache
+TOKEN_LOCK_FILE = TOKEN_CACHE_FILE + '.lock'
+
+
+def save_tokens(tokens: dict) -> None:
+    """
+    Save the given tokens to the token cache file.
+    The file is written atomically and is only readable by the current user.
+    Errors are logged and ignored, a missing cache only means the next start needs a new login.
+    Args:
+        tokens: A dict with the tokens as returned by get_tokens_from_json.
+
+    """
+    if not TOKEN_CACHE_ENABLED:
+        return
+
+    now = time.time()
+    data = {
+        'access_token'            : tokens['access_token'],
+        'access_token_expires_at' : now + tokens['access_token_expires_in'],
+        'refresh_token'           : tokens['refresh_token'],
+        'refresh_token_expires_at': now + tokens['refresh_token_expires_in'],
+    }
+
+    directory = os.path.dirname(os.path.abspath(TOKEN_CACHE_FILE))
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tokens-', suffix='.tmp')
+        try:
+            os.fchmod(fd, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, TOKEN_CACHE_FILE)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except OSError as e:
+        logging.warning(f'Could not write the token cache {TOKEN_CACHE_FILE}: {e}')
+
+
+def load_tokens() -> Optional[dict]:
+    """
+    Load the tokens from the token cache file.
+    Returns: A dict with the tokens like get_tokens_from_json, where the expiry times are the seconds left,
+             or None if there is no usable cache.
+
+    """
+    if not TOKEN_CACHE_ENABLED:
+        return None
+
+    try:
+        with open(TOKEN_CACHE_FILE, 'r') as f:
+            data = json.load(f)
+        now = time.time()
+        return {
+            'access_token'            : data['access_token'],
+            'access_token_expires_in' : data['access_token_expires_at'] - now,
+            'refresh_token'           : data['refresh_token'],
+            'refresh_token_expires_in': data['refresh_token_expires_at'] - now,
+        }
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f'Could not read the token cache {TOKEN_CACHE_FILE}: {e}')
+        return None
+
+
+def token_lock():
+    """
+    Lock the tokens of all worker processes of the server while logging in or refreshing.
+    Every refresh invalidates the previous refresh token, so only one worker may refresh at a time,
+    the others use the new tokens from the token cache. Without a token cache, every worker has its own tokens.
+
+    Returns: A context manager holding the lock.
+
+    See Also: GroheClient.file_lock.file_lock
+
+    """
+    if not TOKEN_CACHE_ENABLED:
+        return contextlib.nullcontext(True)
+    return file_lock(TOKEN_LOCK_FILE)
@@ -1,27 +1,122 @@
 import json
+import logging
+from urllib.parse import urljoin, urlsplit
 
-import requests
-from selenium import webdriver
-from selenium.webdriver import DesiredCapabilities
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.support.wait import WebDriverWait
+from GroheClient.metrics import login_duration, token_refresh_duration
+from GroheClient.session import GROHE_API_BASE_URL, create_session, get_session, get_timeout
+from settings import get_setting as _
 
 
-REFRESH_TOKEN_BASE_URL = "https://idp2-apigw.cloud.grohe.com/v3/iot/oidc/refresh"
-AUTH_BASE_URL = "https://idp2-apigw.cloud.grohe.com/v3/iot/oidc/login"
+REFRESH_TOKEN_BASE_URL = GROHE_API_BASE_URL + "/v3/iot/oidc/refresh"
+AUTH_BASE_URL = GROHE_API_BASE_URL + "/v3/iot/oidc/login"
+
+# fall back to the login with a headless Chrome if the login over HTTP fails
+LOGIN_BROWSER_FALLBACK = bool(_("TOKENS/LOGIN_BROWSER_FALLBACK", True))
+# the maximum number of redirects to follow after submitting the login form
+MAX_LOGIN_REDIRECTS = 10
+
+
+class LoginError(Exception):
+    """
+    Raised if the login with the grohe credentials failed.
+    """
 
 
 def get_tokens_from_credentials(grohe_email: str, grohe_password: str) -> dict:
     """
     Get the initial access and refresh tokens from the given grohe credentials.
+    The login is done over plain HTTP. If that fails and the browser fallback is enabled, the login is retried
+    with a headless Chrome.
+    Args:
+        grohe_email: The grohe email.
+        grohe_password: The grohe password.
+
+    Returns: A dict with the tokens.
+
+    """
+    try:
+        with login_duration.time_result('http'):
+            return get_tokens_from_login_form(grohe_email, grohe_password)
+    except Exception as e:
+        if not LOGIN_BROWSER_FALLBACK:
+            raise
+        logging.warning(f'Login over HTTP failed, falling back to the browser login: {e}')
+
+    with login_duration.time_result('browser'):
+        return get_tokens_from_browser(grohe_email, grohe_password)
+
+
+def get_tokens_from_login_form(grohe_email: str, grohe_password: str) -> dict:
+    """
+    Get the initial access and refresh tokens by submitting the login form over HTTP.
+    The redirects after the login are followed until the ondus:// redirect, which points to the tokens.
     Args:
         grohe_email: The grohe email.
         grohe_password: The grohe password.
 
     Returns: A dict with the tokens.
+    Raises: LoginError if the login form could not be found or the credentials were not accepted.
 
     """
+    # bs4 is imported here, because importing it is slow and it is only needed for the login
+    from bs4 import BeautifulSoup
+
+    # use a separate session, so the login cookies are not sent with other requests
+    with create_session() as session:
+        # get the login form
+        response = session.get(AUTH_BASE_URL, timeout=get_timeout())
+        response.raise_for_status()
+
+        form = BeautifulSoup(response.text, 'html.parser').find('form')
+        if form is None or not form.get('action'):
+            raise LoginError('Could not find the login form.')
+
+        # fill in the login data, keeping the hidden fields of the form
+        data = {field['name']: field.get('value', '') for field in form.find_all('input') if field.get('name')}
+        data['username'] = grohe_email
+        data['password'] = grohe_password
+
+        # submit the form
+        response = session.post(urljoin(response.url, form['action']), data=data, allow_redirects=False,
+                                timeout=get_timeout())
+
+        # follow the redirects until the ondus:// url with the tokens
+        for _redirect in range(MAX_LOGIN_REDIRECTS):
+            location = response.headers.get('location')
+            if not response.is_redirect or location is None:
+                raise LoginError('The login was not accepted. Please check your email and password.')
+            if location.startswith('ondus://'):
+                break
+            response = session.get(urljoin(response.url, location), allow_redirects=False, timeout=get_timeout())
+        else:
+            raise LoginError('Too many redirects after the login.')
+
+        # get the tokens from the token url
+        tokens_url = location.replace('ondus://', urlsplit(GROHE_API_BASE_URL).scheme + '://')
+        response = session.get(tokens_url, timeout=get_timeout())
+        response.raise_for_status()
+
+    return get_tokens_from_json(response.json())
+
+
+def get_tokens_from_browser(grohe_email: str, grohe_password: str) -> dict:
+    """
+    Get the initial access and refresh tokens by logging in with a headless Chrome.
+    Needs selenium and a Chrome installation.
+    Args:
+        grohe_email: The grohe email.
+        grohe_password: The grohe password.
+
+    Returns: A dict with the tokens.
+
+    """
+    # selenium is imported here, because importing it is slow and it is only needed for the login
+    from selenium import webdriver
+    from selenium.webdriver import DesiredCapabilities
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as ec
+    from selenium.webdriver.support.wait import WebDriverWait
+
     # set chrome driver options
     options = webdriver.ChromeOptions()
     options.add_argument('headless')
@@ -112,8 +207,10 @@ def get_refresh_tokens(refresh_token: str) -> dict:
     data = {
         'refresh_token': refresh_token,
     }
-    response = requests.post(REFRESH_TOKEN_BASE_URL, json=data)
-    response.raise_for_status()
+    with token_refresh_duration.time_result():
+        response = get_session().post(REFRESH_TOKEN_BASE_URL, json=data, timeout=get_timeout())
+        response.raise_for_status()
 
     tokens = get_tokens_from_json(response.json())
     return tokens
+
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+import requests
+
+from GroheClient.session import create_async_client, create_session, get_timeout
+from benchmark.run import get_free_port, start_process, stop_process, summarize, wait_until_available
+
+
+def measure(send, requests_count: int) -> dict:
+    """
+    Send the given number of requests one after another.
+    Args:
+        send: Sends a single request and returns its status code.
+        requests_count: The number of requests.
+
+    Returns: The summary of the latencies.
+
+    """
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    for _request in range(requests_count):
+        request_start = time.perf_counter()
+        status = str(send())
+        latencies.append(time.perf_counter() - request_start)
+        statuses[status] = statuses.get(status, 0) + 1
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+async def async_measure(send, requests_count: int) -> dict:
+    """
+    Async version of measure, send is a coroutine function.
+
+    """
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    for _request in range(requests_count):
+        request_start = time.perf_counter()
+        status = str(await send())
+        latencies.append(time.perf_counter() - request_start)
+        statuses[status] = statuses.get(status, 0) + 1
+    return summarize(latencies, statuses, time.perf_counter() - start)
+
+
+def run_sync(url: str, args: argparse.Namespace) -> dict:
+    results = {
+        # a new connection per request, like the bare requests.post calls before the shared session
+        'requests cold': measure(lambda: requests.head(url, timeout=get_timeout()).status_code, args.requests),
+    }
+    with create_session() as session:
+        # the warm-up at server start opens the pooled connection
+        session.head(url, timeout=get_timeout())
+        results['requests warm'] = measure(lambda: session.head(url, timeout=get_timeout()).status_code,
+                                           args.requests)
+    return results
+
+
+async def run_async(url: str, args: argparse.Namespace) -> dict:
+    async def cold_head() -> int:
+        async with create_async_client() as new_client:
+            return (await new_client.head(url)).status_code
+
+    results = {'httpx cold': await async_measure(cold_head, args.requests)}
+    async with create_async_client() as client:
+        async def warm_head() -> int:
+            return (await client.head(url)).status_code
+
+        await warm_head()
+        results['httpx warm'] = await async_measure(warm_head, args.requests)
+    return results
+
+
+def run_benchmark(args: argparse.Namespace) -> dict:
+    """
+    Measure the latency of requests on a new connection and on a pooled connection, which was opened before.
+    Without --url, the requests go to the mock cloud on localhost, which has no TLS handshake.
+    Args:
+        args: The command line arguments.
+
+    Returns: The results per client and connection state.
+
+    """
+    if args.url:
+        return dict(run_sync(args.url, args), **asyncio.run(run_async(args.url, args)))
+
+    cloud_port = get_free_port()
+    with tempfile.TemporaryDirectory(prefix='grohe-benchmark-') as tmp_dir:
+        cloud = start_process(['-m', 'benchmark.mock_cloud', '--port', str(cloud_port)], dict(os.environ),
+                              os.path.join(tmp_dir, 'mock_cloud.log'))
+        try:
+            url = f'http://127.0.0.1:{cloud_port}/'
+
+            async def wait_for_cloud() -> None:
+                async with httpx.AsyncClient() as client:
+                    await wait_until_available(client, url + '_mock/stats', 30)
+
+            asyncio.run(wait_for_cloud())
+            return dict(run_sync(url, args), **asyncio.run(run_async(url, args)))
+        finally:
+            stop_process(cloud)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare the latency of requests on new and on pooled connections.')
+    parser.add_argument('--requests', type=int, default=200, help='number of measured requests per client')
+    parser.add_argument('--url', help='url to send HEAD requests to instead of the mock cloud, '
+                                      'e.g. https://idp2-apigw.cloud.grohe.com to include the TLS handshake')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print(f'{"":<14} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"mean ms":>10}')
+    for name, result in results.items():
+        latency = result['latency_ms']
+        print(f'{name:<14} {latency["p50"]:>10} {latency["p95"]:>10} {latency["p99"]:>10} {latency["mean"]:>10}')
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import json
+import timeit
+
+from GroheClient.commands import build_command_bodies, dumps, get_command, get_payload_template, orjson
+
+APPLIANCE_ID = '00000000-0000-0000-0000-000000000000'
+ACCESS_TOKEN = 'x' * 1200
+
+
+def build_request_per_call(tap_type: int, amount: int, payload_template: dict) -> tuple:
+    """
+    The command request as it was built before the command table: the parameters are checked, the headers and
+    the payload are built and serialized for every command, like requests does for json=.
+    """
+    if tap_type not in (1, 2, 3):
+        raise ValueError(tap_type)
+    if amount % 50 != 0 or amount <= 0 or amount > 2000:
+        raise ValueError(amount)
+    headers = {
+        "Content-Type" : "application/json",
+        "Authorization": f'Bearer {ACCESS_TOKEN}',
+    }
+    data = dict(payload_template, command=get_command(tap_type, amount))
+    return headers, json.dumps(data, allow_nan=False).encode('utf-8')
+
+
+def build_request_from_table(tap_type: int, amount: int, command_bodies: dict, headers: dict) -> tuple:
+    """
+    The command request with the command table: a single lookup, the headers are reused while the token is valid.
+    """
+    body = command_bodies.get((tap_type, amount))
+    if body is None:
+        raise ValueError((tap_type, amount))
+    return headers, body
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the CPU cost of building a tap command request.')
+    parser.add_argument('--number', type=int, default=100000, help='number of requests built per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measurements, the fastest one is reported')
+    args = parser.parse_args()
+
+    payload_template = get_payload_template(APPLIANCE_ID)
+    command_bodies = build_command_bodies(payload_template)
+    headers = {"Content-Type": "application/json", "Authorization": f'Bearer {ACCESS_TOKEN}'}
+
+    table_build = min(timeit.repeat(lambda: build_command_bodies(payload_template), number=10, repeat=args.repeat))
+    before = min(timeit.repeat(lambda: build_request_per_call(2, 500, payload_template), number=args.number,
+                               repeat=args.repeat))
+    after = min(timeit.repeat(lambda: build_request_from_table(2, 500, command_bodies, headers), number=args.number,
+                              repeat=args.repeat))
+    json_data = dict(payload_template, command=get_command(2, 500))
+    serialize = min(timeit.repeat(lambda: dumps(json_data), number=args.number, repeat=args.repeat))
+
+    print(f'JSON backend:                  {"orjson" if orjson is not None else "json"}')
+    print(f'command table per appliance:   {table_build / 10 * 1e3:8.3f} ms, '
+          f'{sum(len(body) for body in command_bodies.values())} bytes')
+    print(f'request built per call:        {before / args.number * 1e6:8.3f} us')
+    print(f'request from the table:        {after / args.number * 1e6:8.3f} us')
+    print(f'dynamic payload serialization: {serialize / args.number * 1e6:8.3f} us')
+    print(f'speedup:                       {before / after:8.1f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmark.run import API_KEY, ROOT_DIR, get_free_port, start_process, stop_process, write_settings
+
+IMPORT_MAIN = 'import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)'
+
+
+def measure_import(env: dict) -> float:
+    """
+    Import main in a new interpreter.
+    Returns: The seconds the import took.
+
+    """
+    result = subprocess.run([sys.executable, '-c', IMPORT_MAIN], cwd=ROOT_DIR, env=env, capture_output=True,
+                            text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def get_slowest_imports(env: dict, count: int) -> list:
+    """
+    Returns: The (cumulative microseconds, module) tuples of the given number of slowest imports of main,
+        measured with python -X importtime.
+
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=ROOT_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+async def measure_first_response(env: dict, server_port: int, log_path: str, timeout: float = 60) -> float:
+    """
+    Start the API and send HEAD requests, which need no tokens, until the first one is answered.
+    Returns: The seconds from starting the process to the first response.
+
+    """
+    start = time.perf_counter()
+    server = start_process(['-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(server_port),
+                            '--log-level', 'warning'], env, log_path)
+    try:
+        async with httpx.AsyncClient(headers={'API_KEY': API_KEY}) as client:
+            while time.perf_counter() - start < timeout:
+                try:
+                    await client.head(f'http://127.0.0.1:{server_port}/tap/2/50')
+                    return time.perf_counter() - start
+                except httpx.TransportError:
+                    await asyncio.sleep(0.01)
+        raise TimeoutError(f'The API did not answer within {timeout} seconds')
+    finally:
+        stop_process(server)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the import time of main and the time to the first response.')
+    parser.add_argument('--repeat', type=int, default=10, help='number of imports, each in a new interpreter')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to show')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='grohe-benchmark-') as tmp_dir:
+        settings_path = os.path.join(tmp_dir, 'settings.json')
+        server_port = get_free_port()
+        # the cloud is not running, the login fails in the background and must not delay the start
+        write_settings(settings_path, get_free_port(), server_port,
+                       argparse.Namespace(pool_size=10, appliances=1, max_concurrent=0))
+        env = dict(os.environ, GROHE_SETTINGS_FILE=settings_path)
+
+        imports = [measure_import(env) for _import in range(args.repeat)]
+        slowest = get_slowest_imports(env, args.top)
+        first_response = asyncio.run(measure_first_response(env, server_port, os.path.join(tmp_dir, 'server.log')))
+
+    print(f'import main:     min {min(imports) * 1e3:8.1f} ms, median {statistics.median(imports) * 1e3:8.1f} ms')
+    print(f'first response:  {first_response * 1e3:8.1f} ms after starting uvicorn')
+    print('slowest imports (cumulative):')
+    for cumulative, module in slowest:
+        print(f'  {cumulative / 1e3:8.1f} ms  {module}')
+
+
+if __name__ == "__main__":
+    main()
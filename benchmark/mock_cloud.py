@@ -0,0 +1,235 @@
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import parse_qs
+
+import fastapi
+import uvicorn
+from fastapi import Request
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
+
+LOCATION_ID = 1000
+ROOM_ID = 2000
+# the type id of a Grohe Blue Home appliance
+APPLIANCE_TYPE_ID = 104
+
+
+class MockCloudConfig:
+    """
+    The behaviour of the mock Grohe cloud.
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 token_expires_in: int = 3600, appliances: int = 1, email: Optional[str] = None,
+                 password: Optional[str] = None, login_redirects: int = 0):
+        """
+        Args:
+            latency: The seconds every response of the cloud is delayed by.
+            jitter: The maximum number of seconds randomly added to the latency.
+            error_rate: The share of the tap commands which fail with the error status.
+            error_status: The status code of a failed tap command.
+            token_expires_in: The number of seconds an access token is valid. Expired tokens are rejected with a 401.
+            appliances: The number of Grohe Blue appliances of the account.
+            email: The email accepted by the login form, any email if None.
+            password: The password accepted by the login form, any password if None.
+            login_redirects: The number of redirects between the login form and the ondus:// redirect to the tokens,
+                like the redirects of the identity provider.
+
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.token_expires_in = token_expires_in
+        self.appliances = appliances
+        self.email = email
+        self.password = password
+        self.login_redirects = login_redirects
+
+    def get_appliance_ids(self) -> list:
+        return [f'00000000-0000-0000-0000-{index:012d}' for index in range(self.appliances)]
+
+    async def delay(self) -> None:
+        await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+
+
+def create_mock_cloud(config: MockCloudConfig) -> fastapi.FastAPI:
+    """
+    Create a mock of the endpoints of the Grohe cloud used by this API: the login form, the token refresh,
+    the discovery listings and the appliance commands. No command reaches a real appliance.
+    Args:
+        config: The behaviour of the mock.
+
+    Returns: The FastAPI app of the mock, its counters are served at /_mock/stats.
+
+    """
+    app = fastapi.FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    token_ids = itertools.count(1)
+    # access token -> monotonic time it expires at
+    access_tokens = {}
+    refresh_tokens = set()
+    stats = {
+        'logins'          : 0,
+        'refreshes'       : 0,
+        'commands'        : 0,
+        'failed_commands' : 0,
+        'rejected_tokens' : 0,
+        'discovery_calls' : 0,
+        'status_calls'    : 0,
+    }
+
+    def issue_tokens() -> dict:
+        token_id = next(token_ids)
+        access_token = f'access-{token_id}'
+        refresh_token = f'refresh-{token_id}'
+        access_tokens[access_token] = time.monotonic() + config.token_expires_in
+        refresh_tokens.add(refresh_token)
+        return {
+            'access_token'      : access_token,
+            'expires_in'        : config.token_expires_in,
+            'refresh_token'     : refresh_token,
+            'refresh_expires_in': 15552000,
+        }
+
+    def is_authorized(request: Request) -> bool:
+        authorization = request.headers.get('Authorization', '')
+        expires_at = access_tokens.get(authorization.removeprefix('Bearer '))
+        if expires_at is None or expires_at < time.monotonic():
+            stats['rejected_tokens'] += 1
+            return False
+        return True
+
+    @app.head("/")
+    async def warm_up() -> Response:
+        return Response()
+
+    def get_login_form(error: str = '') -> Response:
+        return HTMLResponse('<html><body><form method="post" action="/v3/iot/oidc/login">'
+                            '<input type="hidden" name="session_code" value="mock">'
+                            '<input name="username"><input name="password" type="password">'
+                            f'</form>{error}</body></html>')
+
+    def get_login_redirect(request: Request, remaining: int) -> Response:
+        if remaining > 0:
+            return RedirectResponse(f'/v3/iot/oidc/login/redirect/{remaining - 1}', status_code=302)
+        return RedirectResponse(f'ondus://{request.url.netloc}/v3/iot/oidc/token', status_code=302)
+
+    @app.get("/v3/iot/oidc/login")
+    async def login_form() -> Response:
+        await config.delay()
+        return get_login_form()
+
+    @app.post("/v3/iot/oidc/login")
+    async def login(request: Request) -> Response:
+        await config.delay()
+        # parsed by hand, request.form() needs python-multipart
+        form = parse_qs((await request.body()).decode())
+        if ((config.email is not None and form.get('username') != [config.email])
+                or (config.password is not None and form.get('password') != [config.password])):
+            # like the identity provider, the form is shown again with an error
+            return get_login_form('<span class="error">Invalid username or password.</span>')
+        stats['logins'] += 1
+        return get_login_redirect(request, config.login_redirects)
+
+    @app.get("/v3/iot/oidc/login/redirect/{remaining}")
+    async def login_redirect(remaining: int, request: Request) -> Response:
+        return get_login_redirect(request, remaining)
+
+    @app.get("/v3/iot/oidc/token")
+    async def token() -> Response:
+        return JSONResponse(issue_tokens())
+
+    @app.post("/v3/iot/oidc/refresh")
+    async def refresh(request: Request) -> Response:
+        await config.delay()
+        data = await request.json()
+        if data.get('refresh_token') not in refresh_tokens:
+            return JSONResponse({'error': 'invalid refresh token'}, status_code=400)
+        stats['refreshes'] += 1
+        return JSONResponse(issue_tokens())
+
+    @app.get("/v3/iot/locations")
+    async def locations(request: Request) -> Response:
+        await config.delay()
+        stats['discovery_calls'] += 1
+        if not is_authorized(request):
+            return Response(status_code=401)
+        return JSONResponse([{'id': LOCATION_ID, 'name': 'Home'}])
+
+    @app.get("/v3/iot/locations/{location_id}/rooms")
+    async def rooms(location_id: int, request: Request) -> Response:
+        await config.delay()
+        stats['discovery_calls'] += 1
+        if not is_authorized(request):
+            return Response(status_code=401)
+        return JSONResponse([{'id': ROOM_ID, 'name': 'Kitchen'}])
+
+    @app.get("/v3/iot/locations/{location_id}/rooms/{room_id}/appliances")
+    async def appliances(location_id: int, room_id: int, request: Request) -> Response:
+        await config.delay()
+        stats['discovery_calls'] += 1
+        if not is_authorized(request):
+            return Response(status_code=401)
+        return JSONResponse([{'appliance_id': appliance_id, 'type': APPLIANCE_TYPE_ID, 'name': f'Blue {index}'}
+                             for index, appliance_id in enumerate(config.get_appliance_ids())])
+
+    @app.post("/v3/iot/locations/{location_id}/rooms/{room_id}/appliances/{appliance_id}/command")
+    async def command(location_id: int, room_id: int, appliance_id: str, request: Request) -> Response:
+        await config.delay()
+        stats['commands'] += 1
+        if not is_authorized(request):
+            return Response(status_code=401)
+        if random.random() < config.error_rate:
+            stats['failed_commands'] += 1
+            return Response(status_code=config.error_status)
+        await request.body()
+        return Response(status_code=200)
+
+    @app.get("/v3/iot/locations/{location_id}/rooms/{room_id}/appliances/{appliance_id}/status")
+    async def status(location_id: int, room_id: int, appliance_id: str, request: Request) -> Response:
+        await config.delay()
+        stats['status_calls'] += 1
+        if not is_authorized(request):
+            return Response(status_code=401)
+        return JSONResponse([{'type': 'connection', 'value': 1}, {'type': 'update_available', 'value': 0}])
+
+    @app.get("/v3/iot/locations/{location_id}/rooms/{room_id}/appliances/{appliance_id}/details")
+    async def details(location_id: int, room_id: int, appliance_id: str, request: Request) -> Response:
+        await config.delay()
+        stats['status_calls'] += 1
+        if not is_authorized(request):
+            return Response(status_code=401)
+        return JSONResponse({'appliance_id': appliance_id, 'data_latest': {'measurement': {
+            'remaining_filter': 87, 'remaining_co2': 42, 'timestamp': datetime.now(timezone.utc).isoformat(),
+        }}})
+
+    @app.get("/_mock/stats")
+    async def get_stats() -> Response:
+        return JSONResponse(stats)
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run a mock of the Grohe cloud.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds every response is delayed by')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum seconds randomly added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of the tap commands which fail')
+    parser.add_argument('--error-status', type=int, default=503, help='status code of a failed tap command')
+    parser.add_argument('--token-expires-in', type=int, default=3600, help='seconds an access token is valid')
+    parser.add_argument('--appliances', type=int, default=1, help='number of appliances of the account')
+    args = parser.parse_args()
+
+    config = MockCloudConfig(args.latency, args.jitter, args.error_rate, args.error_status, args.token_expires_in,
+                             args.appliances)
+    uvicorn.run(create_mock_cloud(config), host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import logging
+import struct
+from typing import Optional
+
+# the MQTT 3.1.1 packet types handled by the broker
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """
+    Args:
+        topic_filter: A topic filter, it may contain the wildcards + and #.
+        topic: A topic.
+
+    Returns: Whether the topic matches the filter.
+
+    """
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+    for index, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if index >= len(topic_levels) or (level != '+' and level != topic_levels[index]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def encode_packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    length = len(body)
+    header = bytearray([packet_type << 4 | flags])
+    while True:
+        byte = length % 128
+        length //= 128
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + body
+
+
+def encode_string(value: bytes) -> bytes:
+    return struct.pack('!H', len(value)) + value
+
+
+def decode_string(data: bytes, offset: int) -> tuple:
+    length = struct.unpack_from('!H', data, offset)[0]
+    return data[offset + 2:offset + 2 + length], offset + 2 + length
+
+
+class Session:
+    """
+    A connected client of the broker.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.client_id = None
+        self.subscriptions = set()
+        self.will = None
+
+    def send(self, packet: bytes) -> None:
+        if not self.writer.is_closing():
+            self.writer.write(packet)
+
+
+class MqttBroker:
+    """
+    A minimal in-memory MQTT 3.1.1 broker, a stand-in for a real broker like Mosquitto in benchmarks and tests.
+
+    It supports retained messages, wildcards and last wills. Messages are delivered with QoS 0, published QoS 1
+    messages are acknowledged. There is no authentication and no persistence.
+    """
+
+    def __init__(self):
+        self._sessions = set()
+        self._retained = {}
+        self.stats = {
+            'connections': 0,
+            'published'  : 0,
+            'delivered'  : 0,
+        }
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session(writer)
+        self._sessions.add(session)
+        self.stats['connections'] += 1
+        clean = False
+        try:
+            while True:
+                packet = await self._read_packet(reader)
+                if packet is None:
+                    break
+                packet_type, flags, body = packet
+                if packet_type == DISCONNECT:
+                    clean = True
+                    break
+                self._handle_packet(session, packet_type, flags, body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, struct.error) as e:
+            logging.debug(f'Connection of {session.client_id} closed: {e}')
+        finally:
+            self._sessions.discard(session)
+            if session.will is not None and not clean:
+                self.publish(*session.will)
+            writer.close()
+
+    @staticmethod
+    async def _read_packet(reader: asyncio.StreamReader) -> Optional[tuple]:
+        first = await reader.read(1)
+        if not first:
+            return None
+        length = 0
+        for shift in range(0, 28, 7):
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+        return first[0] >> 4, first[0] & 0x0F, await reader.readexactly(length)
+
+    def _handle_packet(self, session: Session, packet_type: int, flags: int, body: bytes) -> None:
+        if packet_type == CONNECT:
+            _protocol, offset = decode_string(body, 0)
+            connect_flags = body[offset + 1]
+            offset += 4
+            client_id, offset = decode_string(body, offset)
+            session.client_id = client_id.decode()
+            if connect_flags & 0x04:
+                will_topic, offset = decode_string(body, offset)
+                will_message, offset = decode_string(body, offset)
+                session.will = (will_topic.decode(), will_message, bool(connect_flags & 0x20))
+            session.send(encode_packet(CONNACK, 0, b'\x00\x00'))
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            topic, offset = decode_string(body, 0)
+            if qos:
+                session.send(encode_packet(PUBACK, 0, body[offset:offset + 2]))
+                offset += 2
+            self.publish(topic.decode(), body[offset:], bool(flags & 0x01))
+        elif packet_type == SUBSCRIBE:
+            packet_id, offset, granted = body[:2], 2, bytearray()
+            topic_filters = []
+            while offset < len(body):
+                topic_filter, offset = decode_string(body, offset)
+                offset += 1
+                topic_filters.append(topic_filter.decode())
+                granted.append(0)
+            session.subscriptions.update(topic_filters)
+            session.send(encode_packet(SUBACK, 0, packet_id + bytes(granted)))
+            for topic, payload in list(self._retained.items()):
+                if any(topic_matches(topic_filter, topic) for topic_filter in topic_filters):
+                    session.send(encode_packet(PUBLISH, 0x01, encode_string(topic.encode()) + payload))
+        elif packet_type == UNSUBSCRIBE:
+            offset = 2
+            while offset < len(body):
+                topic_filter, offset = decode_string(body, offset)
+                session.subscriptions.discard(topic_filter.decode())
+            session.send(encode_packet(UNSUBACK, 0, body[:2]))
+        elif packet_type == PINGREQ:
+            session.send(encode_packet(PINGRESP, 0, b''))
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        """
+        Deliver a message to all matching subscribers.
+        Args:
+            topic: The topic.
+            payload: The payload.
+            retain: Whether the message is kept for new subscribers, an empty payload deletes a retained message.
+
+        """
+        self.stats['published'] += 1
+        if retain:
+            if payload:
+                self._retained[topic] = payload
+            else:
+                self._retained.pop(topic, None)
+        packet = encode_packet(PUBLISH, 0, encode_string(topic.encode()) + payload)
+        for session in self._sessions:
+            if any(topic_matches(topic_filter, topic) for topic_filter in session.subscriptions):
+                session.send(packet)
+                self.stats['delivered'] += 1
+
+
+async def serve(host: str, port: int) -> None:
+    broker = MqttBroker()
+    server = await asyncio.start_server(broker.handle_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Run a minimal MQTT broker.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1883)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
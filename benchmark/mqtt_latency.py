@@ -0,0 +1,179 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import httpx
+import paho.mqtt.client as mqtt
+
+from benchmark.run import (
+    API_KEY, APPLIANCE_ID, get_free_port, start_process, stop_process, summarize, wait_until_available, write_settings
+)
+
+TOPIC_PREFIX = 'grohe'
+
+
+def create_client() -> mqtt.Client:
+    try:
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f'benchmark-{uuid.uuid4().hex[:8]}')
+    except AttributeError:
+        # paho-mqtt before 2.0
+        return mqtt.Client(client_id=f'benchmark-{uuid.uuid4().hex[:8]}')
+
+
+class MqttTapClient:
+    """
+    Sends tap commands to the MQTT bridge of the API and waits for their results.
+    """
+
+    def __init__(self, port: int, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._pending = {}
+        self._connected = asyncio.Event()
+        self._client = create_client()
+        self._client.on_connect = lambda client, *args: loop.call_soon_threadsafe(self._connected.set)
+        self._client.on_message = self._on_message
+        self._client.connect('127.0.0.1', port)
+        self._client.subscribe(f'{TOPIC_PREFIX}/+/tap/result', qos=1)
+        self._client.loop_start()
+
+    def _on_message(self, client, userdata, message) -> None:
+        result = json.loads(message.payload)
+        future = self._pending.pop(result.get('id'), None)
+        if future is not None:
+            self._loop.call_soon_threadsafe(future.set_result, result)
+
+    async def wait_until_available(self, timeout: float) -> None:
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def tap(self, tap_type: int, amount: int, timeout: float = 60) -> dict:
+        command_id = uuid.uuid4().hex
+        future = self._pending[command_id] = self._loop.create_future()
+        self._client.publish(f'{TOPIC_PREFIX}/{APPLIANCE_ID}/tap/set',
+                             json.dumps({'tap_type': tap_type, 'amount': amount, 'id': command_id}), qos=1)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(command_id, None)
+
+    async def wait_for_bridge(self, timeout: float) -> None:
+        # the bridge subscribes once it is connected, commands sent before are lost
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                await self.tap(2, 50, timeout=1)
+                return
+            except asyncio.TimeoutError:
+                if time.monotonic() > deadline:
+                    raise
+
+    def close(self) -> None:
+        self._client.disconnect()
+        self._client.loop_stop()
+
+
+async def measure(tap, requests: int) -> tuple:
+    """
+    Send the given number of taps one after another.
+    Returns: A (latencies in seconds, status counts, duration in seconds) tuple.
+
+    """
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    for _request in range(requests):
+        request_start = time.perf_counter()
+        status = await tap()
+        latencies.append(time.perf_counter() - request_start)
+        statuses[status] = statuses.get(status, 0) + 1
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    """
+    Start the mock cloud, the broker stand-in and the API with the MQTT bridge, then measure the latency of
+    taps over HTTP and over MQTT.
+    Args:
+        args: The command line arguments.
+
+    Returns: The results of both transports.
+
+    """
+    cloud_port, server_port, broker_port = get_free_port(), get_free_port(), get_free_port()
+
+    with tempfile.TemporaryDirectory(prefix='grohe-benchmark-') as tmp_dir:
+        settings_path = os.path.join(tmp_dir, 'settings.json')
+        write_settings(settings_path, cloud_port, server_port, args)
+        with open(settings_path) as file:
+            settings = json.load(file)
+        settings['MQTT'] = {'ENABLED': True, 'HOST': '127.0.0.1', 'PORT': broker_port, 'TOPIC_PREFIX': TOPIC_PREFIX,
+                            'RATE': 0}
+        with open(settings_path, 'w') as file:
+            json.dump(settings, file, indent=2)
+        env = dict(os.environ, GROHE_SETTINGS_FILE=settings_path)
+
+        cloud = start_process(['-m', 'benchmark.mock_cloud', '--port', str(cloud_port), '--latency', str(args.latency)],
+                              env, os.path.join(tmp_dir, 'mock_cloud.log'))
+        broker = start_process(['-m', 'benchmark.mqtt_broker', '--port', str(broker_port)],
+                               env, os.path.join(tmp_dir, 'mqtt_broker.log'))
+        server = None
+        mqtt_client = None
+        try:
+            async with httpx.AsyncClient(timeout=60) as client:
+                await wait_until_available(client, f'http://127.0.0.1:{cloud_port}/_mock/stats', 30)
+                server = start_process(['-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port',
+                                        str(server_port), '--log-level', 'warning'],
+                                       env, os.path.join(tmp_dir, 'server.log'))
+                server_url = f'http://127.0.0.1:{server_port}'
+                await wait_until_available(client, server_url + '/ready', 60, status_code=200)
+
+                mqtt_client = MqttTapClient(broker_port, asyncio.get_running_loop())
+                await mqtt_client.wait_until_available(30)
+                await mqtt_client.wait_for_bridge(30)
+
+                async def http_tap() -> str:
+                    response = await client.post(server_url + '/tap/2/50', headers={'API_KEY': API_KEY})
+                    return str(response.status_code)
+
+                async def mqtt_tap() -> str:
+                    return (await mqtt_client.tap(2, 50))['status']
+
+                results = {}
+                for name, tap in (('http', http_tap), ('mqtt', mqtt_tap)):
+                    await measure(tap, args.warmup)
+                    results[name] = summarize(*await measure(tap, args.requests))
+        finally:
+            if mqtt_client is not None:
+                mqtt_client.close()
+            if server is not None:
+                stop_process(server)
+            stop_process(broker)
+            stop_process(cloud)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Compare the latency of taps over HTTP and over the MQTT bridge.')
+    parser.add_argument('--requests', type=int, default=200, help='number of measured taps per transport')
+    parser.add_argument('--warmup', type=int, default=20, help='number of taps before the measurement')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds every response of the cloud takes')
+    args = parser.parse_args()
+    # the settings of benchmark.run which are not configurable here
+    args.pool_size = 10
+    args.appliances = 1
+    args.max_concurrent = 0
+
+    results = asyncio.run(run_benchmark(args))
+    print(f'{"":<6} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"mean ms":>10} {"taps/s":>10}')
+    for name, result in results.items():
+        latency = result['latency_ms']
+        print(f'{name:<6} {latency["p50"]:>10} {latency["p95"]:>10} {latency["p99"]:>10} {latency["mean"]:>10} '
+              f'{result["throughput_rps"]:>10}')
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Optional
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT_DIR, 'benchmark', 'results')
+
+API_KEY = 'benchmark'
+# the appliance id of the first appliance of the mock cloud
+APPLIANCE_ID = '00000000-0000-0000-0000-000000000000'
+# the ids of the devices of the API with --appliances, one per appliance of the mock cloud
+DEVICE_ID = 'device-{index}'
+
+SCENARIOS = {
+    # a single tap command, waiting for the mock cloud
+    'tap'         : ('POST', '/tap/2/50'),
+    # tap commands spread over all --appliances, the taps of an appliance are executed one after another
+    'tap_devices' : ('POST', '/devices/{device_id}/tap/2/50'),
+    # the validation of a tap command, without a request to the cloud
+    'validate'    : ('HEAD', '/tap/2/50'),
+    # the measurements of an appliance, mostly served from the status cache
+    'measurements': ('GET', f'/devices/{APPLIANCE_ID}/measurements'),
+    # the readiness check, the cheapest route
+    'ready'       : ('GET', '/ready'),
+}
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def write_settings(path: str, cloud_port: int, server_port: int, args: argparse.Namespace) -> None:
+    """
+    Write the settings of the benchmarked API, which point it to the mock cloud.
+    Args:
+        path: The path of the settings file.
+        cloud_port: The port of the mock cloud.
+        server_port: The port of the API.
+        args: The command line arguments.
+
+    """
+    settings = {
+        "DEVICE"     : {"LOCATION_ID": "1000", "ROOM_ID": "2000", "APPLIANCE_ID": APPLIANCE_ID},
+        "CREDENTIALS": {"EMAIL": "benchmark@example.com", "PASSWORD": "benchmark"},
+        "API"        : {"API_KEY": API_KEY},
+        "SERVER"     : {"BIND_ADDRESS": "127.0.0.1", "BIND_PORT": server_port},
+        "CLOUD"      : {"BASE_URL": f"http://127.0.0.1:{cloud_port}"},
+        # refresh the tokens only once they expired, so short token lifetimes exercise the 401 path
+        "TOKENS"     : {"CACHE_ENABLED": False, "LOGIN_BROWSER_FALLBACK": False, "REFRESH_AHEAD": 0},
+        # do not pace the commands by the dispense rate, the mock does not dispense any water
+        "QUEUE"      : {"DISPENSE_RATE": 1000000},
+        "HTTP"       : {"POOL_SIZE": args.pool_size},
+        # measure the API, not the rate limits
+        "RATE_LIMIT" : {"KEY_RATE": 0, "APPLIANCE_RATE": 0},
+        "ADMISSION"  : {"MAX_CONCURRENT": args.max_concurrent},
+        "LOGGING"    : {"FILE": os.path.join(os.path.dirname(path), 'app.log')},
+        # the mock cloud does not serve the history
+        "HISTORY"    : {"ENABLED": False},
+    }
+    if args.appliances > 1:
+        settings["DEVICES"] = [{"ID": DEVICE_ID.format(index=index), "LOCATION_ID": "1000", "ROOM_ID": "2000",
+                                "APPLIANCE_ID": f'00000000-0000-0000-0000-{index:012d}'}
+                               for index in range(args.appliances)]
+    with open(path, 'w') as file:
+        json.dump(settings, file, indent=2)
+
+
+def start_process(args: list, env: dict, log_path: str) -> subprocess.Popen:
+    log_file = open(log_path, 'w')
+    return subprocess.Popen([sys.executable] + args, cwd=ROOT_DIR, env=env, stdout=log_file,
+                            stderr=subprocess.STDOUT)
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def wait_until_available(client: httpx.AsyncClient, url: str, timeout: float,
+                               status_code: Optional[int] = None) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if status_code is None or response.status_code == status_code:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise TimeoutError(f'{url} was not available within {timeout} seconds')
+
+
+def get_process_memory(pid: int) -> dict:
+    """
+    Args:
+        pid: The process id.
+
+    Returns: The current and the peak resident memory of the process in bytes, None where unknown.
+             Only supported on Linux.
+
+    """
+    memory = {'rss_bytes': None, 'peak_rss_bytes': None}
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    memory['rss_bytes'] = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    memory['peak_rss_bytes'] = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return memory
+
+
+def percentile(sorted_values: list, percent: float) -> Optional[float]:
+    """
+    Args:
+        sorted_values: The values in ascending order.
+        percent: The percentile between 0 and 100.
+
+    Returns: The value at the given percentile using the nearest rank, None if there are no values.
+
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(len(sorted_values) * percent / 100 + 0.5), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def get_urls(server_url: str, path: str, appliances: int) -> list:
+    """
+    Returns: The urls of the given path, one per device if the path contains a device id.
+
+    """
+    if '{device_id}' not in path:
+        return [server_url + path]
+    return [server_url + path.format(device_id=DEVICE_ID.format(index=index)) for index in range(appliances)]
+
+
+async def run_load(client: httpx.AsyncClient, method: str, urls: list, requests: int, concurrency: int) -> tuple:
+    """
+    Send the given number of requests to the given urls in turn, with the given number of requests in flight
+    at a time.
+    Returns: A (latencies in seconds, status code counts, duration in seconds) tuple.
+
+    """
+    latencies = []
+    status_codes = {}
+    remaining = iter(range(requests))
+
+    async def worker():
+        for request in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, urls[request % len(urls)])
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            status_codes[status] = status_codes.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _worker in range(concurrency)))
+    return latencies, status_codes, time.perf_counter() - start
+
+
+def summarize(latencies: list, status_codes: dict, duration: float) -> dict:
+    latencies = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests'      : len(latencies),
+        'duration_s'    : round(duration, 3),
+        'throughput_rps': round(len(latencies) / duration, 2) if duration > 0 else None,
+        'status_codes'  : status_codes,
+        'latency_ms'    : {
+            'p50' : to_ms(percentile(latencies, 50)),
+            'p95' : to_ms(percentile(latencies, 95)),
+            'p99' : to_ms(percentile(latencies, 99)),
+            'mean': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max' : to_ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def get_git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    """
+    Start the mock cloud and the API, send the warm-up and the measured requests and collect the results.
+    Args:
+        args: The command line arguments.
+
+    Returns: The results of the run.
+
+    """
+    method, path = SCENARIOS[args.scenario]
+    cloud_port = get_free_port()
+    server_port = get_free_port()
+
+    with tempfile.TemporaryDirectory(prefix='grohe-benchmark-') as tmp_dir:
+        settings_path = os.path.join(tmp_dir, 'settings.json')
+        write_settings(settings_path, cloud_port, server_port, args)
+        env = dict(os.environ, GROHE_SETTINGS_FILE=settings_path)
+
+        cloud = start_process(['-m', 'benchmark.mock_cloud', '--port', str(cloud_port),
+                               '--latency', str(args.latency), '--jitter', str(args.jitter),
+                               '--error-rate', str(args.error_rate), '--error-status', str(args.error_status),
+                               '--token-expires-in', str(args.token_expires_in), '--appliances', str(args.appliances)],
+                              env, os.path.join(tmp_dir, 'mock_cloud.log'))
+        server = None
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+                cloud_url = f'http://127.0.0.1:{cloud_port}'
+                await wait_until_available(client, cloud_url + '/_mock/stats', 30)
+
+                server = start_process(['-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port',
+                                        str(server_port), '--log-level', 'warning'],
+                                       env, os.path.join(tmp_dir, 'server.log'))
+                server_url = f'http://127.0.0.1:{server_port}'
+                await wait_until_available(client, server_url + '/ready', 60, status_code=200)
+                idle_memory = get_process_memory(server.pid)
+
+                client.headers['API_KEY'] = API_KEY
+                urls = get_urls(server_url, path, args.appliances)
+                if args.warmup:
+                    await run_load(client, method, urls, args.warmup, args.concurrency)
+                results = summarize(*await run_load(client, method, urls, args.requests, args.concurrency))
+
+                results['memory'] = {'idle': idle_memory, 'after': get_process_memory(server.pid)}
+                results['mock_cloud'] = (await client.get(cloud_url + '/_mock/stats')).json()
+        finally:
+            if server is not None:
+                stop_process(server)
+            stop_process(cloud)
+
+    results = {
+        'label'    : args.label,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit'   : get_git_commit(),
+        'python'   : platform.python_version(),
+        'config'   : {
+            'scenario'        : args.scenario,
+            'method'          : method,
+            'path'            : path,
+            'requests'        : args.requests,
+            'warmup'          : args.warmup,
+            'concurrency'     : args.concurrency,
+            'pool_size'       : args.pool_size,
+            'appliances'      : args.appliances,
+            'latency'         : args.latency,
+            'jitter'          : args.jitter,
+            'error_rate'      : args.error_rate,
+            'error_status'    : args.error_status,
+            'token_expires_in': args.token_expires_in,
+        },
+        **results,
+    }
+    return results
+
+
+def compare(results: dict, baseline: dict) -> None:
+    """
+    Print the change of the throughput and the latency percentiles against a previous run.
+    Args:
+        results: The results of this run.
+        baseline: The results of the previous run.
+
+    """
+    rows = [('throughput_rps', results['throughput_rps'], baseline['throughput_rps'])]
+    rows += [(f'latency_ms {name}', results['latency_ms'][name], baseline['latency_ms'][name])
+             for name in ('p50', 'p95', 'p99')]
+    print(f'Compared to {baseline.get("label") or baseline.get("commit")} ({baseline.get("timestamp")}):')
+    for name, value, baseline_value in rows:
+        if value is None or not baseline_value:
+            continue
+        print(f'  {name:<16} {baseline_value:>10} -> {value:>10} ({(value - baseline_value) / baseline_value:+.1%})')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the API against a local mock of the Grohe cloud.')
+    parser.add_argument('--scenario', choices=SCENARIOS, default='tap', help='the route to benchmark')
+    parser.add_argument('--requests', type=int, default=1000, help='number of measured requests')
+    parser.add_argument('--warmup', type=int, default=50, help='number of requests before the measurement')
+    parser.add_argument('--concurrency', type=int, default=10, help='number of requests in flight at a time')
+    parser.add_argument('--pool-size', type=int, default=10, help='connection pool size of the API')
+    parser.add_argument('--appliances', type=int, default=1,
+                        help='number of appliances of the mock cloud, the tap_devices scenario taps all of them')
+    parser.add_argument('--max-concurrent', type=int, default=0,
+                        help='taps the API executes at once, further taps wait or are shed, 0 disables the limit')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds every response of the cloud takes')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum seconds randomly added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of the tap commands which fail')
+    parser.add_argument('--error-status', type=int, default=503, help='status code of a failed tap command')
+    parser.add_argument('--token-expires-in', type=int, default=3600, help='seconds an access token is valid')
+    parser.add_argument('--label', help='name of the run, used in the file name of the results')
+    parser.add_argument('--output', help='path of the results file, defaults to benchmark/results/')
+    parser.add_argument('--baseline', help='results file of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        name = f'{datetime.now():%Y%m%d-%H%M%S}-{args.label or args.scenario}.json'
+        output = os.path.join(RESULTS_DIR, name)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f'Results saved to {output}')
+    if args.baseline:
+        with open(args.baseline) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
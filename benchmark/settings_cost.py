@@ -0,0 +1,76 @@
+import argparse
+import importlib
+import json
+import os
+import tempfile
+import timeit
+
+from benchmark.run import write_settings
+
+SETTING = "SERVER/BIND_PORT"
+
+
+def get_setting_from_file(path: str, setting: str):
+    """
+    A lookup as it was done before the settings were cached: the file is read and parsed for every setting.
+    """
+    with open(path, 'r') as f:
+        value = json.load(f)
+    for key in setting.split('/'):
+        value = value[key]
+    return value
+
+
+def count_import_lookups(settings_module) -> int:
+    """
+    Import main and count the settings it looks up.
+    Returns: The number of lookups.
+
+    """
+    lookups = 0
+    get = settings_module.Settings.get
+
+    def counting_get(self, *args, **kwargs):
+        nonlocal lookups
+        lookups += 1
+        return get(self, *args, **kwargs)
+
+    settings_module.Settings.get = counting_get
+    try:
+        importlib.import_module('main')
+    finally:
+        settings_module.Settings.get = get
+    return lookups
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure the cost of looking up settings, cached and from the file.')
+    parser.add_argument('--number', type=int, default=10000, help='number of lookups per measurement')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measurements, the fastest one is reported')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='grohe-benchmark-') as tmp_dir:
+        path = os.path.join(tmp_dir, 'settings.json')
+        write_settings(path, 8100, 8000, argparse.Namespace(pool_size=10, appliances=1, max_concurrent=0))
+        os.environ['GROHE_SETTINGS_FILE'] = path
+        # imported after the settings file is set, the modules read their settings on import
+        import settings
+
+        load = min(timeit.repeat(lambda: settings.Settings(path), number=100, repeat=args.repeat)) / 100
+        cached_settings = settings.Settings(path)
+        cached = min(timeit.repeat(lambda: cached_settings.get(SETTING, 0), number=args.number,
+                                   repeat=args.repeat)) / args.number
+        from_file = min(timeit.repeat(lambda: get_setting_from_file(path, SETTING), number=args.number,
+                                      repeat=args.repeat)) / args.number
+        lookups = count_import_lookups(settings)
+
+    print(f'settings loaded once:          {load * 1e6:10.3f} us')
+    print(f'lookup, cached:                {cached * 1e6:10.3f} us')
+    print(f'lookup, file read every time:  {from_file * 1e6:10.3f} us')
+    print(f'lookups while importing main:  {lookups:10d}')
+    print(f'startup lookups, cached:       {(load + lookups * cached) * 1e3:10.3f} ms')
+    print(f'startup lookups, from file:    {lookups * from_file * 1e3:10.3f} ms')
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,11 @@
 import json
 import uuid
 
-import requests
 import simplejson as simplejson
 
+from GroheClient.discovery import discover_devices
 from GroheClient.tokens import get_tokens_from_credentials
-
-LOCATIONS_BASE_URL = "https://idp2-apigw.cloud.grohe.com/v3/iot/locations"
-ROOMS_BASE_URL = "https://idp2-apigw.cloud.grohe.com/v3/iot/locations/{}/rooms"
-APPLIANCES_BASE_URL = "https://idp2-apigw.cloud.grohe.com/v3/iot/locations/{}/rooms/{}/appliances"
-
-
-class Location:
-    def __init__(self, location_id: str, name: str):
-        self.location_id = location_id
-        self.name = name
-
-    def __repr__(self):
-        return f"Location({self.location_id}, {self.name})"
-
-    def __str__(self):
-        return self.name
-
-
-class Room:
-    def __init__(self, location: Location, room_id: str, name: str):
-        self.location = location
-        self.room_id = room_id
-        self.name = name
-
-    def __repr__(self):
-        return f"Room({self.location} - {self.room_id}, {self.name})"
-
-    def __str__(self):
-        return self.name
-
-
-class Device:
-    def __init__(self, room: Room, appliance_id: str, type_id: int, name: str):
-        self.room = room
-        self.appliance_id = appliance_id
-        self.type_id = type_id
-        self.name = name
-
-    def __repr__(self):
-        return f"Device({self.room} - {self.appliance_id}, {self.name})"
-
-    def __str__(self):
-        return self.name
-
+from settings import get_settings
 
 print("""
   █████████  ██████████ ███████████ █████  █████ ███████████
@@ -75,9 +32,11 @@ You need to provide the following information:
 This script will also create a settings.json file with the information about you selected Device and geneal settings.
 """)
 
+settings_path = get_settings().path
+
 # check if a settings.json file already exists
 try:
-    with open('settings.json', 'r') as f:
+    with open(settings_path, 'r') as f:
         settings = json.load(f)
     print("settings.json already exists. Please delete it if you want to run this script again.")
     exit(0)
@@ -98,45 +57,32 @@ except Exception as e:
 
 print("Tokens obtained successfully. Searching for your Grohe Blue device...")
 # noinspection PyUnboundLocalVariable
-request_headers = {
-    "Authorization": "Bearer " + tokens['access_token'],
-    "Content-Type": "application/json",
-    "Accept": "application/json"
-}
+devices = discover_devices(tokens['access_token'], use_cache=False)
 
-# get the locations
+# print the locations, rooms and devices
 locations = []
+rooms = []
+for device in devices:
+    if device.room.location not in locations:
+        locations.append(device.room.location)
+    if device.room not in rooms:
+        rooms.append(device.room)
+
 print("Found the following locations:")
-for location in requests.get(LOCATIONS_BASE_URL, headers=request_headers).json():
-    locations.append(
-        Location(location['id'], location['name'])
-    )
-    print(f"    - {location['name']} ({location['id']})")
+for location in locations:
+    print(f"    - {location.name} ({location.location_id})")
 
 print("")
 
-# get the rooms
-rooms = []
 print("Found the following rooms:")
-for location in locations:
-    for room in requests.get(ROOMS_BASE_URL.format(location.location_id), headers=request_headers).json():
-        rooms.append(
-            Room(location, room['id'], room['name'])
-        )
-        print(f"    - {room['name']} ({room['id']})")
+for room in rooms:
+    print(f"    - {room.name} ({room.room_id})")
 
 print("")
 
-# get the devices
-devices = []
 print("Found the following devices:")
-for room in rooms:
-    for index, device in enumerate(requests.get(APPLIANCES_BASE_URL.format(room.location.location_id, room.room_id),
-                                   headers=request_headers).json()):
-        devices.append(
-            Device(room, device['appliance_id'], device['type'], device['name'])
-        )
-        print(f"    {index}: {device['name']} ({device['appliance_id']})")
+for index, device in enumerate(devices):
+    print(f"    {index}: {device.name} ({device.appliance_id})")
 
 print("\nPlease enter the ID of the device you want to use with this script.")
 device_id = int(input("Device ID: "))
@@ -167,8 +113,8 @@ if api_key == "":
 
 print(f"Using API key: {api_key}")
 
-print("\nSaving settings to settings.json...")
-with open("settings.json", "w") as settings_file:
+print(f"\nSaving settings to {settings_path}...")
+with open(settings_path, "w") as settings_file:
     settings = {
         "DEVICE"     : {
             "LOCATION_ID" : device.room.location.location_id,
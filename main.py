@@ -1,84 +1,493 @@
+import asyncio
 import logging
+import math
+import time
+import uuid
+from datetime import date
+from typing import Awaitable, Callable, Optional
 
 import fastapi
 import uvicorn
-from fastapi import HTTPException, Security
-from fastapi.openapi.models import APIKey
+from fastapi import Header, HTTPException, Query, Request, Security, WebSocket, WebSocketDisconnect
 from fastapi.params import Depends
-from fastapi.responses import Response
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security.api_key import APIKeyCookie, APIKeyHeader, APIKeyQuery
+from pydantic import BaseModel
 from starlette.status import (
-    HTTP_200_OK, HTTP_201_CREATED, HTTP_403_FORBIDDEN, HTTP_412_PRECONDITION_FAILED, HTTP_500_INTERNAL_SERVER_ERROR
+    HTTP_200_OK, HTTP_201_CREATED, HTTP_202_ACCEPTED, HTTP_400_BAD_REQUEST, HTTP_403_FORBIDDEN, HTTP_404_NOT_FOUND,
+    HTTP_409_CONFLICT, HTTP_412_PRECONDITION_FAILED, HTTP_422_UNPROCESSABLE_ENTITY, HTTP_429_TOO_MANY_REQUESTS,
+    HTTP_500_INTERNAL_SERVER_ERROR, HTTP_502_BAD_GATEWAY, HTTP_503_SERVICE_UNAVAILABLE, WS_1008_POLICY_VIOLATION,
+    WS_1013_TRY_AGAIN_LATER
 )
 
-from GroheClient.tap_controller import check_tap_params, execute_tap_command
+from GroheClient.admission import AdmissionRejectedError, admission_controller
+from GroheClient.auth import PERMISSION_READ, PERMISSION_TAP, ApiKey, api_key_store
+from GroheClient.base import TokensNotReadyError, token_manager
+from GroheClient.circuit_breaker import STATE_OPEN, CircuitOpenError, circuit_breaker
+from GroheClient.commands import check_tap_params
+from GroheClient.devices import Appliance, device_registry
+from GroheClient.dispense import dispense, get_executor
+from GroheClient.events import KEEP_ALIVE, Subscription, TooManySubscribersError, event_bus, parse_event_types
+from GroheClient.history import HISTORY_ENABLED, get_range, history_store, history_sync
+from GroheClient.idempotency import MAX_KEY_LENGTH, IdempotencyConflictError, idempotency_store
+from GroheClient.log_config import ACCESS_LOG, log_auth_failure, request_id_var, setup_logging, stop_logging
+from GroheClient.metrics import ENABLED as METRICS_ENABLED, http_request_duration, render_metrics
+from GroheClient.mqtt_bridge import MQTT_ENABLED, mqtt_bridge
+from GroheClient.rate_limit import RateLimitError, rate_limiter
+from GroheClient.scheduler import JOB_COMPLETED, job_manager
+from GroheClient.session import async_warm_up, close_async_client
+from GroheClient.status import async_execute_control, async_get_measurements, async_get_status
 from settings import get_setting as _
 
 BIND_ADDRESS = _("SERVER/BIND_ADDRESS")
 BIND_PORT = _("SERVER/BIND_PORT")
+# the number of worker processes, they share the tokens through the token cache
+WORKERS = int(_("SERVER/WORKERS", 1))
+
+DEVICES_DISCOVER = bool(_("DEVICES_DISCOVER", False))
 
-API_KEY = _("API/API_KEY")
 API_KEY_NAME = "API_KEY"
 
 API_KEY_QUERY = APIKeyQuery(name=API_KEY_NAME, auto_error=False)
 API_KEY_HEADER = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 API_KEY_COOKIE = APIKeyCookie(name=API_KEY_NAME, auto_error=False)
 
-logging.basicConfig(filename='app.log', filemode='w', format='%(name)s - %(levelname)s - %(message)s')
+access_logger = logging.getLogger('access')
 
 
-async def get_api_key(api_key_query: str = Security(API_KEY_QUERY),
-                      api_key_header: str = Security(API_KEY_HEADER)) -> str:
+async def get_api_key(request: Request, api_key_query: str = Security(API_KEY_QUERY),
+                      api_key_header: str = Security(API_KEY_HEADER)) -> ApiKey:
     """
     Returns the API key from the query or header.
     Args:
+        request: The request, its client is logged if the API key is invalid.
         api_key_query: The API key from the query.
         api_key_header: The API key from the header.
 
     Returns: The API key.
     Raises: HTTPException if the API key is invalid.
 
+    See Also: GroheClient.auth.ApiKeyStore
+
     """
-    if api_key_query == API_KEY:
-        return api_key_query
-    elif api_key_header == API_KEY:
-        return api_key_header
-    else:
-        logging.error(f"Invalid API key: {api_key_query} {api_key_header}")
+    # the keys are read from the settings, so changed keys are used without a restart
+    api_key = api_key_store.authenticate(api_key_query) or api_key_store.authenticate(api_key_header)
+    if api_key is None:
+        log_auth_failure(request.client.host if request.client else None, request.url.path)
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="Could not validate credentials")
+    return api_key
+
+
+def require_permission(permission: str) -> Callable[..., Awaitable[ApiKey]]:
+    """
+    Returns a dependency which checks that the API key of the request has the given permission.
+    Args:
+        permission: The required permission.
+
+    Returns: The dependency returning the API key.
+
+    """
+    async def check_permission(api_key: ApiKey = Depends(get_api_key)) -> ApiKey:
+        if not api_key.has_permission(permission):
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail=f"The API key lacks the {permission} permission")
+        return api_key
+
+    return check_permission
+
+
+TAP_KEY = Depends(require_permission(PERMISSION_TAP))
+READ_KEY = Depends(require_permission(PERMISSION_READ))
+
+
+class Dispense(BaseModel):
+    tap_type: int
+    amount: int
+
+
+class Batch(BaseModel):
+    dispenses: list[Dispense]
+    coalesce: bool = False
+
+
+class MetricsMiddleware:
+    """
+    Records the duration and status code of every request, labeled with the route it matched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            http_request_duration.observe(time.perf_counter() - start, scope['method'],
+                                          route.path if route is not None else 'unmatched', str(status_code))
+
+
+class RequestContextMiddleware:
+    """
+    Assigns an id to every request, which is added to its log records and returned in the X-Request-ID header.
+    An id sent by the client in the X-Request-ID header is used instead. Logs every request with its latency.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope['headers']:
+            if name == b'x-request-id':
+                request_id = value.decode('latin-1')[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        start = time.perf_counter()
+        status_code = HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                message['headers'] = list(message.get('headers', [])) + [
+                    (b'x-request-id', request_id.encode('latin-1'))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            if ACCESS_LOG:
+                latency_ms = round((time.perf_counter() - start) * 1000, 3)
+                access_logger.info(f"{scope['method']} {scope['path']} {status_code} {latency_ms}ms",
+                                   extra={'method': scope['method'], 'path': scope['path'],
+                                          'status_code': status_code, 'latency_ms': latency_ms})
+            request_id_var.reset(token)
 
 
 app = fastapi.FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestContextMiddleware)
 
 
-@app.get("/tap/{tap_type}/{amount}")
-@app.post("/tap/{tap_type}/{amount}")
-def tap(tap_type: int, amount: int, api_key: APIKey = Depends(get_api_key)) -> Response:
+@app.on_event("startup")
+def start_logging() -> None:
+    """
+    Starts the background thread which writes the log records, before the other startup hooks log anything.
+
+    See Also: GroheClient.log_config.setup_logging
+
+    """
+    setup_logging()
+
+
+@app.on_event("startup")
+async def warm_up_connections() -> None:
+    """
+    Opens the pooled connection to the Grohe cloud before the first request arrives.
+
+    See Also: GroheClient.session.async_warm_up
+
+    """
+    await async_warm_up()
+
+
+@app.on_event("startup")
+def start_token_manager() -> None:
+    """
+    Starts the login in the background, so the server accepts requests while the login is running.
+
+    See Also: ready
+
+    """
+    token_manager.start()
+
+
+@app.on_event("startup")
+async def start_device_discovery() -> None:
+    """
+    Discovers the Grohe Blue appliances of the account in the background, if enabled in the settings.
+    The discovery waits for the login to finish.
+
+    See Also: GroheClient.devices.DeviceRegistry.discover
+
+    """
+    if DEVICES_DISCOVER:
+        asyncio.ensure_future(discover_devices())
+
+
+async def discover_devices() -> None:
+    while not token_manager.is_ready():
+        await asyncio.sleep(1)
+    try:
+        await asyncio.to_thread(device_registry.discover)
+    except Exception as e:
+        logging.error(f'Could not discover the appliances: {e}')
+
+
+@app.on_event("startup")
+def start_history_sync() -> None:
+    """
+    Starts syncing the consumption history of the appliances in the background, if enabled in the settings.
+
+    See Also: GroheClient.history.HistorySync
+
+    """
+    if HISTORY_ENABLED:
+        history_sync.start()
+
+
+@app.on_event("startup")
+async def start_mqtt_bridge() -> None:
+    """
+    Connects the MQTT bridge to the broker in the background, if enabled in the settings.
+
+    See Also: GroheClient.mqtt_bridge.MqttBridge
+
+    """
+    if MQTT_ENABLED:
+        mqtt_bridge.start()
+
+
+@app.on_event("shutdown")
+async def close_connections() -> None:
+    """
+    Stops the MQTT bridge and the command queues, closes the pooled connections to the Grohe cloud, stops the
+    background token refresh and history sync and writes the queued log records.
+
+    """
+    await mqtt_bridge.stop()
+    await job_manager.stop()
+    token_manager.stop()
+    history_sync.stop()
+    history_store.close()
+    await close_async_client()
+    stop_logging()
+
+
+async def get_device(device_id: str) -> Appliance:
     """
-    Executes the command for the given tap type and amount.
+    Returns the appliance with the given device id.
     Args:
+        device_id: The device id or the Grohe appliance id.
+
+    Returns: The appliance.
+    Raises: HTTPException if there is no such appliance.
+
+    """
+    appliance = device_registry.get(device_id)
+    if appliance is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Device not found")
+    return appliance
+
+
+async def get_default_device() -> Appliance:
+    """
+    Returns the default appliance.
+    Raises: HTTPException if no appliance is configured.
+
+    """
+    appliance = device_registry.get_default()
+    if appliance is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="No device configured")
+    return appliance
+
+
+async def execute_tap(api_key: ApiKey, appliance: Appliance, tap_type: int, amount: int,
+                      idempotency_key: Optional[str] = None) -> Response:
+    """
+    Executes the command for the given tap type and amount on the given appliance, once per idempotency key.
+    A repeat of a running request waits for its result, a repeat of a finished request gets the same response
+    with the header Idempotent-Replayed. Requests rejected by a rate limit or while the cloud is unavailable
+    are not remembered, so they can be retried with the same key.
+    Args:
+        api_key: The API key of the request, the idempotency keys of every API key are separate.
+        appliance: The appliance.
+        tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
+        amount: The amount of water to be dispensed in ml.
+        idempotency_key: The value of the Idempotency-Key header, None to execute the command unconditionally.
+
+    Returns: The response containing the result of the command.
+    Raises: HTTPException if the command was not executed successfully, a precondition failed
+        or the idempotency key was used for a different request.
+
+    See Also: run_tap, GroheClient.idempotency.IdempotencyStore
+
+    """
+    if idempotency_key is None:
+        return await run_tap(api_key, appliance, tap_type, amount)
+    if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST,
+                            detail=f"The Idempotency-Key must have 1 to {MAX_KEY_LENGTH} characters")
+
+    try:
+        response, replayed = await idempotency_store.run((api_key.name, idempotency_key),
+                                                         (appliance.appliance_id, tap_type, amount),
+                                                         lambda: run_tap(api_key, appliance, tap_type, amount),
+                                                         is_final_tap_error)
+    except IdempotencyConflictError as e:
+        raise HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    if replayed:
+        return fastapi.Response(status_code=response.status_code, headers={"Idempotent-Replayed": "true"})
+    return response
+
+
+def is_final_tap_error(error: Exception) -> bool:
+    """
+    Returns whether the given error of a tap command is returned again to a repeated request.
+    Args:
+        error: The error.
+
+    Returns: False if the command was rejected before it was sent and can be retried, True otherwise.
+
+    """
+    return not (isinstance(error, HTTPException)
+                and error.status_code in (HTTP_429_TOO_MANY_REQUESTS, HTTP_503_SERVICE_UNAVAILABLE))
+
+
+async def run_tap(api_key: ApiKey, appliance: Appliance, tap_type: int, amount: int) -> Response:
+    """
+    Executes the command for the given tap type and amount on the given appliance.
+    The command is queued behind other commands for the appliance and the response is sent once it was executed.
+    If too many commands are executed at once, the request waits for a free slot and is rejected with a 503 status
+    if the wait queue is full or no slot became free within the queue timeout.
+    Args:
+        api_key: The API key of the request, its rate limit is applied.
+        appliance: The appliance.
         tap_type: The type of tap. 1 for still, 2 for medium, 3 for sparkling.
         amount: The amount of water to be dispensed in ml.
-        api_key: The API key to use.
 
     Returns: The response containing the result of the command.
     Raises: HTTPException if the command was not executed successfully or a precondition failed.
 
+    See Also: GroheClient.dispense.dispense
+
     """
     try:
-        success = execute_tap_command(tap_type, amount)
-        if not success:
+        job = await dispense(api_key.bucket, appliance, tap_type, amount)
+        if job.status != JOB_COMPLETED:
             raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not execute command")
         return fastapi.Response(status_code=HTTP_201_CREATED)
     except ValueError as e:
         raise HTTPException(status_code=HTTP_412_PRECONDITION_FAILED, detail=str(e))
+    except TokensNotReadyError as e:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except CircuitOpenError as e:
+        raise get_circuit_open_exception(e)
+    except RateLimitError as e:
+        raise get_rate_limit_exception(e)
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=str(e),
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         logging.error(e)
         raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not execute command")
 
 
-@app.head("/tap/{tap_type}/{amount}")
-def tap_head(tap_type: int, amount: int) -> Response:
+def get_circuit_open_exception(error: CircuitOpenError) -> HTTPException:
+    """
+    Returns the 503 response for a request rejected by the circuit breaker.
+    Args:
+        error: The error raised by the circuit breaker.
+
+    Returns: The HTTPException with a Retry-After header.
+
+    """
+    return HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=str(error),
+                         headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+
+def get_rate_limit_exception(error: RateLimitError) -> HTTPException:
+    """
+    Returns the 429 response for a request rejected by a rate limit.
+    Args:
+        error: The error raised by the rate limiter.
+
+    Returns: The HTTPException with a Retry-After header.
+
+    """
+    return HTTPException(status_code=HTTP_429_TOO_MANY_REQUESTS, detail=str(error),
+                         headers={"Retry-After": str(math.ceil(error.retry_after))})
+
+
+async def read_cached(appliance: Appliance, read: Callable[[Appliance], Awaitable]) -> Response:
+    """
+    Returns a cached value of the given appliance, like its status.
+    Args:
+        appliance: The appliance.
+        read: The coroutine function returning the cache entry of the appliance.
+
+    Returns: The response containing the value. Its Age header contains the seconds since it was fetched.
+    Raises: HTTPException if the value could not be fetched from the Grohe cloud.
+
+    See Also: GroheClient.status
+
+    """
+    try:
+        entry = await read(appliance)
+    except TokensNotReadyError as e:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except CircuitOpenError as e:
+        raise get_circuit_open_exception(e)
+    except Exception as e:
+        logging.error(f'Could not fetch from the Grohe cloud: {e}')
+        raise HTTPException(status_code=HTTP_502_BAD_GATEWAY, detail="Could not fetch from the Grohe cloud")
+    return JSONResponse(entry.value, headers={"Age": str(int(entry.get_age()))})
+
+
+async def execute_control(api_key: ApiKey, appliance: Appliance, name: str) -> Response:
+    """
+    Executes the given control command on the given appliance and drops its cached status and measurements.
+    Args:
+        api_key: The API key of the request, its rate limit is applied.
+        appliance: The appliance.
+        name: The name of the control command.
+
+    Returns: A 202 response, the appliance reports the result with its next measurement.
+    Raises: HTTPException if the command was not executed successfully.
+
+    See Also: GroheClient.status.async_execute_control
+
+    """
+    try:
+        circuit_breaker.raise_if_open()
+        rate_limiter.check(api_key.bucket, appliance.appliance_id)
+        success = await async_execute_control(appliance, name)
+    except TokensNotReadyError as e:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except CircuitOpenError as e:
+        raise get_circuit_open_exception(e)
+    except RateLimitError as e:
+        raise get_rate_limit_exception(e)
+    except Exception as e:
+        logging.error(e)
+        success = False
+    if not success:
+        raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR, detail="Could not execute command")
+    return fastapi.Response(status_code=HTTP_202_ACCEPTED)
+
+
+def validate_tap(tap_type: int, amount: int) -> Response:
     """
     Returning a 200 OK response for the given tap type and amount.
     Args:
@@ -88,7 +497,7 @@ def tap_head(tap_type: int, amount: int) -> Response:
     Returns: The response containing a 200 status code.
     Raises: HTTPException if the values are invalid.
 
-    See Also: GroheClient.tap_controller.check_tap_params
+    See Also: GroheClient.commands.check_tap_params
 
     """
     try:
@@ -99,5 +508,409 @@ def tap_head(tap_type: int, amount: int) -> Response:
     return fastapi.Response(status_code=HTTP_200_OK)
 
 
+def queue_batch(api_key: ApiKey, appliance: Appliance, batch: Batch) -> Response:
+    """
+    Queues a job which dispenses the given list of dispenses one after another on the given appliance.
+    Amounts above 2000 ml are split into several commands, which are paced by the dispense rate of the appliance.
+    A batch counts as a single request for the rate limits.
+    Args:
+        api_key: The API key of the request, its rate limit is applied.
+        appliance: The appliance.
+        batch: The dispenses of the job and whether consecutive dispenses of the same tap type are merged.
+
+    Returns: A 202 response containing the queued job. Its status can be requested with the job_id.
+    Raises: HTTPException if a dispense is invalid.
+
+    See Also: GroheClient.scheduler.split_dispenses
+
+    """
+    dispenses = [(dispense.tap_type, dispense.amount) for dispense in batch.dispenses]
+    try:
+        circuit_breaker.raise_if_open()
+        rate_limiter.check(api_key.bucket, appliance.appliance_id)
+    except RateLimitError as e:
+        raise get_rate_limit_exception(e)
+    except CircuitOpenError as e:
+        raise get_circuit_open_exception(e)
+    try:
+        job = job_manager.submit(appliance.appliance_id, get_executor(appliance), dispenses, batch.coalesce)
+    except ValueError as e:
+        # the batch was not queued, so it does not count against the rate limits
+        rate_limiter.release(api_key.bucket, appliance.appliance_id)
+        raise HTTPException(status_code=HTTP_412_PRECONDITION_FAILED, detail=str(e))
+    return JSONResponse(job.to_dict(), status_code=HTTP_202_ACCEPTED)
+
+
+@app.get("/tap/{tap_type}/{amount}")
+@app.post("/tap/{tap_type}/{amount}")
+async def tap(tap_type: int, amount: int, api_key: ApiKey = TAP_KEY,
+              appliance: Appliance = Depends(get_default_device),
+              idempotency_key: Optional[str] = Header(None)) -> Response:
+    """
+    Executes the command for the given tap type and amount on the default appliance.
+
+    See Also: execute_tap
+
+    """
+    return await execute_tap(api_key, appliance, tap_type, amount, idempotency_key)
+
+
+@app.head("/tap/{tap_type}/{amount}")
+async def tap_head(tap_type: int, amount: int) -> Response:
+    """
+    Validates the given tap type and amount.
+
+    See Also: validate_tap
+
+    """
+    return validate_tap(tap_type, amount)
+
+
+@app.post("/tap/batch")
+async def tap_batch(batch: Batch, api_key: ApiKey = TAP_KEY,
+                    appliance: Appliance = Depends(get_default_device)) -> Response:
+    """
+    Queues a batch of dispenses on the default appliance.
+
+    See Also: queue_batch
+
+    """
+    return queue_batch(api_key, appliance, batch)
+
+
+@app.get("/devices")
+async def get_devices(api_key: ApiKey = READ_KEY) -> Response:
+    """
+    Returns all appliances served by the API.
+
+    Returns: The response containing the list of appliances.
+
+    """
+    return JSONResponse([appliance.to_dict() for appliance in device_registry.get_all()])
+
+
+@app.get("/devices/{device_id}/tap/{tap_type}/{amount}")
+@app.post("/devices/{device_id}/tap/{tap_type}/{amount}")
+async def device_tap(tap_type: int, amount: int, api_key: ApiKey = TAP_KEY,
+                     appliance: Appliance = Depends(get_device),
+                     idempotency_key: Optional[str] = Header(None)) -> Response:
+    """
+    Executes the command for the given tap type and amount on the given appliance.
+
+    See Also: execute_tap
+
+    """
+    return await execute_tap(api_key, appliance, tap_type, amount, idempotency_key)
+
+
+@app.head("/devices/{device_id}/tap/{tap_type}/{amount}")
+async def device_tap_head(tap_type: int, amount: int, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Validates the given tap type and amount for the given appliance.
+
+    See Also: validate_tap
+
+    """
+    return validate_tap(tap_type, amount)
+
+
+@app.post("/devices/{device_id}/tap/batch")
+async def device_tap_batch(batch: Batch, api_key: ApiKey = TAP_KEY,
+                           appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Queues a batch of dispenses on the given appliance.
+
+    See Also: queue_batch
+
+    """
+    return queue_batch(api_key, appliance, batch)
+
+
+@app.get("/devices/{device_id}/status")
+async def device_status(api_key: ApiKey = READ_KEY, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Returns the status of the given appliance, like its connection and available updates.
+
+    See Also: read_cached
+
+    """
+    return await read_cached(appliance, async_get_status)
+
+
+@app.get("/devices/{device_id}/measurements")
+async def device_measurements(api_key: ApiKey = READ_KEY, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Returns the latest measurements of the given appliance, like the remaining filter capacity and CO2.
+
+    See Also: read_cached
+
+    """
+    return await read_cached(appliance, async_get_measurements)
+
+
+@app.post("/devices/{device_id}/measurements/refresh")
+async def device_measurements_refresh(api_key: ApiKey = TAP_KEY,
+                                      appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Asks the given appliance to report its current measurements.
+
+    See Also: execute_control
+
+    """
+    return await execute_control(api_key, appliance, 'get_current_measurement')
+
+
+@app.post("/devices/{device_id}/filter/reset")
+async def device_filter_reset(api_key: ApiKey = TAP_KEY, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Resets the filter status of the given appliance after the filter was changed.
+
+    See Also: execute_control
+
+    """
+    return await execute_control(api_key, appliance, 'filter_status_reset')
+
+
+@app.post("/devices/{device_id}/co2/reset")
+async def device_co2_reset(api_key: ApiKey = TAP_KEY, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Resets the CO2 status of the given appliance after the CO2 bottle was changed.
+
+    See Also: execute_control
+
+    """
+    return await execute_control(api_key, appliance, 'co2_status_reset')
+
+
+@app.get("/devices/{device_id}/history/consumption")
+async def device_consumption(period: str = Query('day', regex='^(day|week)$'),
+                             start: Optional[date] = Query(None, alias='from'),
+                             end: Optional[date] = Query(None, alias='to'),
+                             api_key: ApiKey = READ_KEY, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Returns the water consumption of the given appliance per day or week and tap type.
+    Args:
+        period: "day" or "week".
+        start: The first day, defaults to 30 days or 52 weeks ago.
+        end: The last day, defaults to today.
+        api_key: The API key to use.
+        appliance: The appliance.
+
+    Returns: The response containing the list of totals.
+
+    See Also: GroheClient.history.HistoryStore.get_consumption
+
+    """
+    consumption = await asyncio.to_thread(history_store.get_consumption, appliance.appliance_id, period,
+                                          *get_range(period, start, end))
+    return JSONResponse(consumption)
+
+
+@app.get("/devices/{device_id}/history/trends")
+async def device_trends(period: str = Query('day', regex='^(day|week)$'),
+                        start: Optional[date] = Query(None, alias='from'),
+                        end: Optional[date] = Query(None, alias='to'),
+                        api_key: ApiKey = READ_KEY, appliance: Appliance = Depends(get_device)) -> Response:
+    """
+    Returns the remaining filter capacity and CO2 of the given appliance per day or week.
+    Args:
+        period: "day" or "week".
+        start: The first day, defaults to 30 days or 52 weeks ago.
+        end: The last day, defaults to today.
+        api_key: The API key to use.
+        appliance: The appliance.
+
+    Returns: The response containing the list of values.
+
+    See Also: GroheClient.history.HistoryStore.get_trends
+
+    """
+    trends = await asyncio.to_thread(history_store.get_trends, appliance.appliance_id, period,
+                                     *get_range(period, start, end))
+    return JSONResponse(trends)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, api_key: ApiKey = READ_KEY) -> Response:
+    """
+    Returns the status of the given job.
+    Args:
+        job_id: The id of the job.
+        api_key: The API key to use.
+
+    Returns: The response containing the job.
+    Raises: HTTPException if the job does not exist.
+
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Job not found")
+    return JSONResponse(job.to_dict())
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, api_key: ApiKey = TAP_KEY) -> Response:
+    """
+    Cancels the given job. A running job stops after its current command.
+    Args:
+        job_id: The id of the job.
+        api_key: The API key to use.
+
+    Returns: The response containing the job.
+    Raises: HTTPException if the job does not exist or is already finished.
+
+    """
+    job = job_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Job not found")
+    if not job_manager.cancel(job):
+        raise HTTPException(status_code=HTTP_409_CONFLICT, detail="Job is already finished")
+    return JSONResponse(job.to_dict())
+
+
+def subscribe_events(types: Optional[str]) -> Subscription:
+    """
+    Subscribes to the events of the given types.
+    Args:
+        types: A comma separated list of event types, None for all types.
+
+    Returns: The subscription.
+    Raises: HTTPException if an event type is unknown or there are too many subscribers.
+
+    See Also: GroheClient.events.EventBus.subscribe
+
+    """
+    try:
+        return event_bus.subscribe(parse_event_types(types))
+    except ValueError as e:
+        raise HTTPException(status_code=HTTP_412_PRECONDITION_FAILED, detail=str(e))
+    except TooManySubscribersError as e:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+
+
+@app.get("/events")
+async def events(types: Optional[str] = None, api_key: ApiKey = READ_KEY) -> Response:
+    """
+    Streams the events of the API as server-sent events: the lifecycle of tap commands, token refreshes
+    and status updates. An idle stream sends a keep-alive comment every KEEP_ALIVE seconds.
+    Args:
+        types: A comma separated list of event types, e.g. "command.,token.refreshed", all types if omitted.
+        api_key: The API key to use.
+
+    Returns: The streaming response.
+    Raises: HTTPException if an event type is unknown or there are too many subscribers.
+
+    """
+    subscription = subscribe_events(types)
+
+    async def stream():
+        try:
+            while True:
+                event = await subscription.get(KEEP_ALIVE)
+                yield event.to_sse() if event is not None else b': keep-alive\n\n'
+        finally:
+            subscription.close()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.websocket("/events/ws")
+async def events_websocket(websocket: WebSocket, types: Optional[str] = None) -> None:
+    """
+    Streams the events of the API over a WebSocket, one JSON message per event.
+    The API key is sent as query parameter or header, like for the other routes.
+    Args:
+        websocket: The WebSocket.
+        types: A comma separated list of event types, all types if omitted.
+
+    See Also: events
+
+    """
+    api_key = (api_key_store.authenticate(websocket.query_params.get(API_KEY_NAME))
+               or api_key_store.authenticate(websocket.headers.get(API_KEY_NAME)))
+    if api_key is None or not api_key.has_permission(PERMISSION_READ):
+        if api_key is None:
+            log_auth_failure(websocket.client.host if websocket.client else None, websocket.url.path)
+        await websocket.close(code=WS_1008_POLICY_VIOLATION)
+        return
+    try:
+        subscription = subscribe_events(types)
+    except HTTPException as e:
+        await websocket.close(code=WS_1013_TRY_AGAIN_LATER if e.status_code == HTTP_503_SERVICE_UNAVAILABLE
+                              else WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+
+    async def wait_for_disconnect() -> None:
+        # messages of the client are ignored, the subscription ends once it disconnects
+        try:
+            while (await websocket.receive())['type'] != 'websocket.disconnect':
+                pass
+        finally:
+            subscription.close()
+
+    receiver = asyncio.ensure_future(wait_for_disconnect())
+    try:
+        while True:
+            event = await subscription.get()
+            if event is None:
+                break
+            await websocket.send_text(event.to_json().decode())
+    except (WebSocketDisconnect, OSError):
+        pass
+    finally:
+        receiver.cancel()
+        subscription.close()
+
+
+@app.get("/ready")
+async def ready() -> Response:
+    """
+    Returns whether the login to the Grohe cloud finished and taps can be executed.
+
+    Returns: A 200 response if the API is ready, a 503 response while the login is running or if it failed.
+             The body contains the login status: "ready", "starting" or "failed".
+
+    """
+    status = token_manager.get_status()
+    status_code = HTTP_200_OK if status == 'ready' else HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse({"status": status}, status_code=status_code)
+
+
+@app.get("/health")
+async def health() -> Response:
+    """
+    Returns the health of the API and its connection to the Grohe cloud.
+
+    Returns: The response containing the login status, the state of the circuit breaker and the number of running,
+             waiting and shed tap requests.
+             The status code is 503 while the circuit breaker is open, 200 otherwise.
+
+    """
+    breaker = circuit_breaker.get_status()
+    status_code = HTTP_503_SERVICE_UNAVAILABLE if breaker['state'] == STATE_OPEN else HTTP_200_OK
+    return JSONResponse({
+        "login"          : token_manager.get_status(),
+        "circuit_breaker": breaker,
+        "admission"      : admission_controller.get_status(),
+    }, status_code=status_code)
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """
+    Returns the metrics of the API in the Prometheus text format.
+
+    Returns: The response containing the metrics.
+    Raises: HTTPException if the metrics are disabled.
+
+    """
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Metrics are disabled")
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host=BIND_ADDRESS, port=int(BIND_PORT))
+    # uvicorn imports the app in every worker process, so it needs the import string instead of the app
+    uvicorn.run("main:app" if WORKERS > 1 else app, host=BIND_ADDRESS, port=int(BIND_PORT), workers=WORKERS)
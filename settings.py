@@ -1,25 +1,246 @@
 import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
 
+_MISSING = object()
 
-def get_setting(setting: str) -> str:
+# environment variable with the path of the settings file
+SETTINGS_FILE_ENV = "GROHE_SETTINGS_FILE"
+# prefix of environment variables overriding single settings, e.g. GROHE__SERVER__BIND_PORT=8080
+ENV_OVERRIDE_PREFIX = "GROHE__"
+# seconds between two checks of the settings file for changes
+RELOAD_CHECK_INTERVAL = 2
+
+DEFAULT_SETTINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'settings.json')
+
+# the types of the known settings, values from the file and the environment are validated against them
+SETTINGS_SCHEMA = {
+    "DEVICE/LOCATION_ID"  : str,
+    "DEVICE/ROOM_ID"      : str,
+    "DEVICE/APPLIANCE_ID" : str,
+    "CREDENTIALS/EMAIL"   : str,
+    "CREDENTIALS/PASSWORD": str,
+    "API/API_KEY"         : str,
+    "SERVER/BIND_ADDRESS" : str,
+    "SERVER/BIND_PORT"    : int,
+    "SERVER/WORKERS"      : int,
+}
+
+
+def _convert(setting: str, value, expected_type: type):
+    """
+    Convert the given value to the expected type.
+    Args:
+        setting: The name of the setting, used in the error message.
+        value: The value to convert.
+        expected_type: The type the value should have.
+
+    Returns: The converted value.
+    Raises: ValueError if the value can not be converted.
+
+    """
+    if isinstance(value, expected_type) and not (expected_type is int and isinstance(value, bool)):
+        return value
+    if expected_type is bool and isinstance(value, str):
+        if value.lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if value.lower() in ('0', 'false', 'no', 'off'):
+            return False
+    elif expected_type is int and isinstance(value, (str, float)):
+        # int() would silently drop the fraction of a float, so only whole numbers are accepted
+        try:
+            number = float(value)
+        except ValueError:
+            number = None
+        if number is not None and number.is_integer():
+            return int(value) if isinstance(value, str) and value.strip().lstrip('+-').isdigit() else int(number)
+    elif expected_type in (int, float, str) and isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        try:
+            return expected_type(value)
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid value for setting {setting}: {value!r}. Expected a value of type {expected_type.__name__}.')
+
+
+def _parse_env_value(setting: str, value: str):
+    """
+    Parse the value of an environment variable override. Settings of type str keep the raw string, so values like
+    passwords are never changed. JSON is decoded for settings of other known types, and for unknown settings only
+    if it is a list or an object; other values are converted to the type of the default when they are read.
+    Args:
+        setting: The name of the setting, e.g. "SERVER/BIND_PORT".
+        value: The value of the environment variable.
+
+    Returns: The parsed value.
+
+    """
+    expected_type = SETTINGS_SCHEMA.get(setting)
+    if expected_type is str:
+        return value
+    try:
+        parsed = json.loads(value)
+    except ValueError:
+        return value
+    if expected_type is None and not isinstance(parsed, (list, dict)):
+        return value
+    return parsed
+
+
+class Settings:
+    """
+    The parsed content of the settings file, loaded once and kept in memory.
+
+    Environment variables starting with GROHE__ override single settings, the path segments are separated by
+    two underscores: GROHE__SERVER__BIND_PORT overrides "SERVER/BIND_PORT".
+    The file is checked for changes at most every RELOAD_CHECK_INTERVAL seconds and reloaded when it changed.
+    """
+
+    def __init__(self, path: Optional[str] = None, environ: Optional[dict] = None):
+        self.path = path or os.environ.get(SETTINGS_FILE_ENV) or DEFAULT_SETTINGS_FILE
+        self._environ = os.environ if environ is None else environ
+        self._values = {}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        """
+        Load and validate the settings file and apply the environment variable overrides.
+        A missing settings file is treated as an empty one.
+
+        Raises: ValueError if the file is not valid JSON or a setting has an invalid value.
+
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, 'r') as f:
+                values = json.load(f)
+        except FileNotFoundError:
+            mtime = None
+            values = {}
+
+        for name, value in self._environ.items():
+            if not name.startswith(ENV_OVERRIDE_PREFIX):
+                continue
+            node = values
+            path = name[len(ENV_OVERRIDE_PREFIX):].split('__')
+            *sections, key = path
+            for section in sections:
+                node = node.setdefault(section, {})
+            node[key] = _parse_env_value('/'.join(path), value)
+
+        for setting, expected_type in SETTINGS_SCHEMA.items():
+            section, key = setting.split('/')
+            if key in values.get(section, {}):
+                values[section][key] = _convert(setting, values[section][key], expected_type)
+
+        self._values = values
+        self._mtime = mtime
+        self._next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+
+    def reload_if_changed(self) -> bool:
+        """
+        Reload the settings if the settings file changed since it was loaded.
+        If the file is invalid or was removed, the previous settings are kept.
+        Returns: True if the settings were reloaded, False otherwise.
+
+        """
+        with self._lock:
+            self._next_check = time.monotonic() + RELOAD_CHECK_INTERVAL
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                self.load()
+            except ValueError as e:
+                logging.error(f'Could not reload the settings from {self.path}: {e}')
+                self._mtime = mtime
+                return False
+        logging.info(f'Reloaded the settings from {self.path}')
+        return True
+
+    def get(self, setting: str, default=_MISSING):
+        """
+        Get a setting.
+        Args:
+            setting: The settings string looks like: "DEVICE/LOCATION_ID"
+            default: The value to return if the setting is not present. If omitted, a missing setting raises a KeyError.
+                     Values of present settings are converted to the type of the default.
+
+        Returns: The value of the setting.
+
+        """
+        if time.monotonic() >= self._next_check:
+            self.reload_if_changed()
+
+        value = self._values
+        for key in setting.split('/'):
+            try:
+                value = value[key]
+            except (KeyError, TypeError):
+                if default is _MISSING:
+                    raise KeyError(f'Missing setting {setting} in {self.path}')
+                return default
+        if default is not _MISSING and default is not None:
+            value = _convert(setting, value, type(default))
+        return value
+
+
+_settings = None
+_settings_lock = threading.Lock()
+
+
+def load_settings(path: Optional[str] = None) -> Settings:
+    """
+    Load the settings from the given path and use them for all following get_setting calls.
+    Args:
+        path: The path of the settings file. Defaults to the GROHE_SETTINGS_FILE environment variable
+              or the settings.json file next to this module.
+
+    Returns: The loaded settings.
+
+    """
+    global _settings
+    with _settings_lock:
+        _settings = Settings(path)
+    return _settings
+
+
+def get_settings() -> Settings:
+    """
+    Get the loaded settings. The settings are loaded on first use.
+    Returns: The loaded settings.
+
+    """
+    global _settings
+    if _settings is None:
+        with _settings_lock:
+            if _settings is None:
+                _settings = Settings()
+    return _settings
+
+
+def get_setting(setting: str, default=_MISSING):
     """
     Get the setting from the settings.json file.
     Args:
         setting: The settings string looks like: "DEVICE/LOCATION_ID"
                  with the equivalent jason key being [DEVICE"]["LOCATION_ID"]
+        default: The value to return if the setting or the settings.json file is not present.
+                 If omitted, a missing setting raises a KeyError.
 
     Returns: The value of the json key
     Examples: get_setting("DEVICE/LOCATION_ID")
 
-    See Also: settings.json
+    See Also: settings.json, Settings
     References: settings_example.json
 
     """
-    with open('settings.json', 'r') as f:
-        settings = json.load(f)
-
-    keys = setting.split('/')
-    value = settings
-    for key in keys:
-        value = value[key]
-    return value
+    return get_settings().get(setting, default)
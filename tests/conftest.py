@@ -0,0 +1,65 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import pytest
+import uvicorn
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the settings are read when the modules are imported, so they are written before any test module is collected
+_settings_dir = tempfile.mkdtemp(prefix='grohe-tests-')
+with open(os.path.join(_settings_dir, 'settings.json'), 'w') as _file:
+    json.dump({
+        'DEVICE'     : {'LOCATION_ID': '1000', 'ROOM_ID': '2000', 'APPLIANCE_ID': '00000000-0000-0000-0000-000000000000'},
+        'CREDENTIALS': {'EMAIL': 'user@example.com', 'PASSWORD': 'secret'},
+        'API'        : {'API_KEY': 'test-key'},
+        'SERVER'     : {'BIND_ADDRESS': '127.0.0.1', 'BIND_PORT': 8000},
+        'TOKENS'     : {'CACHE_ENABLED': False, 'LOGIN_BROWSER_FALLBACK': False},
+        'HISTORY'    : {'ENABLED': False},
+        'LOGGING'    : {'FILE': os.path.join(_settings_dir, 'app.log')},
+    }, _file)
+os.environ['GROHE_SETTINGS_FILE'] = os.path.join(_settings_dir, 'settings.json')
+
+from benchmark.mock_cloud import MockCloudConfig, create_mock_cloud  # noqa: E402
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mock_cloud():
+    """
+    Starts the mock of the Grohe cloud in a background thread.
+
+    Returns: A function taking a MockCloudConfig, which starts the mock and returns its base url.
+
+    """
+    servers = []
+
+    def start(config: MockCloudConfig) -> str:
+        port = get_free_port()
+        server = uvicorn.Server(uvicorn.Config(create_mock_cloud(config), host='127.0.0.1', port=port,
+                                               log_level='warning'))
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        deadline = time.monotonic() + 10
+        while not server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError('The mock cloud did not start.')
+            time.sleep(0.01)
+        return f'http://127.0.0.1:{port}'
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(5)
@@ -0,0 +1,28 @@
+import pytest
+
+from GroheClient.auth import ALL_PERMISSIONS, PERMISSION_READ, PERMISSION_TAP, ApiKeyStore, hash_key
+
+
+def load_key(permissions) -> dict:
+    key = {'NAME': 'dashboard', 'KEY_SHA256': hash_key('dashboard-key')}
+    if permissions is not None:
+        key['PERMISSIONS'] = permissions
+    return ApiKeyStore()._load({'KEYS': [key]})
+
+
+@pytest.mark.parametrize('permissions, expected', [
+    ('read', {PERMISSION_READ}),
+    (['read'], {PERMISSION_READ}),
+    (['tap', 'read'], {PERMISSION_TAP, PERMISSION_READ}),
+    ([], set()),
+    (None, ALL_PERMISSIONS),
+])
+def test_permissions(permissions, expected):
+    assert load_key(permissions)[hash_key('dashboard-key')].permissions == expected
+
+
+@pytest.mark.parametrize('permissions', ['reader', ['read', 'write'], 'tap,read'])
+def test_unknown_permissions_are_rejected(permissions, caplog):
+    assert load_key(permissions) == {}
+    assert 'Invalid API key dashboard' in caplog.text
+    assert 'Unknown permissions' in caplog.text
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from GroheClient import dispense
+from GroheClient.auth import api_key_store
+from GroheClient.circuit_breaker import CircuitBreaker, CircuitOpenError
+from GroheClient.devices import device_registry
+from GroheClient.rate_limit import RateLimiter, TokenBucket
+
+APPLIANCE_ID = '00000000-0000-0000-0000-000000000000'
+HEADERS = {'API_KEY': 'test-key'}
+
+
+@pytest.fixture
+def open_circuit(monkeypatch):
+    breaker = CircuitBreaker(open_duration=60)
+    breaker._open()
+    limiter = RateLimiter(appliance_rate=1.0, appliance_burst=2.0)
+    for module in (main, dispense):
+        monkeypatch.setattr(module, 'circuit_breaker', breaker)
+        monkeypatch.setattr(module, 'rate_limiter', limiter)
+    return limiter
+
+
+def assert_tokens_kept(limiter: RateLimiter, key_bucket: TokenBucket) -> None:
+    # the rejected requests did not take tokens, the full burst is left
+    for _request in range(2):
+        limiter.check(key_bucket, APPLIANCE_ID)
+
+
+def test_dispense_rejected_by_open_circuit_keeps_tokens(open_circuit):
+    key_bucket = TokenBucket(1.0, 2.0)
+    appliance = device_registry.get_default()
+    for _request in range(5):
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(dispense.dispense(key_bucket, appliance, 2, 50))
+    assert_tokens_kept(open_circuit, key_bucket)
+
+
+@pytest.mark.parametrize('method, path, body', [
+    ('POST', '/tap/2/50', None),
+    ('POST', '/tap/batch', {'dispenses': [{'tap_type': 2, 'amount': 50}]}),
+    ('POST', f'/devices/{APPLIANCE_ID}/filter/reset', None),
+])
+def test_routes_rejected_by_open_circuit_keep_tokens(open_circuit, monkeypatch, method, path, body):
+    api_key = api_key_store.authenticate('test-key')
+    monkeypatch.setattr(api_key, 'bucket', TokenBucket(1.0, 2.0))
+    client = TestClient(main.app)
+    # more requests than the burst, they must never turn into 429 responses
+    for _request in range(5):
+        response = client.request(method, path, headers=HEADERS, json=body)
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+    assert_tokens_kept(open_circuit, api_key.bucket)
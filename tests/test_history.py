@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from GroheClient import history
+from GroheClient.devices import Appliance
+from GroheClient.history import HistoryStore, get_range, parse_measurements, parse_withdrawals
+
+APPLIANCE_ID = '00000000-0000-0000-0000-000000000000'
+# noon in UTC, the same local day in every timezone between UTC-11 and UTC+11
+DAY = int(datetime(2023, 1, 2, 12, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / 'history.sqlite3'))
+    yield store
+    store.close()
+
+
+def test_parse_withdrawals():
+    data = {'data': {'withdrawals': [
+        {'starttime': '2023-01-02T12:00:00Z', 'tap_type': 1, 'tap_amount': 250},
+        {'date': '2023-01-02T12:00:00', 'water_type': 'Sparkling', 'waterconsumption': 0.5},
+        {'starttime': DAY + 60, 'water_type': 'medium', 'tap_amount': 100},
+        # skipped, without a tap type, an amount or a valid time
+        {'starttime': '2023-01-02T12:00:00Z', 'tap_amount': 100},
+        {'starttime': '2023-01-02T12:00:00Z', 'tap_type': 2},
+        {'starttime': 'yesterday', 'tap_type': 2, 'tap_amount': 100},
+    ]}}
+    assert parse_withdrawals(data) == [(DAY, 1, 250.0), (DAY, 3, 500.0), (DAY + 60, 2, 100.0)]
+    assert parse_withdrawals({}) == []
+    assert parse_withdrawals({'data': None}) == []
+
+
+def test_parse_measurements():
+    data = {'data': {'measurement': [
+        {'timestamp': '2023-01-02T12:00:00+00:00', 'remaining_filter': 80, 'remaining_co2': 60},
+        {'date': '2023-01-02T13:00:00Z', 'remaining_filter': 79},
+        {'timestamp': None, 'remaining_filter': 78},
+    ]}}
+    assert parse_measurements(data) == [(DAY, 80, 60), (DAY + 3600, 79, None)]
+
+
+def test_add_replaces_changed_rows(store):
+    assert store.add(APPLIANCE_ID, [(DAY, 1, 250.0), (DAY, 2, 100.0)], [(DAY, 80, 60)]) == 3
+    # the same rows again change nothing
+    assert store.add(APPLIANCE_ID, [(DAY, 1, 250.0), (DAY, 2, 100.0)], [(DAY, 80, 60)]) == 0
+    # the running total of the day grew and the CO2 was measured again
+    assert store.add(APPLIANCE_ID, [(DAY, 1, 400.0), (DAY, 2, 100.0)], [(DAY, 80, 55)]) == 2
+
+    start, end = get_range(history.PERIOD_DAY, datetime(2023, 1, 2).date())
+    assert store.get_consumption(APPLIANCE_ID, history.PERIOD_DAY, start, end) == [
+        {'period': '2023-01-02', 'tap_type': 1, 'amount_ml': 400.0, 'withdrawals': 1},
+        {'period': '2023-01-02', 'tap_type': 2, 'amount_ml': 100.0, 'withdrawals': 1},
+    ]
+    assert store.get_trends(APPLIANCE_ID, history.PERIOD_DAY, start, end) == [
+        {'period': '2023-01-02', 'remaining_filter': 80, 'remaining_co2': 55},
+    ]
+    assert store.get_last_timestamp(APPLIANCE_ID) == DAY
+    assert store.get_last_timestamp('other') is None
+
+
+def test_consumption_per_week(store):
+    # monday to sunday are one week, the next monday starts a new one
+    days = [int(datetime(2023, 1, day, 12, tzinfo=timezone.utc).timestamp()) for day in (2, 8, 9)]
+    store.add(APPLIANCE_ID, [(days[0], 1, 100.0), (days[1], 1, 200.0), (days[2], 1, 300.0)], [])
+    store.add('other', [(days[0], 1, 1000.0)], [])
+
+    start, end = get_range(history.PERIOD_WEEK, datetime(2023, 1, 1).date(), datetime(2023, 1, 15).date())
+    assert store.get_consumption(APPLIANCE_ID, history.PERIOD_WEEK, start, end) == [
+        {'period': '2023-01-02', 'tap_type': 1, 'amount_ml': 300.0, 'withdrawals': 2},
+        {'period': '2023-01-09', 'tap_type': 1, 'amount_ml': 300.0, 'withdrawals': 1},
+    ]
+
+
+def test_sync_fetches_only_new_data(store, monkeypatch):
+    ranges = []
+
+    def fetch_appliance_data(appliance, start, end):
+        ranges.append((start, end))
+        return {'data': {'withdrawals': [{'starttime': int(end.timestamp()), 'tap_type': 1, 'tap_amount': 100}]}}
+
+    monkeypatch.setattr(history, 'fetch_appliance_data', fetch_appliance_data)
+    monkeypatch.setattr(history, 'INITIAL_DAYS', 60)
+    appliance = Appliance('default', '1000', '2000', APPLIANCE_ID)
+
+    # the first sync fetches the initial days in chunks
+    assert history.sync_appliance(store, appliance) == 3
+    assert len(ranges) == 3
+    assert all((end - start).days < history.CHUNK_DAYS for start, end in ranges)
+
+    # the next sync starts at the last stored row
+    ranges.clear()
+    last_timestamp = store.get_last_timestamp(APPLIANCE_ID)
+    history.sync_appliance(store, appliance)
+    assert len(ranges) == 1
+    assert ranges[0][0].timestamp() == last_timestamp
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+# prints the modules and threads of the interpreter after importing main
+IMPORT_MAIN = '''
+import sys, threading
+import main
+print('bs4' in sys.modules, threading.active_count())
+'''
+
+
+def test_import_of_main_is_lazy():
+    result = subprocess.run([sys.executable, '-c', IMPORT_MAIN], cwd=ROOT, env=dict(os.environ), capture_output=True,
+                            text=True, check=True)
+    bs4_imported, threads = result.stdout.split()
+    # bs4 is only needed for the login and the log thread is started by the startup hook
+    assert bs4_imported == 'False'
+    assert threads == '1'
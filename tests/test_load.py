@@ -0,0 +1,21 @@
+import argparse
+import asyncio
+
+from benchmark.run import run_benchmark
+
+LATENCY = 0.2
+CONCURRENCY = 20
+
+
+def test_concurrent_taps():
+    # one appliance per request in flight, as the taps of an appliance are executed one after another
+    args = argparse.Namespace(scenario='tap_devices', appliances=CONCURRENCY, requests=100, warmup=0,
+                              concurrency=CONCURRENCY, pool_size=CONCURRENCY, max_concurrent=0, latency=LATENCY,
+                              jitter=0.0, error_rate=0.0, error_status=503, token_expires_in=3600, label=None)
+    results = asyncio.run(run_benchmark(args))
+
+    assert results['status_codes'] == {'201': 100}
+    assert results['mock_cloud']['commands'] == 100
+    # the requests wait for the slow cloud concurrently instead of one after another
+    assert results['latency_ms']['p50'] < 2 * LATENCY * 1000
+    assert results['throughput_rps'] > 0.4 * CONCURRENCY / LATENCY
@@ -0,0 +1,65 @@
+import pytest
+
+from GroheClient import tokens
+from GroheClient.tokens import MAX_LOGIN_REDIRECTS, LoginError, get_tokens_from_login_form
+from benchmark.mock_cloud import MockCloudConfig
+
+EMAIL = 'user@example.com'
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def identity_provider(mock_cloud, monkeypatch):
+    """
+    Points the login to a mock identity provider, which only accepts EMAIL and PASSWORD.
+
+    Returns: A function taking the number of redirects after the login and the path of the login form.
+
+    """
+
+    def start(login_redirects: int = 0, login_path: str = '/v3/iot/oidc/login') -> str:
+        base_url = mock_cloud(MockCloudConfig(latency=0, email=EMAIL, password=PASSWORD,
+                                              login_redirects=login_redirects))
+        monkeypatch.setattr(tokens, 'GROHE_API_BASE_URL', base_url)
+        monkeypatch.setattr(tokens, 'AUTH_BASE_URL', base_url + login_path)
+        return base_url
+
+    return start
+
+
+def test_login(identity_provider):
+    identity_provider(login_redirects=3)
+    result = get_tokens_from_login_form(EMAIL, PASSWORD)
+    assert result == {'access_token' : 'access-1', 'access_token_expires_in': 3600,
+                      'refresh_token': 'refresh-1', 'refresh_token_expires_in': 15552000}
+
+
+def test_login_without_redirects(identity_provider):
+    identity_provider(login_redirects=0)
+    assert get_tokens_from_login_form(EMAIL, PASSWORD)['access_token'] == 'access-1'
+
+
+def test_missing_login_form(identity_provider):
+    # the stats of the mock are served as JSON, without a form
+    identity_provider(login_path='/_mock/stats')
+    with pytest.raises(LoginError, match='Could not find the login form'):
+        get_tokens_from_login_form(EMAIL, PASSWORD)
+
+
+@pytest.mark.parametrize('email, password', [(EMAIL, 'wrong'), ('other@example.com', PASSWORD)])
+def test_rejected_credentials(identity_provider, email, password):
+    identity_provider(login_redirects=3)
+    with pytest.raises(LoginError, match='The login was not accepted'):
+        get_tokens_from_login_form(email, password)
+
+
+def test_maximum_number_of_redirects(identity_provider):
+    # the redirect of the login form and the intermediate redirects
+    identity_provider(login_redirects=MAX_LOGIN_REDIRECTS - 1)
+    assert get_tokens_from_login_form(EMAIL, PASSWORD)['access_token'] == 'access-1'
+
+
+def test_too_many_redirects(identity_provider):
+    identity_provider(login_redirects=MAX_LOGIN_REDIRECTS)
+    with pytest.raises(LoginError, match='Too many redirects'):
+        get_tokens_from_login_form(EMAIL, PASSWORD)
@@ -0,0 +1,43 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from GroheClient import base, tokens
+from GroheClient.base import TokenManager
+from benchmark.mock_cloud import MockCloudConfig
+
+HEADERS = {'API_KEY': 'test-key'}
+
+
+def get_samples(text: str) -> dict:
+    """
+    Returns: The values of the samples in the given Prometheus text format by their names with labels.
+
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_token_gauges_after_login(mock_cloud, monkeypatch):
+    base_url = mock_cloud(MockCloudConfig(latency=0, token_expires_in=3600))
+    monkeypatch.setattr(tokens, 'GROHE_API_BASE_URL', base_url)
+    monkeypatch.setattr(tokens, 'AUTH_BASE_URL', base_url + '/v3/iot/oidc/login')
+    manager = TokenManager()
+    monkeypatch.setattr(base, 'token_manager', manager)
+    client = TestClient(main.app)
+
+    # without tokens the gauges have no value
+    samples = get_samples(client.get('/metrics', headers=HEADERS).text)
+    assert 'grohe_token_age_seconds' not in samples
+    assert 'grohe_token_expires_in_seconds' not in samples
+
+    manager.login()
+    samples = get_samples(client.get('/metrics', headers=HEADERS).text)
+    assert 0 <= samples['grohe_token_age_seconds'] < 5
+    # the expiry is 60 seconds before the end of the token lifetime
+    assert samples['grohe_token_expires_in_seconds'] == pytest.approx(3600 - 60, abs=5)
+    assert samples['grohe_token_events_total{event="refreshes"}'] == 0
@@ -0,0 +1,135 @@
+import asyncio
+import json
+
+import pytest
+
+from GroheClient import dispense, mqtt_bridge
+from GroheClient.events import COMMAND_ACKNOWLEDGED, COMMAND_QUEUED, COMMAND_SENT, STATUS_UPDATED, event_bus
+from GroheClient.idempotency import IdempotencyStore
+from GroheClient.mqtt_bridge import (
+    AVAILABILITY_TOPIC, COMMAND_TOPIC, RESULT_COMPLETED, RESULT_REJECTED, RESULT_TOPIC, STATUS_TOPIC, TAP_TOPIC,
+    MqttBridge
+)
+from GroheClient.scheduler import JobManager
+
+APPLIANCE_ID = '00000000-0000-0000-0000-000000000000'
+
+
+class FakeMessage:
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeClient:
+    """
+    Stands in for the paho client: it connects at once and records the subscriptions and published messages.
+    """
+
+    def __init__(self):
+        self.subscriptions = []
+        self.messages = []
+        self.on_connect = None
+        self.on_message = None
+
+    def connect_async(self, host, port, keep_alive):
+        pass
+
+    def loop_start(self):
+        self.on_connect(self, None, {}, 0)
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append(topic)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        self.messages.append((topic, payload, retain))
+
+    def get_messages(self, topic: str) -> list:
+        return [(json.loads(payload) if payload.startswith(('{', '[')) else payload, retain)
+                for message_topic, payload, retain in self.messages if message_topic == topic]
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    """
+    Replaces the tap commands sent to the Grohe cloud. The command queues and the idempotency keys are reset,
+    as every test runs its own event loop.
+
+    Returns: The list of the executed (appliance id, tap type, amount) tuples.
+
+    """
+    commands = []
+
+    def get_executor(appliance):
+        async def execute(tap_type, amount):
+            commands.append((appliance.appliance_id, tap_type, amount))
+            return True
+        return execute
+
+    monkeypatch.setattr(dispense, 'get_executor', get_executor)
+    monkeypatch.setattr(dispense, 'job_manager', JobManager())
+    monkeypatch.setattr(mqtt_bridge, 'idempotency_store', IdempotencyStore())
+    return commands
+
+
+async def run_bridge(client: FakeClient, commands: list) -> list:
+    bridge = MqttBridge(client_factory=lambda: client)
+    bridge.start()
+    try:
+        # let the event forwarder subscribe before the commands publish their events
+        await asyncio.sleep(0)
+        results = [await bridge.handle_tap_command(device_id, payload) for device_id, payload in commands]
+        event_bus.publish(STATUS_UPDATED, {'appliance_id': APPLIANCE_ID, 'status': {'online': True}})
+        await asyncio.sleep(0.05)
+    finally:
+        await bridge.stop()
+        await dispense.job_manager.stop()
+    return results
+
+
+def test_tap_command_round_trip(executed):
+    client = FakeClient()
+    results = asyncio.run(run_bridge(client, [
+        (APPLIANCE_ID, b'{"tap_type": 2, "amount": 250}'),
+        (APPLIANCE_ID, b'{"tap_type": 2}'),
+        ('unknown', b'{"tap_type": 2, "amount": 250}'),
+    ]))
+
+    assert client.subscriptions == [TAP_TOPIC.format(device_id='+')]
+    assert client.get_messages(AVAILABILITY_TOPIC) == [('online', True), ('offline', True)]
+    assert executed == [(APPLIANCE_ID, 2, 250)]
+    assert [result['status'] for result in results] == [RESULT_COMPLETED, RESULT_REJECTED, RESULT_REJECTED]
+    assert 'Unknown device' in results[2]['error']
+    published = [result for result, _retain in client.get_messages(RESULT_TOPIC.format(device_id=APPLIANCE_ID))]
+    assert [result['status'] for result in published] == [RESULT_COMPLETED, RESULT_REJECTED]
+
+    # the command events and the status are published to the retained state topics of the device
+    events = client.get_messages(COMMAND_TOPIC.format(device_id=APPLIANCE_ID))
+    assert all(retain for _event, retain in events)
+    assert [event['event'] for event, _retain in events] == [COMMAND_QUEUED, COMMAND_SENT, COMMAND_ACKNOWLEDGED]
+    assert client.get_messages(STATUS_TOPIC.format(device_id=APPLIANCE_ID)) == [({'online': True}, True)]
+
+
+def test_idempotent_tap_command(executed):
+    client = FakeClient()
+    payload = b'{"tap_type": 1, "amount": 100, "id": "command-1"}'
+    results = asyncio.run(run_bridge(client, [(APPLIANCE_ID, payload), (APPLIANCE_ID, payload)]))
+
+    # a redelivered command is only executed once
+    assert [result['status'] for result in results] == [RESULT_COMPLETED, RESULT_COMPLETED]
+    assert executed == [(APPLIANCE_ID, 1, 100)]
+
+
+def test_missing_paho_is_reported(monkeypatch):
+    monkeypatch.setattr(mqtt_bridge, 'mqtt', None)
+    with pytest.raises(RuntimeError, match='paho-mqtt'):
+        MqttBridge().start()
@@ -0,0 +1,207 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from GroheClient import tap_controller
+from GroheClient.circuit_breaker import CircuitBreaker
+from GroheClient.devices import Appliance
+from GroheClient.retry import RetryPolicy
+from GroheClient.tap_controller import _async_send_tap_command
+
+
+class FaultyCloud:
+    """
+    Answers the tap commands with the given faults, then with a 200 status. A fault is a status code, a
+    (status code, headers) tuple or an httpx exception class. Requests with another access token than the accepted
+    one get a 401 status, every refresh of the tokens issues the next token.
+    """
+
+    def __init__(self, *faults, accepted_token: str = 'token-1'):
+        self.faults = list(faults)
+        self.requests = []
+        self.access_token = 'token-1'
+        self.accepted_token = accepted_token
+        self.refreshes = 0
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if request.headers['Authorization'] != f'Bearer {self.accepted_token}':
+            return httpx.Response(401)
+        fault = self.faults.pop(0) if self.faults else 200
+        if isinstance(fault, type):
+            raise fault('fault injected by the test', request=request)
+        status_code, headers = fault if isinstance(fault, tuple) else (fault, {})
+        return httpx.Response(status_code, headers=headers)
+
+    async def get_access_token(self) -> str:
+        return self.access_token
+
+    async def refresh_tokens(self, stale_access_token: str) -> None:
+        self.refreshes += 1
+        self.access_token = f'token-{self.refreshes + 1}'
+
+
+@pytest.fixture
+def send(monkeypatch):
+    """
+    Returns: A function sending a tap command to a FaultyCloud with the given retry policy.
+
+    """
+    appliance = Appliance('test', '1000', '2000', '00000000-0000-0000-0000-000000000000')
+    monkeypatch.setattr(tap_controller, 'circuit_breaker', CircuitBreaker(min_requests=1000))
+
+    def run(cloud: FaultyCloud, policy: RetryPolicy) -> bool:
+        async def send_command() -> bool:
+            async with httpx.AsyncClient(transport=httpx.MockTransport(cloud.handle)) as client:
+                monkeypatch.setattr(tap_controller, 'get_async_client', lambda: client)
+                return await _async_send_tap_command(appliance, appliance.command_bodies[(2, 50)], policy)
+
+        monkeypatch.setattr(tap_controller, 'async_get_access_token', cloud.get_access_token)
+        monkeypatch.setattr(tap_controller, 'async_refresh_tokens', cloud.refresh_tokens)
+        return asyncio.run(send_command())
+
+    return run
+
+
+def fast_policy(retry_ambiguous: bool = False) -> RetryPolicy:
+    return RetryPolicy(deadline=5, max_attempts=3, base_delay=0.01, max_delay=0.02, retry_ambiguous=retry_ambiguous)
+
+
+@pytest.mark.parametrize('status_code', [429, 503])
+def test_retry_delay_of_safe_status(status_code):
+    delay = RetryPolicy(base_delay=0.5).get_retry_delay(1, 0, status_code=status_code)
+    assert 0 <= delay <= 0.5
+
+
+def test_retry_delay_grows_exponentially():
+    policy = RetryPolicy(deadline=100, max_attempts=10, base_delay=1, max_delay=100)
+    assert max(policy.get_retry_delay(1, 0, status_code=503) for _ in range(100)) <= 1
+    assert max(policy.get_retry_delay(4, 0, status_code=503) for _ in range(100)) > 1
+
+
+def test_retry_delay_of_retry_after_seconds():
+    assert RetryPolicy().get_retry_delay(1, 0, status_code=429, retry_after='3') == 3
+
+
+def test_retry_delay_of_retry_after_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=3)
+    delay = RetryPolicy().get_retry_delay(1, 0, status_code=429, retry_after=format_datetime(retry_at, usegmt=True))
+    assert 1 < delay <= 3
+
+
+def test_retry_delay_ignores_invalid_retry_after():
+    delay = RetryPolicy(base_delay=0.5).get_retry_delay(1, 0, status_code=429, retry_after='soon')
+    assert 0 <= delay <= 0.5
+
+
+@pytest.mark.parametrize('status_code', [400, 404, 500, 502, 504])
+def test_no_retry_of_ambiguous_or_client_errors(status_code):
+    assert RetryPolicy().get_retry_delay(1, 0, status_code=status_code) is None
+
+
+@pytest.mark.parametrize('status_code', [500, 502, 504])
+def test_retry_of_ambiguous_errors_if_enabled(status_code):
+    assert RetryPolicy(retry_ambiguous=True).get_retry_delay(1, 0, status_code=status_code) is not None
+
+
+def test_retry_delay_of_errors():
+    request = httpx.Request('POST', 'https://example.com')
+    policy = RetryPolicy()
+    assert policy.get_retry_delay(1, 0, exception=httpx.ConnectError('refused', request=request)) is not None
+    assert policy.get_retry_delay(1, 0, exception=httpx.ConnectTimeout('timeout', request=request)) is not None
+    # the command may have reached the appliance
+    assert policy.get_retry_delay(1, 0, exception=httpx.ReadTimeout('timeout', request=request)) is None
+
+
+def test_no_retry_after_last_attempt():
+    assert RetryPolicy(max_attempts=3).get_retry_delay(3, 0, status_code=503) is None
+
+
+def test_no_retry_after_deadline():
+    policy = RetryPolicy(deadline=8)
+    assert policy.get_retry_delay(1, 0, status_code=429, retry_after='10') is None
+    assert policy.get_retry_delay(1, 7.5, status_code=429, retry_after='1') is None
+    assert policy.get_retry_delay(1, 6, status_code=429, retry_after='1') == 1
+
+
+def test_send_retries_rate_limit_with_retry_after(send):
+    cloud = FaultyCloud((429, {'Retry-After': '0.2'}))
+    start = time.monotonic()
+    assert send(cloud, fast_policy())
+    assert len(cloud.requests) == 2
+    assert time.monotonic() - start >= 0.2
+
+
+def test_send_retries_unavailable(send):
+    cloud = FaultyCloud(503, 503)
+    assert send(cloud, fast_policy())
+    assert len(cloud.requests) == 3
+
+
+def test_send_gives_up_after_max_attempts(send):
+    cloud = FaultyCloud(503, 503, 503)
+    assert not send(cloud, fast_policy())
+    assert len(cloud.requests) == 3
+
+
+@pytest.mark.parametrize('status_code', [500, 502, 504])
+def test_send_does_not_retry_ambiguous_errors(send, status_code):
+    cloud = FaultyCloud(status_code)
+    assert not send(cloud, fast_policy())
+    assert len(cloud.requests) == 1
+
+
+def test_send_retries_ambiguous_errors_if_enabled(send):
+    cloud = FaultyCloud(502)
+    assert send(cloud, fast_policy(retry_ambiguous=True))
+    assert len(cloud.requests) == 2
+
+
+def test_send_does_not_retry_read_timeout(send):
+    cloud = FaultyCloud(httpx.ReadTimeout)
+    with pytest.raises(httpx.ReadTimeout):
+        send(cloud, fast_policy())
+    assert len(cloud.requests) == 1
+
+
+def test_send_retries_connect_error(send):
+    cloud = FaultyCloud(httpx.ConnectError)
+    assert send(cloud, fast_policy())
+    assert len(cloud.requests) == 2
+
+
+def test_send_refreshes_expired_tokens(send):
+    cloud = FaultyCloud(accepted_token='token-2')
+    assert send(cloud, fast_policy())
+    assert cloud.refreshes == 1
+    assert [request.headers['Authorization'] for request in cloud.requests] == ['Bearer token-1', 'Bearer token-2']
+
+
+def test_send_refreshes_tokens_only_once(send):
+    cloud = FaultyCloud(accepted_token='token-3')
+    assert not send(cloud, fast_policy())
+    assert cloud.refreshes == 1
+    assert len(cloud.requests) == 2
+
+
+def test_send_retries_within_deadline(send):
+    cloud = FaultyCloud(*[503] * 100)
+    policy = RetryPolicy(deadline=0.5, max_attempts=100, base_delay=0.05, max_delay=0.1)
+    start = time.monotonic()
+    assert not send(cloud, policy)
+    # the deadline applies to the start of the last attempt, its response may arrive after it
+    assert time.monotonic() - start < policy.deadline + 0.2
+    assert len(cloud.requests) > 2
+
+
+def test_send_gives_up_if_retry_after_exceeds_deadline(send):
+    cloud = FaultyCloud((503, {'Retry-After': '10'}))
+    start = time.monotonic()
+    assert not send(cloud, fast_policy())
+    assert len(cloud.requests) == 1
+    assert time.monotonic() - start < 1
+
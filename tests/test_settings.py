@@ -0,0 +1,47 @@
+import glob
+import json
+import os
+import re
+
+import pytest
+
+from settings import Settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def settings_path(tmp_path):
+    path = tmp_path / 'settings.json'
+    path.write_text(json.dumps({'ADMISSION': {'QUEUE_TIMEOUT': 2}, 'SERVER': {'BIND_PORT': 8000}}))
+    return str(path)
+
+
+def test_fractional_override_of_float_setting(settings_path):
+    settings = Settings(settings_path, {'GROHE__ADMISSION__QUEUE_TIMEOUT': '0.5', 'GROHE__RATE_LIMIT__KEY_RATE': '0.5'})
+    assert settings.get('ADMISSION/QUEUE_TIMEOUT', 2.0) == 0.5
+    assert settings.get('RATE_LIMIT/KEY_RATE', 1.0) == 0.5
+
+
+def test_integer_value_of_float_setting(settings_path):
+    assert Settings(settings_path, {}).get('ADMISSION/QUEUE_TIMEOUT', 2.0) == 2.0
+
+
+def test_fractional_value_of_int_setting_is_rejected(settings_path):
+    settings = Settings(settings_path, {'GROHE__ADMISSION__MAX_QUEUE': '2.5'})
+    with pytest.raises(ValueError, match='ADMISSION/MAX_QUEUE'):
+        settings.get('ADMISSION/MAX_QUEUE', 32)
+    assert Settings(settings_path, {'GROHE__ADMISSION__MAX_QUEUE': '4.0'}).get('ADMISSION/MAX_QUEUE', 32) == 4
+
+
+@pytest.mark.parametrize('value', ['1.50', '1e3', 'true', '[1]'])
+def test_string_override_is_kept(settings_path, value):
+    assert Settings(settings_path, {'GROHE__CREDENTIALS__PASSWORD': value}).get('CREDENTIALS/PASSWORD') == value
+
+
+def test_float_settings_have_float_defaults():
+    # an int default converts the value of the setting to an int
+    pattern = re.compile(r'float\(_\("([A-Z_/]+)", \d+\)\)')
+    for path in glob.glob(os.path.join(ROOT, 'GroheClient', '*.py')):
+        with open(path) as file:
+            assert pattern.findall(file.read()) == [], path
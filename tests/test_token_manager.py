@@ -0,0 +1,49 @@
+import time
+
+from GroheClient import base
+from GroheClient.base import TokenManager
+
+
+def get_tokens(name: str, expires_in: int = 120) -> dict:
+    # the access token expires within REFRESH_AHEAD seconds, so it is due for a refresh at once
+    return {'access_token': f'{name}-access', 'refresh_token': f'{name}-refresh', 'access_token_expires_in': expires_in,
+            'refresh_token_expires_in': 3600}
+
+
+def test_failed_refresh_falls_back_to_login(monkeypatch):
+    logins = []
+    refreshes = []
+
+    def get_initial_tokens():
+        logins.append(time.monotonic())
+        return get_tokens(f'login{len(logins)}')
+
+    def get_refresh_tokens(refresh_token):
+        refreshes.append(refresh_token)
+        raise ValueError('invalid refresh token')
+
+    monkeypatch.setattr(base, 'MIN_REFRESH_INTERVAL', 0.1)
+    monkeypatch.setattr(base, 'get_initial_tokens', get_initial_tokens)
+    monkeypatch.setattr(base, 'get_refresh_tokens', get_refresh_tokens)
+    manager = TokenManager()
+    manager.start()
+    try:
+        time.sleep(0.55)
+    finally:
+        manager.stop()
+
+    # the rejected refresh token is replaced by a new login instead of being retried
+    assert refreshes[:2] == ['login1-refresh', 'login2-refresh']
+    assert manager.get_stats()['relogins'] == len(logins) - 1
+    assert manager.get_stats()['refresh_failures'] == len(refreshes)
+    # the tokens are refreshed at most every MIN_REFRESH_INTERVAL seconds
+    assert 3 <= len(logins) <= 6
+    assert min(b - a for a, b in zip(logins, logins[1:])) >= 0.09
+
+
+def test_refresh_delay(monkeypatch):
+    manager = TokenManager()
+    manager.set_tokens(get_tokens('login', expires_in=3600))
+    assert 3600 - 60 - base.REFRESH_AHEAD - 1 < manager.get_refresh_delay() <= 3600 - 60 - base.REFRESH_AHEAD
+    manager.set_tokens(get_tokens('login', expires_in=10))
+    assert base.MIN_REFRESH_INTERVAL - 1 < manager.get_refresh_delay() <= base.MIN_REFRESH_INTERVAL